@@ -0,0 +1,102 @@
+"""
+Representative models and fixtures for the benchmark suite.
+
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytz
+
+from tinymodel import TinyModel, FieldDef
+from tinymodel.memory_service import InMemoryService
+
+
+class BenchLeafModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int, long]),
+        FieldDef('name', allowed_types=[unicode]),
+        FieldDef('score', allowed_types=[float]),
+        FieldDef('created_at', allowed_types=[datetime]),
+    ]
+
+
+class BenchWideModel(TinyModel):
+    FIELD_DEFS = [FieldDef('id', allowed_types=[int, long])] + \
+                 [FieldDef('int_%d' % x, allowed_types=[int]) for x in range(10)] + \
+                 [FieldDef('str_%d' % x, allowed_types=[unicode]) for x in range(10)] + \
+                 [FieldDef('float_%d' % x, allowed_types=[float]) for x in range(5)] + \
+                 [FieldDef('bool_%d' % x, allowed_types=[bool]) for x in range(5)] + \
+                 [FieldDef('created_at', allowed_types=[datetime]),
+                  FieldDef('price', allowed_types=[Decimal])]
+
+
+class BenchBranchModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int, long]),
+        FieldDef('leaf', allowed_types=[BenchLeafModel], relationship='has_one'),
+        FieldDef('tags', allowed_types=[{unicode: [(int,)]}]),
+    ]
+
+
+class BenchNestedModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int, long]),
+        FieldDef('title', allowed_types=[unicode]),
+        FieldDef('branch', allowed_types=[BenchBranchModel], relationship='has_one'),
+        FieldDef('matrix', allowed_types=[[[float]]]),
+        FieldDef('labels', allowed_types=[{unicode: {unicode: [int]}}]),
+    ]
+
+
+class BenchManyModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int, long]),
+        FieldDef('title', allowed_types=[unicode]),
+        FieldDef('leaves', allowed_types=[[BenchLeafModel]], relationship='has_many'),
+    ]
+
+
+MODEL_CLASSES = [BenchLeafModel, BenchWideModel, BenchBranchModel, BenchNestedModel, BenchManyModel]
+
+CREATED_AT = datetime(2014, 1, 2, 3, 4, 5, tzinfo=pytz.utc)
+
+
+def leaf_kwargs(id=1):
+    return {'id': id, 'name': u'leaf %d' % id, 'score': id * 0.5, 'created_at': CREATED_AT + timedelta(seconds=id)}
+
+
+def wide_kwargs(id=1):
+    kwargs = {'id': id, 'created_at': CREATED_AT, 'price': Decimal('10.05')}
+    kwargs.update(('int_%d' % x, x * id) for x in range(10))
+    kwargs.update(('str_%d' % x, u'value %d' % x) for x in range(10))
+    kwargs.update(('float_%d' % x, x / 3.0) for x in range(5))
+    kwargs.update(('bool_%d' % x, x % 2 == 0) for x in range(5))
+    return kwargs
+
+
+def nested_kwargs(id=1):
+    branch = BenchBranchModel(id=id, leaf=BenchLeafModel(**leaf_kwargs(id)), tags={u'a': [(1, 2), (3,)], u'b': []})
+    return {'id': id, 'title': u'nested', 'branch': branch,
+            'matrix': [[x * 0.5 for x in range(10)] for y in range(10)],
+            'labels': {u'x': {u'y': [1, 2, 3]}, u'z': {}}}
+
+
+def many_kwargs(id=1, count=50):
+    return {'id': id, 'title': u'many', 'leaves': [BenchLeafModel(**leaf_kwargs(x)) for x in range(count)]}
+
+
+class ForeignModel(object):
+
+    """ Stands in for an ORM object, with attributes that match the field titles. """
+
+    def __init__(self, **kwargs):
+        for (key, value) in kwargs.items():
+            setattr(self, key, ForeignModel(**value.to_json(return_raw=True)) if isinstance(value, TinyModel) else value)
+
+
+def memory_service():
+    """
+    Returns an InMemoryService, so that api methods can be benchmarked without the cost of a real storage.
+
+    """
+    return InMemoryService()
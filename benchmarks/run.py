@@ -0,0 +1,402 @@
+"""
+Benchmarks the hot paths of tinymodel.
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --output results.json --compare baseline.json --threshold 0.2
+    python -m benchmarks.run --input results.json --compare baseline.json
+
+Each benchmark reports ops/sec (the best of several timed rounds) and the peak memory growth while it runs,
+in KB of resident memory. Benchmarks run in a forked process each, so that one benchmark's allocations
+do not hide another's. With --compare, the process exits with status 1 if any benchmark got slower, or grew
+its peak memory, by more than the threshold relative to the baseline.
+
+"""
+import Queue
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from tinymodel import compile_all
+from tinymodel.internals import json_cache
+from tinymodel.sqlite_service import SqliteService
+from benchmarks.models import (
+    BenchLeafModel,
+    BenchManyModel,
+    BenchNestedModel,
+    BenchWideModel,
+    ForeignModel,
+    MODEL_CLASSES,
+    leaf_kwargs,
+    many_kwargs,
+    memory_service,
+    nested_kwargs,
+    wide_kwargs,
+)
+
+
+BENCHMARKS = []
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS = (
+    ('wide', BenchWideModel, wide_kwargs),
+    ('nested', BenchNestedModel, nested_kwargs),
+    ('has_many', BenchManyModel, many_kwargs),
+)
+
+
+def benchmark(name):
+    """
+    Registers a benchmark. The decorated function does the setup and returns the operation to time.
+
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+def __register_model_benchmarks(label, cls, make_kwargs):
+    @benchmark(label + '.construct')
+    def construct():
+        kwargs = make_kwargs()
+        return lambda: cls(**kwargs)
+
+    @benchmark(label + '.from_json')
+    def from_json():
+        as_json = cls(**make_kwargs()).to_json()
+        return lambda: cls(from_json=as_json)
+
+    @benchmark(label + '.from_json_lazy')
+    def from_json_lazy():
+        as_json = cls(**make_kwargs()).to_json()
+        return lambda: cls(from_json=as_json, lazy=True)
+
+    def uncached(model, **kwargs):
+        def run():
+            # drop the cached results, so that every field is serialized again
+            json_cache.clear(model)
+            return model.to_json(**kwargs)
+        return run
+
+    @benchmark(label + '.to_json')
+    def to_json():
+        return uncached(cls(**make_kwargs()))
+
+    @benchmark(label + '.to_json_dict')
+    def to_json_dict():
+        return uncached(cls(**make_kwargs()), return_dict=True)
+
+    @benchmark(label + '.to_json_raw')
+    def to_json_raw():
+        return uncached(cls(**make_kwargs()), return_raw=True)
+
+    @benchmark(label + '.to_json_cached')
+    def to_json_cached():
+        model = cls(**make_kwargs())
+        return model.to_json
+
+    @benchmark(label + '.validate')
+    def validate():
+        model = cls(**make_kwargs())
+
+        def run():
+            # drop the memoized results, so that every field is validated again
+            for field in model.FIELDS:
+                field.was_validated = False
+            model.validate()
+        return run
+
+    @benchmark(label + '.random')
+    def random():
+        return lambda: cls(random=True)
+
+    @benchmark(label + '.from_foreign_model')
+    def from_foreign_model():
+        foreign_model = ForeignModel(**make_kwargs())
+        return lambda: cls(from_foreign_model=foreign_model)
+
+    @benchmark(label + '.replace_refs_with_ids')
+    def replace_refs_with_ids():
+        model = cls(**make_kwargs())
+        return model.replace_refs_with_ids
+
+    @benchmark(label + '.to_bytes')
+    def to_bytes():
+        model = cls(**make_kwargs())
+        return model.to_bytes
+
+    @benchmark(label + '.from_bytes')
+    def from_bytes():
+        as_bytes = cls(**make_kwargs()).to_bytes()
+        return lambda: cls.from_bytes(as_bytes)
+
+
+for (label, cls, make_kwargs) in MODELS:
+    __register_model_benchmarks(label, cls, make_kwargs)
+
+
+@benchmark('import.tinymodel')
+def import_tinymodel():
+    # the cost of python -c "import tinymodel", interpreter startup included, as paid by CLI tools and short-lived workers
+    command = [sys.executable, '-c', 'import tinymodel']
+    return lambda: subprocess.check_call(command, cwd=PACKAGE_DIR)
+
+
+def __populated_service(count=100):
+    service = memory_service()
+    for x in range(count):
+        BenchLeafModel.create(service, **leaf_kwargs(x + 1))
+    return service
+
+
+@benchmark('api.find')
+def api_find():
+    service = __populated_service()
+    return lambda: BenchLeafModel.find(service, name=u'leaf 50')
+
+
+@benchmark('api.find_projection')
+def api_find_projection():
+    service = __populated_service()
+    return lambda: BenchLeafModel.find(service, limit=20, only=['name'])
+
+
+@benchmark('api.create')
+def api_create():
+    service = memory_service()
+    kwargs = leaf_kwargs()
+    del kwargs['id']
+    return lambda: BenchLeafModel.create(service, **kwargs)
+
+
+@benchmark('api.update')
+def api_update():
+    service = __populated_service()
+    return lambda: BenchLeafModel.update(service, id=10, name=u'updated')
+
+
+@benchmark('api.delete')
+def api_delete():
+    service = __populated_service()
+    return lambda: BenchLeafModel.delete(service, name=u'no such leaf')
+
+
+@benchmark('api.get_or_create')
+def api_get_or_create():
+    service = __populated_service()
+    return lambda: BenchLeafModel.get_or_create(service, name=u'leaf 10')
+
+
+@benchmark('api.create_or_update_by')
+def api_create_or_update_by():
+    service = __populated_service()
+    return lambda: BenchLeafModel.create_or_update_by(service, by=['name'], name=u'leaf 10', score=1.5)
+
+
+@benchmark('api.sum')
+def api_sum():
+    service = __populated_service()
+    return lambda: BenchLeafModel.sum(service, return_fields=['score'])
+
+
+LARGE_TABLE_ROWS = 100000
+
+
+def __large_service():
+    """ Returns a service with LARGE_TABLE_ROWS leaves, written directly to the storage to keep the setup fast. """
+    service = memory_service()
+    service.create_many(endpoint_name='bench_leaf_model', records=[leaf_kwargs(x + 1) for x in xrange(LARGE_TABLE_ROWS)])
+    return service
+
+
+@benchmark('large.find_equal')
+def large_find_equal():
+    service = __large_service()
+    return lambda: BenchLeafModel.find(service, name=u'leaf 5000')
+
+
+@benchmark('large.find_range')
+def large_find_range():
+    service = __large_service()
+    return lambda: BenchLeafModel.find(service, id={'gte': 5000, 'lt': 5020})
+
+
+@benchmark('large.find_ordered')
+def large_find_ordered():
+    service = __large_service()
+    return lambda: BenchLeafModel.find(service, order_by={'score': 'descending'}, offset=100, limit=20)
+
+
+def __sqlite_service(count=0):
+    service = SqliteService(':memory:', [BenchLeafModel], indexes={'bench_leaf_model': ['name', 'score']})
+    service.create_many(endpoint_name='bench_leaf_model', records=[leaf_kwargs(x + 1) for x in xrange(count)])
+    return service
+
+
+@benchmark('sqlite.find_range')
+def sqlite_find_range():
+    service = __sqlite_service(LARGE_TABLE_ROWS)
+    return lambda: BenchLeafModel.find(service, id={'gte': 5000, 'lt': 5020}, order_by={'id': 'descending'})
+
+
+@benchmark('sqlite.create_many')
+def sqlite_create_many():
+    service = __sqlite_service()
+    records = [leaf_kwargs(x + 1) for x in xrange(100)]
+    for record in records:
+        del record['id']
+    return lambda: BenchLeafModel.create_many(service, records)
+
+
+def __peak_memory_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X, and in KB elsewhere
+    return peak / 1024 if sys.platform == 'darwin' else peak
+
+
+def __time_operation(operation, min_time, rounds):
+    """ Returns the best ops/sec over the given number of rounds, each running for at least min_time seconds. """
+    best = 0.0
+    iterations = 1
+    for x in range(rounds):
+        while True:
+            started_at = time.time()
+            for y in xrange(iterations):
+                operation()
+            elapsed = time.time() - started_at
+            if elapsed >= min_time:
+                break
+            iterations = max(iterations * 2, int(iterations * min_time / max(elapsed, 1e-6)))
+        best = max(best, iterations / elapsed)
+    return best
+
+
+def __run_in_child(setup, min_time, rounds, queue):
+    try:
+        memory_before = __peak_memory_kb()
+        operation = setup()
+        operation()
+        ops_per_sec = __time_operation(operation, min_time, rounds)
+        queue.put({'ops_per_sec': ops_per_sec, 'peak_memory_kb': __peak_memory_kb() - memory_before})
+    except Exception as e:
+        queue.put({'error': '%s: %s' % (type(e).__name__, e)})
+
+
+def __wait_for_result(name, process, queue, timeout):
+    """
+    Returns the result that a forked benchmark puts on the queue, without waiting forever for a process that died.
+
+    :raises Exception: if the process exits without a result, or runs for longer than timeout seconds
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return queue.get(timeout=1.0)
+        except Queue.Empty:
+            if process.exitcode is not None:
+                # the result can still be in the pipe when the process exits
+                try:
+                    return queue.get(timeout=1.0)
+                except Queue.Empty:
+                    raise Exception("Benchmark " + name + " crashed with exit code " + str(process.exitcode))
+            if time.time() > deadline:
+                process.terminate()
+                process.join()
+                raise Exception("Benchmark " + name + " timed out after " + str(timeout) + " seconds")
+
+
+def run_benchmarks(names=None, min_time=0.2, rounds=3, isolate=True, timeout=600.0):
+    """
+    Runs the registered benchmarks.
+
+    :param list(str) names: Only run the benchmarks whose name contains one of these strings. Defaults to all of them.
+    :param float min_time: The minimum duration of a timed round, in seconds
+    :param int rounds: The number of timed rounds. The best one is reported.
+    :param bool isolate: If True, every benchmark runs in a forked process
+    :param float timeout: The time a forked benchmark may run, in seconds
+
+    :rtype dict: Maps benchmark names to their results
+    :raises Exception: if any benchmark fails, crashes or times out
+
+    """
+    compile_all(classes=MODEL_CLASSES)
+    results = {}
+    for (name, setup) in BENCHMARKS:
+        if names and not any(n in name for n in names):
+            continue
+        queue = multiprocessing.Queue()
+        if isolate:
+            process = multiprocessing.Process(target=__run_in_child, args=(setup, min_time, rounds, queue))
+            process.start()
+            result = __wait_for_result(name, process, queue, timeout)
+            process.join()
+        else:
+            __run_in_child(setup, min_time, rounds, queue)
+            result = queue.get(timeout=timeout)
+        if 'error' in result:
+            raise Exception("Benchmark " + name + " failed with " + result['error'])
+        results[name] = result
+    return results
+
+
+def compare(baseline, results, threshold=0.2):
+    """
+    Compares benchmark results to a baseline.
+
+    :param dict baseline: Results of an earlier run, as returned by run_benchmarks
+    :param dict results: Results of the current run
+    :param float threshold: The tolerated relative regression, e.g. 0.2 for 20%
+
+    :rtype list(str): A description of each regression past the threshold. Benchmarks missing from either side are skipped.
+
+    """
+    regressions = []
+    for name in sorted(set(baseline) & set(results)):
+        before, after = baseline[name], results[name]
+        if after['ops_per_sec'] < before['ops_per_sec'] * (1 - threshold):
+            regressions.append('%s: %.1f ops/sec, down from %.1f' % (name, after['ops_per_sec'], before['ops_per_sec']))
+        # small absolute changes are noise from the allocator and the page size
+        if after['peak_memory_kb'] > max(before['peak_memory_kb'] * (1 + threshold), before['peak_memory_kb'] + 1024):
+            regressions.append('%s: %d KB peak memory, up from %d' % (name, after['peak_memory_kb'], before['peak_memory_kb']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths of tinymodel.")
+    parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    parser.add_argument('--input', help="compare the results in this JSON file instead of running the benchmarks")
+    parser.add_argument('--compare', metavar='BASELINE', help="fail if the results regress relative to this JSON file")
+    parser.add_argument('--threshold', type=float, default=0.2, help="the tolerated relative regression (default: 0.2)")
+    parser.add_argument('--min-time', type=float, default=0.2, help="the minimum duration of a timed round, in seconds")
+    parser.add_argument('--rounds', type=int, default=3, help="the number of timed rounds per benchmark")
+    parser.add_argument('--timeout', type=float, default=600.0, help="the time a benchmark may run, in seconds")
+    parser.add_argument('names', nargs='*', help="only run the benchmarks whose name contains one of these")
+    args = parser.parse_args(argv)
+
+    if args.input:
+        with open(args.input) as fp:
+            results = json.load(fp)
+    else:
+        results = run_benchmarks(args.names, min_time=args.min_time, rounds=args.rounds, timeout=args.timeout)
+        for name in sorted(results):
+            print '%-40s %12.1f ops/sec %8d KB' % (name, results[name]['ops_per_sec'], results[name]['peak_memory_kb'])
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            regressions = compare(json.load(fp), results, args.threshold)
+        for regression in regressions:
+            print 'REGRESSION ' + regression
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
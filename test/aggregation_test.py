@@ -0,0 +1,99 @@
+from datetime import datetime
+from decimal import Decimal
+from unittest import TestCase
+
+import pytz
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_raises, eq_
+
+from tinymodel import TinyModel, FieldDef
+from tinymodel.internals.aggregation import Aggregator, get_numpy
+from tinymodel.memory_service import InMemoryService
+from tinymodel.sqlite_service import SqliteService
+from tinymodel.utils import ValidationError
+
+
+class MyAggregatedModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int, long]),
+        FieldDef('country', allowed_types=[unicode]),
+        FieldDef('views', allowed_types=[int]),
+        FieldDef('score', allowed_types=[float]),
+        FieldDef('price', allowed_types=[Decimal]),
+        FieldDef('seen_at', allowed_types=[datetime]),
+    ]
+
+
+class MyAggregateFieldModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int, long]),
+        FieldDef('aggregate', allowed_types=[unicode]),
+    ]
+
+
+RECORDS = [
+    {'country': u'FR', 'views': 10, 'score': 0.5, 'price': Decimal('1.10'), 'seen_at': datetime(2014, 1, 1, tzinfo=pytz.utc)},
+    {'country': u'FR', 'views': 30, 'score': 1.5, 'price': Decimal('2.20'), 'seen_at': datetime(2014, 1, 3, tzinfo=pytz.utc)},
+    {'country': u'US', 'views': 5, 'price': Decimal('3.30'), 'seen_at': datetime(2014, 1, 2, tzinfo=pytz.utc)},
+    {'country': u'US', 'views': 7, 'score': 2.0},
+    {'views': 1},
+]
+METRICS = {'views': 'sum', 'score': 'avg', 'price': 'sum', 'seen_at': 'max', 'id': 'count'}
+EXPECTED = [
+    {'country': None, 'views': 1, 'score': None, 'price': None, 'seen_at': None, 'id': 1},
+    {'country': u'FR', 'views': 40, 'score': 1.0, 'price': Decimal('3.30'), 'seen_at': datetime(2014, 1, 3, tzinfo=pytz.utc), 'id': 2},
+    {'country': u'US', 'views': 12, 'score': 2.0, 'price': Decimal('3.30'), 'seen_at': datetime(2014, 1, 2, tzinfo=pytz.utc), 'id': 2},
+]
+
+
+class AggregationTest(TestCase):
+    def check_aggregator(self, use_numpy):
+        aggregator = Aggregator(['country'], {'views': 'max', 'score': 'min', 'price': 'avg', 'total': 'sum', 'average': 'avg'},
+                                {'views': 'int', 'score': 'float', 'price': 'decimal', 'total': 'int', 'average': 'float'},
+                                use_numpy=use_numpy)
+        aggregator.add([{'country': u'FR', 'views': 3, 'score': 1.5, 'price': '1.5', 'total': 2 ** 62, 'average': 1.0},
+                        {'country': u'US', 'views': 4}])
+        aggregator.add([{'country': u'FR', 'views': 2 ** 64, 'score': 0.5, 'price': 2.5, 'total': 2 ** 62, 'average': 2}])
+        # int sums and extremes are exact, past the range of 64-bit ints
+        eq_(aggregator.results(), [{'country': u'FR', 'views': 2 ** 64, 'score': 0.5, 'price': Decimal('2'), 'total': 2 ** 63, 'average': 1.5},
+                                   {'country': u'US', 'views': 4, 'score': None, 'price': None, 'total': None, 'average': None}])
+
+    def test_aggregator(self):
+        self.check_aggregator(use_numpy=False)
+        eq_(Aggregator([], {'views': 'count', 'score': 'sum'}, {}).results(), [{'views': 0, 'score': None}])
+
+    def test_aggregator_numpy(self):
+        if get_numpy() is None:
+            raise SkipTest('NumPy is not installed')
+        self.check_aggregator(use_numpy=True)
+
+    def test_client_aggregation(self):
+        service = InMemoryService()
+        MyAggregatedModel.create_many(service, RECORDS)
+        eq_(MyAggregatedModel.aggregate(service, group_by=['country'], metrics=METRICS, page_size=2), EXPECTED)
+        eq_(MyAggregatedModel.aggregate(service, metrics={'views': 'max'}, country=u'FR'), [{'views': 30}])
+
+    def test_pushdown(self):
+        service = SqliteService(':memory:', [MyAggregatedModel])
+        MyAggregatedModel.create_many(service, RECORDS)
+        eq_(MyAggregatedModel.aggregate(service, group_by=['country'], metrics=METRICS), EXPECTED)
+        eq_(MyAggregatedModel.aggregate(service, metrics={'views': 'max'}, country=u'FR'), [{'views': 30}])
+        service.close()
+
+    def test_validation(self):
+        service = InMemoryService()
+        assert_raises(ValidationError, MyAggregatedModel.aggregate, service, metrics={})
+        assert_raises(ValidationError, MyAggregatedModel.aggregate, service, metrics={'views': 'median'})
+        assert_raises(ValidationError, MyAggregatedModel.aggregate, service, metrics={'country': 'sum'})
+        assert_raises(ValidationError, MyAggregatedModel.aggregate, service, group_by=['nope'], metrics={'views': 'sum'})
+
+    def test_aggregate_field(self):
+        # a field named aggregate is read and serialized like any other field, and the method stays on the class
+        model = MyAggregateFieldModel(id=1, aggregate=u'total')
+        eq_(model.aggregate, u'total')
+        eq_(model.to_json(return_dict=True), {'id': 1, 'aggregate': u'total'})
+        assert_raises(AttributeError, getattr, MyAggregateFieldModel(id=1), 'aggregate')
+        service = InMemoryService()
+        MyAggregateFieldModel.create_many(service, [{'aggregate': u'a'}, {'aggregate': u'a'}, {'aggregate': u'b'}])
+        eq_(MyAggregateFieldModel.aggregate(service, group_by=['aggregate'], metrics={'id': 'count'}),
+            [{'aggregate': u'a', 'id': 2}, {'aggregate': u'b', 'id': 1}])
@@ -7,8 +7,9 @@ from caliendo.patch import patch
 from nose.tools import assert_raises, ok_, eq_
 
 from tinymodel import TinyModel, FieldDef, api, defaults
+from tinymodel.memory_service import InMemoryService
 from tinymodel.service import Service
-from tinymodel.utils import ModelException
+from tinymodel.utils import ModelException, UnloadedFieldError, ValidationError
 
 
 def ServiceMock(return_type='foreign_model'):
@@ -48,6 +49,31 @@ class MyOtherModel(TinyModel):
     ]
 
 
+class MyTrackedModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[long, int]),
+        FieldDef('name', allowed_types=[unicode]),
+        FieldDef('size', allowed_types=[int]),
+        FieldDef('tags', allowed_types=[[unicode]]),
+    ]
+
+
+class MyStatModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[long, int]),
+        FieldDef('count', allowed_types=[int]),
+        FieldDef('exists', allowed_types=[bool]),
+    ]
+
+
+class MyDraftModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[long, int]),
+        FieldDef('save', allowed_types=[unicode]),
+        FieldDef('changes', allowed_types=[int]),
+    ]
+
+
 class MyForeignModel(object):
     def __init__(self, *args, **kwargs):
         [setattr(self, k, v) for k, v in kwargs.iteritems()]
@@ -237,8 +263,229 @@ class APiTest(TestCase):
         result, created = MyTinyModel.create_or_update_by(service, by=['id'], **params)
         ok_(not created)
 
+    def test_create_or_update_by_projection(self):
+        calls = []
+
+        def find(**kwargs):
+            calls.append(kwargs)
+            return [json.dumps({'id': 1})]
+        update = lambda **kwargs: json.dumps({'id': 1, 'my_float': kwargs['my_float']})
+        # services without projection support get the same find call as ever
+        MyOtherModel.create_or_update_by(Service(return_type='json', find=find, update=update), by=['id'], id=1, my_float=0.5)
+        eq_((calls[-1]['limit'], 'only' in calls[-1]), (None, False))
+        service = Service(return_type='json', supports_projection=True, find=find, update=update)
+        model, created = MyOtherModel.create_or_update_by(service, by=['id'], id=1, my_float=0.5)
+        eq_((calls[-1]['limit'], calls[-1]['only']), (1, ['id']))
+        eq_((model.my_float, created), (0.5, False))
+
     def test_create_or_update_fails(self):
         service = ServiceMock()
         assert_raises(ValueError, MyTinyModel.create_or_update_by, service, by=['id'])
         assert_raises(ValueError, MyTinyModel.create_or_update_by, service, by=[], **{'name': 'test'})
         assert_raises(ValueError, MyTinyModel.create_or_update_by, service, by=['id'], **{'name': 'test'})
+
+    def test_projection(self):
+        calls = []
+
+        def find(**kwargs):
+            calls.append(kwargs)
+            return [json.dumps({'my_int': 1, 'my_str': 'foo'})]
+
+        service = Service(return_type='json', find=find, update=find, create=lambda **kwargs: json.dumps({'my_int': 2, 'my_bool': True}))
+        found = MyTinyModel.find(service, only=['my_int', 'my_str', 'my_calculated_value'])
+        eq_(calls[-1]['only'], ['my_int', 'my_str'])
+        eq_(found[0].my_int, 1)
+        ok_(found[0].my_calculated_value)
+        assert_raises(UnloadedFieldError, getattr, found[0], 'my_bool')
+        assert_raises(AttributeError, getattr, found[0], 'my_bool')
+        eq_(found[0].to_json(return_dict=True), {'my_int': 1, 'my_str': 'foo', 'my_calculated_value': True})
+
+        MyTinyModel.find(service, exclude=['my_m2m', 'my_datetime'])
+        ok_('my_m2m' not in calls[-1]['only'] and 'my_int' in calls[-1]['only'])
+        MyOtherModel.find(service, only=['my_float'])
+        eq_(calls[-1]['only'], ['id', 'my_float'])
+        MyTinyModel.find(service)
+        ok_('only' not in calls[-1])
+        assert_raises(ValidationError, MyTinyModel.find, service, only=['foo'])
+
+        updated = MyTinyModel.update(service, only=['my_int'], my_int=1)
+        eq_(calls[-1]['only'], ['my_int'])
+        assert_raises(UnloadedFieldError, getattr, updated[0], 'my_str')
+
+        found, created = MyTinyModel.get_or_create(service, only=['my_int'], my_int=1)
+        ok_(not created)
+        eq_(calls[-1]['only'], ['my_int'])
+
+        model = MyTinyModel(my_int=1, my_str='foo', my_bool=False)
+        eq_(model.to_json(return_dict=True, only=['my_int']), {'my_int': 1})
+        eq_(model.to_json(return_raw=True, exclude=['my_int', 'my_calculated_value']), {'my_str': 'foo', 'my_bool': False})
+        assert_raises(ValidationError, model.to_json, only=['foo'])
+
+    def test_projection_of_service_models(self):
+        # the models a tinymodel service returns are its own, e.g. cached, and are projected as copies
+        cached = MyTrackedModel(id=1, name=u'Orca', size=8)
+        service = Service(return_type='tinymodel', find=lambda **kwargs: [cached])
+        found = MyTrackedModel.find(service, only=['name'])[0]
+        ok_(found is not cached)
+        eq_(found.name, u'Orca')
+        assert_raises(UnloadedFieldError, getattr, found, 'size')
+        eq_((cached.size, cached.LOADED_FIELDS), (8, None))
+        eq_(cached.to_json(return_dict=True), {'id': 1, 'name': u'Orca', 'size': 8})
+
+    def test_create_many(self):
+        created = []
+        service = Service(return_type='json', create=lambda **kwargs: created.append(kwargs) or json.dumps({'id': kwargs['id']}))
+        models = MyOtherModel.create_many(service, [{'id': 1}, {'id': 2, 'my_float': 0.5}])
+        eq_([m.id for m in models], [1, 2])
+        eq_([kwargs['endpoint_name'] for kwargs in created], ['my_other_model'] * 2)
+
+        bulk_service = Service(return_type='json', create_many=lambda endpoint_name, records: [json.dumps(r) for r in records])
+        models = MyOtherModel.create_many(bulk_service, [{'id': 1}, {'id': 2}])
+        eq_([m.id for m in models], [1, 2])
+        eq_(MyOtherModel.create_many(bulk_service, []), [])
+        assert_raises(ValidationError, MyOtherModel.create_many, bulk_service, [{'id': 'foo'}])
+
+    def test_count_and_exists(self):
+        calls = []
+
+        def find(**kwargs):
+            calls.append(kwargs)
+            return [json.dumps({'id': x}) for x in range(kwargs['offset'], 25)][:kwargs['limit']]
+        service = Service(return_type='json', find=find)
+        eq_(MyTinyModel.count(service, my_str='foo', my_float=1.5, page_size=10), 25)
+        eq_([(kwargs['offset'], 'only' in kwargs, 'my_float' in kwargs) for kwargs in calls], [(0, False, False), (10, False, False), (20, False, False)])
+        eq_(MyOtherModel.exists(service, my_float=1.5), True)
+        eq_((calls[-1]['limit'], 'only' in calls[-1]), (1, False))
+        assert_raises(ValidationError, MyTinyModel.exists, service, my_int='foo')
+
+        # only the ids are fetched from services that support projections
+        projecting_service = Service(return_type='json', supports_projection=True, find=find)
+        eq_(MyOtherModel.count(projecting_service, page_size=10), 25)
+        eq_(calls[-1]['only'], ['id'])
+        eq_(MyOtherModel.exists(projecting_service), True)
+        eq_((calls[-1]['limit'], calls[-1]['only']), (1, ['id']))
+
+        counting_service = Service(return_type='json', find=find, count=lambda **kwargs: '0')
+        eq_(MyOtherModel.count(counting_service), 0)
+        eq_(MyOtherModel.exists(counting_service), False)
+
+    def test_count_and_exists_fields(self):
+        # fields named count or exists are read and serialized like any other field
+        stat = MyStatModel(id=1, count=5, exists=True)
+        eq_((stat.count, stat.exists), (5, True))
+        eq_(stat.to_json(return_dict=True), {'id': 1, 'count': 5, 'exists': True})
+        ok_(not hasattr(MyStatModel(id=2), 'count'))
+        service = InMemoryService()
+        MyStatModel.create_many(service, [{'count': 5}, {'count': 6}])
+        eq_(MyStatModel.find(service, id=2)[0].count, 6)
+        eq_((MyStatModel.count(service, count={'gte': 6}), MyStatModel.exists(service, count=7)), (1, False))
+
+    def test_upsert(self):
+        calls = []
+        service = InMemoryService(middlewares=[lambda name, call, **kwargs: (name == 'upsert' and calls.append(kwargs)) or call(**kwargs)])
+        model, created = MyOtherModel.create_or_update_by(service, by=['id'], id=1, my_float=0.5)
+        eq_((model.id, model.my_float, created), (1, 0.5, True))
+        model, created = MyOtherModel.create_or_update_by(service, by=['id'], id=1, my_float=1.5)
+        eq_((model.my_float, created), (1.5, False))
+        model, created = MyOtherModel.get_or_create(service, id=1, my_float=2.5)
+        eq_((model.my_float, created), (1.5, False))
+        eq_([(kwargs['by'], kwargs['update']) for kwargs in calls], [(['id'], True), (['id'], True), (['id'], False)])
+
+        results = MyOtherModel.create_or_update_many_by(service, [{'id': 1, 'my_float': 3.5}, {'id': 2}], by=['id'])
+        eq_([(model.id, created) for (model, created) in results], [(1, False), (2, True)])
+        eq_(MyOtherModel.find(service, id=1)[0].my_float, 3.5)
+
+    def test_create_or_update_many_by(self):
+        service = InMemoryService()
+        MyOtherModel.create_many(service, [{'id': 1, 'my_float': 0.5}, {'id': 2, 'my_float': 0.5}])
+        calls = []
+        fallback_service = Service(return_type='json', middlewares=[lambda name, call, **kwargs: calls.append(name) or call(**kwargs)],
+                                   find=service.find, create_many=service.create_many, update=service.update)
+        results = MyOtherModel.create_or_update_many_by(fallback_service, [
+            {'id': 1, 'my_float': 1.5},
+            {'id': 3, 'my_float': 1.5},
+            {'id': 2},
+            {'id': 1, 'my_float': 2.5},
+        ], by=['id'])
+        eq_([(model.id, created) for (model, created) in results], [(1, False), (3, True), (2, False), (1, False)])
+        # the existing records are looked up in one find, and come back whole
+        eq_(sorted(calls), ['create_many', 'find', 'update'])
+        eq_(results[2][0].my_float, 0.5)
+        eq_([model.my_float for model in MyOtherModel.find(service, order_by={'id': 'ascending'})], [2.5, 0.5, 1.5])
+
+        # the find is paged, and records are matched on the values of every by field
+        calls[:] = []
+        results = MyOtherModel.create_or_update_many_by(fallback_service, [
+            {'id': 3, 'my_float': 1.5},
+            {'id': 4, 'my_float': 1.5},
+            {'id': 2, 'my_float': 0.5},
+        ], by=['id', 'my_float'], page_size=1)
+        eq_([(model.id, model.my_float, created) for (model, created) in results], [(3, 1.5, False), (4, 1.5, True), (2, 0.5, False)])
+        eq_(sorted(calls), ['create_many', 'find', 'find', 'find'])
+
+        # keys that cannot be filtered on together are looked up one find each, which only fetch their own record
+        MyTrackedModel.create_many(service, [{'name': u'name %d' % x, 'size': x} for x in range(200)])
+        fetched = []
+        counting_service = Service(return_type='json', find=lambda **kwargs: fetched.append(service.find(**kwargs)) or fetched[-1],
+                                   create_many=service.create_many, update=service.update)
+        results = MyTrackedModel.create_or_update_many_by(counting_service, [{'name': u'name 3', 'size': 30}, {'name': u'new'}], by=['name'])
+        eq_([(model.name, created) for (model, created) in results], [(u'name 3', False), (u'new', True)])
+        eq_(MyTrackedModel.find(service, name=u'name 3')[0].size, 30)
+        eq_((len(fetched), sum(len(page) for page in fetched)), (2, 1))
+        assert_raises(ValueError, MyOtherModel.create_or_update_many_by, service, [{'my_float': 1.5}], by=['id'])
+
+    def test_changes_and_save(self):
+        calls = []
+        memory_service = InMemoryService()
+        service = Service(return_type='json', middlewares=[lambda method_name, call, **kwargs: calls.append((method_name, kwargs)) or call(**kwargs)],
+                          find=memory_service.find, create=memory_service.create, update=memory_service.update)
+        model = MyTrackedModel(name=u'Orca', size=8, tags=[u'fast'])
+        eq_(model.changes()['name'], (None, u'Orca'))
+        eq_(model.save(service).id, 1)
+        eq_(model.changes(), {})
+
+        found = MyTrackedModel.find(service, id=1)[0]
+        eq_(found.changes(), {})
+        found.size = 9
+        found.tags.append(u'smart')
+        del found.name
+        eq_(found.changes(), {'size': (8, 9), 'tags': ([u'fast'], [u'fast', u'smart']), 'name': (u'Orca', None)})
+        found.save(service)
+        eq_(calls[-1], ('update', {'endpoint_name': 'my_tracked_model', 'id': 1, 'size': 9, 'tags': [u'fast', u'smart']}))
+        eq_(found.changes(), {})
+        found.save(service)
+        eq_(calls[-1][0], 'update')
+        eq_(len(calls), 3)
+
+        # setting a field back to its original value is not a change, and lazy fields are compared once translated
+        lazy = MyTrackedModel(from_json=memory_service.find(endpoint_name='my_tracked_model', id=1)[0], lazy=True).mark_clean()
+        lazy.size = 10
+        lazy.size = 9
+        eq_(lazy.tags, [u'fast', u'smart'])
+        eq_(lazy.changes(), {})
+        lazy.tags = [u'slow']
+        eq_(lazy.changes(), {'tags': ([u'fast', u'smart'], [u'slow'])})
+
+    def test_change_tracking_fields(self):
+        # fields named save or changes are read and serialized like any other field
+        draft = MyDraftModel(id=1, save=u'slot 1', changes=3)
+        eq_((draft.save, draft.changes), (u'slot 1', 3))
+        eq_(draft.to_json(return_dict=True), {'id': 1, 'save': u'slot 1', 'changes': 3})
+        service = InMemoryService()
+        MyDraftModel.create_many(service, [{'id': 1, 'save': u'slot 1', 'changes': 3}])
+        found = MyDraftModel.find(service, id=1)[0]
+        found.changes = 4
+        eq_([model.id for model in MyDraftModel.update_changed(service, [found])], [1])
+        eq_(MyDraftModel.find(service, id=1)[0].changes, 4)
+
+    def test_update_changed(self):
+        service = InMemoryService()
+        MyTrackedModel.create_many(service, [{'name': u'Orca', 'size': 8}, {'name': u'Shark', 'size': 5}, {'name': u'Seal', 'size': 2}])
+        models = MyTrackedModel.find(service, order_by={'id': 'ascending'})
+        models[0].size = 9
+        models[2].name = u'Walrus'
+        eq_([model.id for model in MyTrackedModel.update_changed(service, models)], [1, 3])
+        eq_([(model.name, model.size) for model in MyTrackedModel.find(service, order_by={'id': 'ascending'})],
+            [(u'Orca', 9), (u'Shark', 5), (u'Walrus', 2)])
+        eq_(MyTrackedModel.update_changed(service, models), [])
+        assert_raises(ValueError, MyTrackedModel.update_changed, service, [MyTrackedModel(size=1)])
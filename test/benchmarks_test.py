@@ -0,0 +1,39 @@
+import os
+import time
+from unittest import TestCase
+
+from nose.tools import assert_raises, eq_, ok_
+
+from benchmarks.run import BENCHMARKS, compare, run_benchmarks
+
+
+class BenchmarksTest(TestCase):
+    def test_run_benchmarks(self):
+        results = run_benchmarks(names=['wide.to_json_raw', 'api.find', 'import.'], min_time=0.001, rounds=1, isolate=False)
+        eq_(sorted(results), ['api.find', 'api.find_projection', 'import.tinymodel', 'wide.to_json_raw'])
+        for result in results.values():
+            ok_(result['ops_per_sec'] > 0)
+
+    def test_failed_benchmarks(self):
+        # a crashed or stuck process fails the run instead of hanging it
+        BENCHMARKS.append(('test.crash', lambda: os._exit(1)))
+        BENCHMARKS.append(('test.stuck', lambda: time.sleep(30)))
+        try:
+            with assert_raises(Exception) as context:
+                run_benchmarks(names=['test.crash'], min_time=0.001, rounds=1)
+            eq_(str(context.exception), 'Benchmark test.crash crashed with exit code 1')
+            with assert_raises(Exception) as context:
+                run_benchmarks(names=['test.stuck'], min_time=0.001, rounds=1, timeout=0.5)
+            eq_(str(context.exception), 'Benchmark test.stuck timed out after 0.5 seconds')
+        finally:
+            del BENCHMARKS[-2:]
+
+    def test_compare(self):
+        baseline = {'a': {'ops_per_sec': 100.0, 'peak_memory_kb': 4096},
+                    'b': {'ops_per_sec': 100.0, 'peak_memory_kb': 100},
+                    'c': {'ops_per_sec': 100.0, 'peak_memory_kb': 100}}
+        results = {'a': {'ops_per_sec': 85.0, 'peak_memory_kb': 6000},
+                   'b': {'ops_per_sec': 150.0, 'peak_memory_kb': 500},
+                   'd': {'ops_per_sec': 1.0, 'peak_memory_kb': 0}}
+        eq_(compare(baseline, results, threshold=0.2), ['a: 6000 KB peak memory, up from 4096'])
+        eq_(len(compare(baseline, results, threshold=0.1)), 2)
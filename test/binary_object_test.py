@@ -0,0 +1,98 @@
+from datetime import datetime
+from decimal import Decimal
+from unittest import TestCase
+
+import pytz
+from nose.tools import assert_raises, eq_, ok_
+
+from tinymodel import TinyModel, FieldDef
+from tinymodel.internals.binary_object import schema_fingerprint
+from tinymodel.utils import ModelException
+from test.model_internals_test import MyJSONTranslatableModel, MyValidTestModel
+
+
+class MyBinaryChildModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int, long]),
+        FieldDef('name', allowed_types=[unicode]),
+        FieldDef('created_at', allowed_types=[datetime]),
+    ]
+
+
+class MyBinaryModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[long]),
+        FieldDef('my_float', allowed_types=[float]),
+        FieldDef('my_decimal', allowed_types=[Decimal]),
+        FieldDef('my_bool', allowed_types=[bool]),
+        FieldDef('my_none', allowed_types=[type(None)]),
+        FieldDef('my_nested', allowed_types=[{str: [(int,)]}]),
+        FieldDef('my_set', allowed_types=[set([str])]),
+        FieldDef('my_child', allowed_types=[MyBinaryChildModel], relationship='has_one'),
+        FieldDef('my_children', allowed_types=[[MyBinaryChildModel]], relationship='has_many'),
+    ]
+
+
+class BinaryObjectTest(TestCase):
+    def setUp(self):
+        self.child = MyBinaryChildModel(id=1, name=u'caf\xe9', created_at=datetime(2014, 1, 2, 3, 4, 5, 6, tzinfo=pytz.utc))
+        self.other_child = MyBinaryChildModel(id=-20, name=u'', created_at=datetime(1950, 6, 7, 8, 9, 10))
+        self.model = MyBinaryModel(id=2L ** 40, my_float=-1.25, my_decimal=Decimal('10.05'), my_bool=False, my_none=None,
+                                   my_nested={'a': [(1, -2), ()], 'b': []}, my_set={'x', 'y'},
+                                   my_child=self.child, my_children=[self.child, self.other_child])
+
+    def test_round_trip(self):
+        decoded = MyBinaryModel.from_bytes(self.model.to_bytes())
+        decoded.validate()
+        eq_(decoded.to_json(return_dict=True), self.model.to_json(return_dict=True))
+        eq_(type(decoded.id), long)
+        eq_(decoded.my_decimal, Decimal('10.05'))
+        eq_(decoded.my_nested, {'a': [(1, -2), ()], 'b': []})
+        eq_(decoded.my_set, {'x', 'y'})
+        eq_(decoded.my_child.created_at, self.child.created_at)
+        eq_(decoded.my_child.created_at.tzinfo.utcoffset(None).total_seconds(), 0)
+        eq_(decoded.my_children[1].created_at, self.other_child.created_at)
+        ok_(decoded.my_children[1].created_at.tzinfo is None)
+        eq_(decoded.my_children[0].name, u'caf\xe9')
+
+    def test_missing_fields_and_offsets(self):
+        eastern = pytz.FixedOffset(-300)
+        child = MyBinaryChildModel(id=3, created_at=datetime(2014, 1, 2, 3, 4, 5, tzinfo=eastern))
+        decoded = MyBinaryChildModel.from_bytes(child.to_bytes())
+        ok_(not hasattr(decoded, 'name'))
+        eq_(decoded.created_at, child.created_at)
+        eq_(decoded.created_at.utcoffset(), child.created_at.utcoffset())
+
+    def test_ids_in_relationship_fields(self):
+        model = MyBinaryModel(my_child_id=5, my_child_ids=[1, 2])
+        decoded = MyBinaryModel.from_bytes(model.to_bytes())
+        eq_(decoded.my_child, 5)
+        eq_(decoded.my_children, [1, 2])
+
+    def test_user_defined_types(self):
+        model = MyValidTestModel(random=True)
+        decoded = MyValidTestModel.from_bytes(model.to_bytes())
+        decoded.validate()
+        eq_(decoded.my_int, model.my_int)
+        eq_(decoded.my_nested_set, model.my_nested_set)
+
+    def test_batch(self):
+        models = [MyJSONTranslatableModel(random=True) for x in range(20)]
+        decoded = MyJSONTranslatableModel.from_bytes_many(MyJSONTranslatableModel.to_bytes_many(models))
+        eq_(len(decoded), 20)
+        for (original, copy) in zip(models, decoded):
+            eq_(copy.to_json(return_dict=True), original.to_json(return_dict=True))
+        eq_(MyJSONTranslatableModel.from_bytes_many(MyJSONTranslatableModel.to_bytes_many([])), [])
+
+    def test_smaller_than_json(self):
+        ok_(len(self.model.to_bytes()) < len(self.model.to_json()))
+
+    def test_schema_fingerprint(self):
+        eq_(len(schema_fingerprint(MyBinaryModel)), 16)
+        ok_(schema_fingerprint(MyBinaryModel) != schema_fingerprint(MyBinaryChildModel))
+        assert_raises(ModelException, MyBinaryChildModel.from_bytes, self.model.to_bytes())
+        assert_raises(ModelException, MyBinaryModel.from_bytes, 'not a payload')
+        # payloads shorter than the header
+        for payload in ('', 'TMB', self.model.to_bytes()[:6]):
+            assert_raises(ModelException, MyBinaryModel.from_bytes, payload)
+            assert_raises(ModelException, MyBinaryModel.from_bytes_many, payload)
@@ -0,0 +1,83 @@
+import json
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from nose.tools import assert_raises, eq_, ok_
+
+from tinymodel.cli import BINARY, format_report, load_model_class, main, run
+from tinymodel.parallel import JSON_ARRAY
+from test.parallel_test import MyParallelChildModel, MyParallelModel, make_models
+
+
+class CliTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.records = [model.to_json(return_dict=True) for model in make_models(12)]
+        self.records[4]['id'] = u'not an int'
+        self.records[7] = {'id': 7, 'scores': u'not a dict'}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_load_model_class(self):
+        ok_(load_model_class('test.parallel_test.MyParallelModel') is MyParallelModel)
+        assert_raises(ValueError, load_model_class, 'test.parallel_test.make_models')
+        assert_raises(ValueError, load_model_class, 'test.no_such_module.Model')
+
+    def test_run(self):
+        fp = StringIO('\n'.join(json.dumps(record) for record in self.records))
+        for workers in (1, 2):
+            fp.seek(0)
+            output = StringIO()
+            stats = run(MyParallelModel, fp, output, to_format=BINARY, chunk_size=5, workers=workers)
+            eq_((stats['rows'], stats['load_errors'], stats['validation_errors']), (12, 1, 1))
+            eq_([message.split(':')[0] for message in stats['messages']], ['record 4', 'record 7'])
+            eq_(sorted(stats['field_seconds']), ['children', 'id', 'scores', 'seen_at'])
+            ok_('12 rows' in format_report(stats))
+
+            # binary back to a JSON array, without errors
+            output.seek(0)
+            converted = StringIO()
+            stats = run(MyParallelModel, output, converted, to_format=JSON_ARRAY, workers=workers)
+            eq_((stats['rows'], stats['load_errors'], stats['validation_errors']), (10, 0, 0))
+            eq_([record['id'] for record in json.loads(converted.getvalue())], [0, 1, 2, 3, 5, 6, 8, 9, 10, 11])
+
+    def test_binary_errors(self):
+        binary = StringIO()
+        run(MyParallelModel, StringIO('\n'.join(json.dumps(record) for record in self.records)), binary, to_format=BINARY, chunk_size=5)
+        # chunks of another model are load errors, one per chunk, instead of ending the run
+        stats = run(MyParallelChildModel, StringIO(binary.getvalue()))
+        eq_((stats['rows'], stats['load_errors']), (0, 3))
+        ok_(stats['messages'][0].startswith('after record 0: Cannot decode binary chunk: ModelException'))
+
+        # a truncated chunk is a load error too, after the complete chunks
+        for cut in (10, len(binary.getvalue()) - binary.getvalue().rindex('TMB') + 4):
+            stats = run(MyParallelModel, StringIO(binary.getvalue()[:-cut]))
+            eq_((stats['rows'], stats['load_errors']), (8, 1))
+            ok_(stats['messages'][0].startswith('after record 8: Truncated binary input'))
+
+    def test_malformed_json_array(self):
+        # the records before the damage are loaded, and the damage is a load error
+        truncated = json.dumps(self.records)
+        truncated = truncated[:truncated.index('"id": 9')]
+        for workers in (1, 2):
+            stats = run(MyParallelModel, StringIO(truncated), chunk_size=5, workers=workers)
+            eq_((stats['rows'], stats['load_errors'], stats['validation_errors']), (9, 2, 1))
+            ok_(stats['messages'][-1].startswith('after record 9: Invalid JSON array'))
+
+        path = os.path.join(self.directory, 'truncated.json')
+        with open(path, 'w') as fp:
+            fp.write(truncated)
+        eq_(main(['test.parallel_test.MyParallelModel', path]), 1)
+
+    def test_main(self):
+        path = os.path.join(self.directory, 'records.json')
+        with open(path, 'w') as fp:
+            json.dump(self.records[:3], fp)
+        output_path = os.path.join(self.directory, 'records.ndjson')
+        eq_(main(['test.parallel_test.MyParallelModel', path, '-o', output_path, '--chunk-size', '2']), 0)
+        with open(output_path) as fp:
+            eq_([json.loads(line)['id'] for line in fp], [0, 1, 2])
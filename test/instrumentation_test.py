@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+from nose.tools import eq_, ok_
+
+from tinymodel import TinyModel, FieldDef, instrumentation
+from tinymodel.memory_service import InMemoryService
+from test.api_test import MyOtherModel, MyTrackedModel, ServiceMock
+
+
+class MyInstrumentedModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int]),
+        FieldDef('my_str', allowed_types=[unicode]),
+        FieldDef('my_calculated', allowed_types=[int], calculated=lambda m: m.id * 2),
+    ]
+
+
+class InstrumentationTest(TestCase):
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+        instrumentation.set_sink(None)
+
+    def __metrics(self):
+        return dict(((m['name'], m['model'], m['endpoint']), m['count']) for m in instrumentation.snapshot())
+
+    def test_disabled(self):
+        setattr_method = TinyModel.__dict__['__setattr__']
+        instrumentation.enable()
+        instrumentation.disable()
+        ok_(TinyModel.__dict__['__setattr__'] is setattr_method)
+        MyInstrumentedModel(id=1).to_json()
+        eq_(instrumentation.snapshot(), [])
+
+    def test_model_methods(self):
+        instrumentation.enable()
+        model = MyInstrumentedModel(from_json='{"id": 1, "my_str": "foo"}')
+        model.my_calculated
+        model.to_json()
+        model.validate()
+        metrics = self.__metrics()
+        eq_(metrics[('from_json', 'MyInstrumentedModel', None)], 1)
+        eq_(metrics[('to_json', 'MyInstrumentedModel', None)], 1)
+        eq_(metrics[('validate', 'MyInstrumentedModel', None)], 1)
+        ok_(metrics[('calculated_evaluation', 'MyInstrumentedModel', None)] >= 2)
+        eq_(metrics[('json_recast', 'MyInstrumentedModel', None)], 1)
+        ok_(metrics[('__setattr__', 'MyInstrumentedModel', None)] >= 2)
+        ok_(all(m['seconds'] >= 0 for m in instrumentation.snapshot()))
+
+    def test_api_methods(self):
+        instrumentation.enable()
+        MyOtherModel.find(ServiceMock(return_type='tinymodel'), id=1)
+        MyOtherModel.create(ServiceMock(return_type='tinymodel'), 'other_models', id=1)
+        metrics = self.__metrics()
+        eq_(metrics[('api.find', 'MyOtherModel', 'my_other_model')], 1)
+        eq_(metrics[('api.create', 'MyOtherModel', 'other_models')], 1)
+
+        # including the api methods added on top of the service methods, e.g. count, create_many and save
+        service = InMemoryService()
+        models = MyTrackedModel.create_many(service, [{'size': 1}, {'size': 2}])
+        MyTrackedModel.count(service)
+        MyTrackedModel.exists(service, size=1)
+        MyTrackedModel.aggregate(service, metrics={'size': 'sum'})
+        MyTrackedModel.create_or_update_many_by(service, [{'id': 1, 'size': 3}], by=['id'])
+        models[0].size = 4
+        MyTrackedModel.update_changed(service, models)
+        models[1].save(service, endpoint_name='tracked')
+        metrics = self.__metrics()
+        for name in ('create_many', 'count', 'exists', 'aggregate', 'create_or_update_many_by', 'update_changed'):
+            eq_(metrics[('api.' + name, 'MyTrackedModel', 'my_tracked_model')], 1)
+        eq_(metrics[('api.save', 'MyTrackedModel', 'tracked')], 1)
+
+    def test_sink(self):
+        flushed = []
+        instrumentation.enable(sink=flushed.append)
+        MyInstrumentedModel(id=1).validate()
+        metrics = instrumentation.flush()
+        eq_(flushed, [metrics])
+        ok_(metrics)
+        eq_(instrumentation.snapshot(), [])
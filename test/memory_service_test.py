@@ -0,0 +1,69 @@
+from datetime import datetime
+import json
+from unittest import TestCase
+
+from nose.tools import assert_raises, eq_
+
+from tinymodel.memory_service import InMemoryService
+from tinymodel.utils import ValidationError
+from test.api_test import MyOtherModel
+
+
+class InMemoryServiceTest(TestCase):
+    def setUp(self):
+        self.service = InMemoryService()
+        self.service.create_many(endpoint_name='rows', records=[
+            {'id': 1, 'name': u'Blue Whale', 'size': 30, 'seen_at': datetime(2014, 1, 1)},
+            {'id': 2, 'name': u'Grey Whale', 'size': 15, 'seen_at': datetime(2014, 1, 3)},
+            {'id': 3, 'name': u'Blue Shark', 'size': 5, 'seen_at': datetime(2014, 1, 2)},
+            {'id': 4, 'name': u'Whale Shark', 'size': 12, 'seen_at': None},
+        ])
+
+    def ids(self, **kwargs):
+        return [json.loads(document)['id'] for document in self.service.find(endpoint_name='rows', **kwargs)]
+
+    def test_find(self):
+        eq_(self.ids(name=u'Grey Whale'), [2])
+        eq_(self.ids(id=3), [3])
+        eq_(self.ids(id=9), [])
+        eq_(self.ids(size={'gte': 12, 'lt': 30}), [2, 4])
+        eq_(self.ids(size={'gt': 12}), [1, 2])
+        eq_(self.ids(size={'lte': 12}, name=u'Blue Shark'), [3])
+        eq_(self.ids(seen_at={'lt': datetime(2014, 1, 3)}), [1, 3])
+        eq_(self.ids(order_by={'size': 'descending'}), [1, 2, 4, 3])
+        eq_(self.ids(order_by={'seen_at': 'ascending'}, offset=1, limit=2), [1, 3])
+        eq_(self.ids(name=u'whale', fuzzy=['name'], order_by={'size': 'ascending'}), [4, 2, 1])
+        eq_(self.ids(name=u'the blue', fuzzy=['name'], fuzzy_match_exclude=['the']), [1, 3])
+        eq_(json.loads(self.service.find(endpoint_name='rows', id=1, only=['name'])[0]), {'name': u'Blue Whale'})
+
+    def test_indexes_follow_writes(self):
+        eq_(self.ids(size={'lt': 13}), [3, 4])
+        eq_(self.ids(name=u'Blue Shark'), [3])
+        self.service.update(endpoint_name='rows', id=3, name=u'Tiger Shark', size=20)
+        self.service.create(endpoint_name='rows', name=u'Blue Shark', size=3)
+        eq_(self.ids(size={'lt': 13}), [4, 5])
+        eq_(self.ids(name=u'Blue Shark'), [5])
+        self.service.delete(endpoint_name='rows', name=u'Blue Shark')
+        eq_(self.ids(size={'lt': 13}), [4])
+        eq_(self.ids(order_by={'size': 'ascending'}), [4, 2, 3, 1])
+        assert_raises(ValidationError, self.service.update, endpoint_name='rows', name=u'No id')
+        assert_raises(ValidationError, self.service.create, endpoint_name='rows', id=1)
+
+    def test_get_or_create_and_sum(self):
+        (document, created) = self.service.get_or_create(endpoint_name='rows', name=u'Blue Whale')
+        eq_((json.loads(document)['id'], created), (1, False))
+        (document, created) = self.service.get_or_create(endpoint_name='rows', name=u'Orca')
+        eq_((json.loads(document)['id'], created), (5, True))
+        eq_(json.loads(self.service.sum(endpoint_name='rows', return_fields=['size'], size={'gt': 10})), {'size': 57})
+
+    def test_api(self):
+        created = MyOtherModel.create(self.service, my_float=1.5)
+        eq_(MyOtherModel.find(self.service, id=created.id)[0].my_float, 1.5)
+        MyOtherModel.update(self.service, id=created.id, my_float=2.5)
+        eq_(MyOtherModel.sum(self.service, return_fields=['my_float']).my_float, 2.5)
+        MyOtherModel.delete(self.service, id=created.id)
+        eq_(MyOtherModel.find(self.service), [])
+
+    def test_count_and_exists(self):
+        eq_(self.service.count(endpoint_name='rows', size={'gt': 10}), 3)
+        eq_(self.service.exists(endpoint_name='rows', name=u'Orca'), False)
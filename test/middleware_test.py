@@ -0,0 +1,155 @@
+import threading
+import time
+from unittest import TestCase
+
+from nose.tools import assert_raises, eq_, ok_
+
+from tinymodel.internals.concurrency import WorkerPool
+from tinymodel.middleware import HedgingPolicy, LatencyHistogram, Retry, Timeout
+from tinymodel.service import Service
+from tinymodel.utils import ServiceTimeoutError, ValidationError
+from test.api_test import MyOtherModel
+
+
+class MiddlewareTest(TestCase):
+    def test_chain_order(self):
+        calls = []
+
+        def outer(method_name, call, **kwargs):
+            calls.append(('outer', method_name, kwargs['endpoint_name']))
+            return call(**kwargs)
+
+        def inner(method_name, call, **kwargs):
+            calls.append(('inner', method_name, kwargs['endpoint_name']))
+            return call(**kwargs)
+
+        service = Service(return_type='json', middlewares=[outer, inner],
+                          find=lambda **kwargs: ['{"id": 1}'])
+        found = MyOtherModel.find(service, id=1)
+        eq_([m.id for m in found], [1])
+        eq_(calls, [('outer', 'find', 'my_other_model'), ('inner', 'find', 'my_other_model')])
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram()
+        for x in range(100):
+            histogram.record('my_endpoint', 'find', (x + 1) / 1000.0)
+        histogram.record('other_endpoint', 'create', 1.0)
+        eq_(histogram.count('my_endpoint'), 100)
+        eq_(histogram.count(), 101)
+        percentiles = histogram.percentiles('my_endpoint', 'find')
+        ok_(0.050 <= percentiles['p50'] <= 0.050 * 1.05 ** 2)
+        ok_(0.095 <= percentiles['p95'] <= 0.095 * 1.05 ** 2)
+        ok_(0.099 <= percentiles['p99'] <= 0.099 * 1.05 ** 2)
+        eq_(histogram.percentile(50, 'no_endpoint'), None)
+        eq_(sorted(histogram.snapshot()), [('my_endpoint', 'find'), ('other_endpoint', 'create')])
+
+        service = Service(return_type='json', middlewares=[histogram], find=lambda **kwargs: [])
+        MyOtherModel.find(service, id=1)
+        eq_(histogram.count('my_other_model', 'find'), 1)
+
+    def test_retry(self):
+        attempts = []
+
+        def flaky(**kwargs):
+            attempts.append(kwargs)
+            if len(attempts) < 3:
+                raise IOError('connection reset')
+            return []
+
+        service = Service(return_type='json', middlewares=[Retry(attempts=3, base_delay=0.001)], find=flaky, create=flaky)
+        eq_(MyOtherModel.find(service, id=1), [])
+        eq_(len(attempts), 3)
+
+        # writes are never retried
+        del attempts[:]
+        assert_raises(IOError, MyOtherModel.create, service, id=1)
+        eq_(len(attempts), 1)
+
+        # reads give up after the last attempt
+        del attempts[:]
+        service = Service(return_type='json', middlewares=[Retry(attempts=2, base_delay=0.001)], find=flaky)
+        assert_raises(IOError, MyOtherModel.find, service, id=1)
+        eq_(len(attempts), 2)
+
+        # other errors are not transient, and are raised at once
+        del attempts[:]
+        service = Service(return_type='json', middlewares=[Retry(attempts=3, base_delay=0.001)],
+                          find=lambda **kwargs: attempts.append(kwargs) or 1 / 0)
+        assert_raises(ZeroDivisionError, MyOtherModel.find, service, id=1)
+        eq_(len(attempts), 1)
+        assert_raises(ValidationError, Retry, attempts=0)
+
+    def test_timeout(self):
+        def slow(**kwargs):
+            time.sleep(0.5)
+            return []
+
+        service = Service(return_type='json', middlewares=[Timeout(0.05)], find=slow, create=lambda **kwargs: '{"id": 2}')
+        started_at = time.time()
+        assert_raises(ServiceTimeoutError, MyOtherModel.find, service, id=1)
+        ok_(time.time() - started_at < 0.4)
+        eq_(MyOtherModel.create(service, id=2).id, 2)
+
+    def test_hedging(self):
+        calls = []
+
+        def find(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return ['{"id": 1}']
+            return ['{"id": 2}']
+
+        def create(**kwargs):
+            calls.append(kwargs)
+            time.sleep(0.05)
+            return '{"id": 3}'
+
+        policy = HedgingPolicy(delay=0.01, budget=0.5, max_tokens=1)
+        service = Service(return_type='json', hedging_policy=policy, find=find, create=create)
+        started_at = time.time()
+        eq_([m.id for m in MyOtherModel.find(service, id=1)], [2])
+        ok_(time.time() - started_at < 0.4)
+        eq_(len(calls), 2)
+        eq_(policy.hedged, 1)
+
+        # writes are never hedged
+        del calls[:]
+        eq_(MyOtherModel.create(service, id=3).id, 3)
+        eq_(len(calls), 1)
+
+        # hedges are capped by the budget
+        calls.append({})
+        policy.tokens = 0
+        eq_([m.id for m in MyOtherModel.find(service, id=1)], [2])
+        eq_(policy.hedged, 1)
+
+    def test_hedging_workers(self):
+        # calls that are not hedged reuse the same worker thread
+        policy = HedgingPolicy(delay=1.0, budget=0)
+        service = Service(return_type='json', hedging_policy=policy, find=lambda **kwargs: ['{"id": 1}'])
+        MyOtherModel.find(service, id=1)
+        thread_count = threading.active_count()
+        for x in range(20):
+            MyOtherModel.find(service, id=1)
+        eq_(threading.active_count(), thread_count)
+
+        # a worker is reserved for every task submitted while it is idle
+        workers = WorkerPool()
+        done = threading.Event()
+        workers.submit(done.set)
+        ok_(done.wait(1.0))
+        time.sleep(0.05)
+        eq_(workers.idle, 1)
+        done.clear()
+        workers.submit(done.set)
+        ok_(done.wait(1.0))
+
+    def test_hedging_delay(self):
+        histogram = LatencyHistogram()
+        policy = HedgingPolicy(delay=0.5, histogram=histogram, min_samples=10)
+        eq_(policy.get_delay('find', 'my_endpoint'), 0.5)
+        for x in range(100):
+            histogram.record('my_endpoint', 'find', 0.01)
+        ok_(0.01 <= policy.get_delay('find', 'my_endpoint') <= 0.0106)
+        eq_(policy.get_delay('find', 'other_endpoint'), 0.5)
@@ -0,0 +1,89 @@
+import mmap
+import os
+import tempfile
+from unittest import TestCase
+
+from nose.tools import assert_raises, eq_, ok_
+
+from tinymodel import TinyModel, FieldDef
+from tinymodel import model_file as model_file_module
+from tinymodel.model_file import ModelFile, write_model_file
+from tinymodel.utils import ModelException
+from test.binary_object_test import MyBinaryChildModel, MyBinaryModel
+
+
+class MyNumericModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int, long]),
+        FieldDef('score', allowed_types=[float]),
+        FieldDef('active', allowed_types=[bool]),
+        FieldDef('name', allowed_types=[str]),
+    ]
+
+
+class ModelFileTest(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.models = [MyNumericModel(id=i, score=i / 2.0, active=i % 2 == 0, name='row %d' % i) for i in range(50)]
+        self.models[7] = MyNumericModel(id=7)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_records(self):
+        eq_(write_model_file(self.path, MyNumericModel, iter(self.models)), 50)
+        with ModelFile(self.path, MyNumericModel) as model_file:
+            eq_(len(model_file), 50)
+            eq_(model_file[3].to_json(return_dict=True), self.models[3].to_json(return_dict=True))
+            eq_(model_file[-1].name, 'row 49')
+            ok_(not hasattr(model_file[7], 'name'))
+            eq_([m.id for m in model_file[10:13]], [10, 11, 12])
+            eq_([m.id for m in model_file], range(50))
+            assert_raises(IndexError, model_file.__getitem__, 50)
+
+    def test_columns(self):
+        write_model_file(self.path, MyNumericModel, self.models)
+        with ModelFile(self.path, MyNumericModel) as model_file:
+            eq_(len(model_file.column('id')), 50)
+            eq_(model_file.column('id')[49], 49)
+            eq_(model_file.column('score')[3], 1.5)
+            eq_(model_file.column('score')[7], None)
+            eq_(list(model_file.column('active'))[:3], [True, False, True])
+            eq_(len(model_file.column('score').buffer()), 50 * 8)
+            eq_(model_file.column('score').presence()[7], '\0')
+            assert_raises(KeyError, model_file.column, 'name')
+
+    def test_nested_models(self):
+        child = MyBinaryChildModel(id=1, name=u'child')
+        models = [MyBinaryModel(id=long(i), my_child=child, my_children=[child]) for i in range(3)]
+        write_model_file(self.path, MyBinaryModel, models)
+        with ModelFile(self.path, MyBinaryModel) as model_file:
+            eq_(model_file[2].my_children[0].name, u'child')
+            eq_(sorted(model_file.columns.keys()), ['id', 'my_bool', 'my_float'])
+            eq_(model_file.column('my_float')[0], None)
+
+    def test_schema_mismatch(self):
+        write_model_file(self.path, MyNumericModel, self.models)
+        assert_raises(ModelException, ModelFile, self.path, MyBinaryChildModel)
+
+    def test_invalid_files(self):
+        # the file of setUp is empty
+        assert_raises(ModelException, ModelFile, self.path, MyNumericModel)
+
+        mappings = []
+
+        class RecordingMmap(object):
+            ACCESS_READ = mmap.ACCESS_READ
+
+            def mmap(self, *args, **kwargs):
+                mappings.append(mmap.mmap(*args, **kwargs))
+                return mappings[-1]
+        write_model_file(self.path, MyNumericModel, self.models)
+        model_file_module.mmap = RecordingMmap()
+        try:
+            assert_raises(ModelException, ModelFile, self.path, MyBinaryChildModel)
+        finally:
+            model_file_module.mmap = mmap
+        # the mapping of a rejected file is closed
+        assert_raises(ValueError, mappings[0].size)
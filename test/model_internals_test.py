@@ -325,6 +325,23 @@ class MyJSONTranslatableModel(TinyModel):
     ]
 
 
+class MyGraphTagModel(TinyModel):
+    TO_JSON_CALLS = []
+    FIELD_DEFS = [FieldDef(title='id', allowed_types=[int]),
+                  FieldDef(title='my_str', allowed_types=[unicode])]
+
+    def to_json(self, *args, **kwargs):
+        self.TO_JSON_CALLS.append(self)
+        return TinyModel.to_json(self, *args, **kwargs)
+
+
+class MyGraphPostModel(TinyModel):
+    FIELD_DEFS = [FieldDef(title='id', allowed_types=[int]),
+                  FieldDef(title='my_tags', allowed_types=[[MyGraphTagModel]]),
+                  FieldDef(title='my_parent', allowed_types=["test.model_internals_test.MyGraphPostModel"]),
+                  FieldDef(title='my_note', allowed_types=["test.model_internals_test.MyGraphPostModel"])]
+
+
 class TinyModelTest(TestCase):
 
     COLLECTION_TYPES = (dict, list, tuple, set)
@@ -661,3 +678,236 @@ class TinyModelTest(TestCase):
       ok_(not dt.tzinfo and not dt.microsecond)
       dt = obj.to_json(return_raw=True, naive_datetimes=True)['my_datetime']
       ok_(not dt.tzinfo and not dt.microsecond)
+
+    def test_lazy_from_json(self):
+        obj = MyJSONTranslatableModel(random=True)
+        obj_as_json = obj.to_json()
+
+        lazy_obj = MyJSONTranslatableModel(from_json=obj_as_json, lazy=True)
+        eq_(set(lazy_obj.LAZY_FIELDS.keys()), set(f.title for f in MyJSONTranslatableModel.FIELD_DEFS))
+        eq_(lazy_obj.FIELDS, [])
+        # untouched fields are passed through without being translated
+        eq_(lazy_obj.to_json(return_dict=True), json.loads(obj_as_json))
+        eq_(len(lazy_obj.LAZY_FIELDS), 5)
+
+        # fields are translated on first access, and only once
+        ok_(isinstance(lazy_obj.my_datetime, datetime))
+        ok_('my_datetime' not in lazy_obj.LAZY_FIELDS)
+        ok_(lazy_obj.my_datetime is lazy_obj.my_datetime)
+        eq_(lazy_obj.my_str, obj.my_str)
+
+        # assignment and deletion discard the raw value
+        lazy_obj.my_bool = not obj.my_bool
+        eq_(lazy_obj.my_bool, not obj.my_bool)
+        del lazy_obj.my_fk
+        ok_(not hasattr(lazy_obj, 'my_fk'))
+
+        # translated output matches the eager path
+        lazy_obj = MyJSONTranslatableModel(from_json=obj_as_json, lazy=True)
+        eager_obj = MyJSONTranslatableModel(from_json=obj_as_json)
+        eq_(lazy_obj.to_json(return_raw=True).keys(), eager_obj.to_json(return_raw=True).keys())
+        lazy_obj.validate()
+        eq_(lazy_obj.LAZY_FIELDS, {})
+
+    def test_memoized_calculated_fields(self):
+        calls = []
+
+        def total(model):
+            calls.append(model)
+            return model.my_int + len(model.my_list)
+
+        class MyMemoizedModel(TinyModel):
+            FIELD_DEFS = [FieldDef(title='my_int', allowed_types=[int]),
+                          FieldDef(title='my_list', allowed_types=[[int]]),
+                          FieldDef(title='my_str', allowed_types=[str]),
+                          FieldDef(title='my_total', allowed_types=[int], calculated=total, depends_on=['my_int', 'my_list']),
+                          FieldDef(title='my_double_total', allowed_types=[int], calculated=lambda m: m.my_total * 2, depends_on=['my_total'])]
+
+        obj = MyMemoizedModel(my_int=1, my_list=[1, 2], my_str='foo')
+        eq_(obj.my_total, 3)
+        eq_(obj.my_double_total, 6)
+        obj.to_json()
+        repr(obj)
+        eq_(len(calls), 1)
+
+        # setting an unrelated field keeps the memoized value
+        obj.my_str = 'bar'
+        eq_(obj.my_total, 3)
+        eq_(len(calls), 1)
+
+        # setting or deleting a dependency recalculates, including dependent calculated fields
+        obj.my_int = 10
+        eq_(obj.my_double_total, 24)
+        eq_(len(calls), 2)
+        del obj.my_list
+        assert_raises(AttributeError, getattr, obj, 'my_total')
+
+        class MyBadDependencyModel(TinyModel):
+            FIELD_DEFS = [FieldDef(title='my_int', allowed_types=[int]),
+                          FieldDef(title='my_total', allowed_types=[int], calculated=total, depends_on=['foo'])]
+
+        assert_raises(ValidationError, MyBadDependencyModel)
+
+        # a calculated field without depends_on can't be invalidated, so memoized fields can't depend on it
+        class MyUnmemoizedDependencyModel(TinyModel):
+            FIELD_DEFS = [FieldDef(title='my_int', allowed_types=[int]),
+                          FieldDef(title='my_double', allowed_types=[int], calculated=lambda m: m.my_int * 2),
+                          FieldDef(title='my_total', allowed_types=[int], calculated=lambda m: m.my_double + 1, depends_on=['my_double'])]
+
+        assert_raises(ValidationError, MyUnmemoizedDependencyModel)
+
+    def test_to_json_cache(self):
+        class MyCachedChildModel(TinyModel):
+            FIELD_DEFS = [FieldDef(title='my_int', allowed_types=[int]),
+                          FieldDef(title='my_list', allowed_types=[[int]])]
+
+        class MyCachedModel(TinyModel):
+            FIELD_DEFS = [FieldDef(title='my_str', allowed_types=[str]),
+                          FieldDef(title='my_children', allowed_types=[[MyCachedChildModel]])]
+
+        class MyUncachedModel(TinyModel):
+            FIELD_DEFS = [FieldDef(title='my_int', allowed_types=[int]),
+                          FieldDef(title='my_now', allowed_types=[datetime], calculated=lambda m: datetime.utcnow())]
+
+        child = MyCachedChildModel(my_int=1, my_list=[1])
+        obj = MyCachedModel(my_str='foo', my_children=[child])
+        # results are cached from the second serialization on
+        ok_(obj.to_json() is not obj.to_json())
+        as_json = obj.to_json()
+        ok_(obj.to_json() is as_json)
+        ok_(child.to_json() is child.to_json())
+
+        # dicts are copies of the cached dict
+        obj.to_json(return_dict=True)['my_str'] = 'bar'
+        eq_(obj.to_json(return_dict=True)['my_str'], 'foo')
+        eq_(obj.to_json(return_raw=True)['my_str'], 'foo')
+
+        # setting a field of a child, or modifying it in place, invalidates the parent
+        child.my_int = 2
+        eq_(obj.to_json(return_dict=True)['my_children'], [{'my_int': 2, 'my_list': [1]}])
+        child.my_list.append(2)
+        eq_(obj.to_json(return_dict=True)['my_children'], [{'my_int': 2, 'my_list': [1, 2]}])
+        obj.my_children.append(MyCachedChildModel(my_int=3))
+        eq_(len(obj.to_json(return_dict=True)['my_children']), 2)
+        del obj.my_str
+        ok_('my_str' not in obj.to_json(return_dict=True))
+
+        uncached = MyUncachedModel(my_int=1)
+        uncached.to_json()
+        ok_(uncached.to_json() is not uncached.to_json())
+
+    def test_to_json_graph(self):
+        calls = MyGraphTagModel.TO_JSON_CALLS
+        tag = MyGraphTagModel(id=1, my_str=u'shared')
+        first = MyGraphPostModel(id=1, my_tags=[tag, tag, MyGraphTagModel(id=2, my_str=u'other')])
+        second = MyGraphPostModel(id=2, my_tags=[tag], my_parent=first, my_note=MyGraphPostModel(my_tags=[]))
+
+        # a child that appears twice is serialized once per call
+        eq_(first.to_json(return_dict=True)['my_tags'][:2], [{'id': 1, 'my_str': u'shared'}] * 2)
+        eq_(calls.count(tag), 1)
+
+        first.my_parent = second
+        graph = json.loads(MyGraphPostModel.to_json_graph([first, second]))
+        eq_(graph['models'], [{'$ref': 'test.model_internals_test.MyGraphPostModel:1'},
+                              {'$ref': 'test.model_internals_test.MyGraphPostModel:2'}])
+        eq_(len(graph['objects']), 5)
+        eq_(graph['objects']['test.model_internals_test.MyGraphTagModel:1'], {'id': 1, 'my_str': u'shared'})
+        eq_(graph['objects']['test.model_internals_test.MyGraphPostModel:1']['my_parent'],
+            {'$ref': 'test.model_internals_test.MyGraphPostModel:2'})
+
+        (loaded_first, loaded_second) = MyGraphPostModel.from_json_graph(json.dumps(graph))
+        ok_(loaded_first.my_tags[0] is loaded_first.my_tags[1] is loaded_second.my_tags[0])
+        eq_(loaded_first.my_tags[0].my_str, u'shared')
+        ok_(loaded_first.my_parent is loaded_second and loaded_second.my_parent is loaded_first)
+        eq_(loaded_second.my_note.my_tags, [])
+        graph['objects']['os.path:1'] = {}
+        assert_raises(ModelException, MyGraphPostModel.from_json_graph, graph)
+
+    def test_compiled_schema(self):
+        import threading
+        from tinymodel.internals.schema import compile_schema
+
+        child_types = [MyJSONTranslatableModel]
+        child_field_def = FieldDef(title='my_child', allowed_types=child_types, relationship='has_one')
+
+        class MyCompiledModel(TinyModel):
+            FIELD_DEFS = [FieldDef(title='my_int', allowed_types=[int]),
+                          FieldDef(title='my_missing', allowed_types=['test.no_such_module.NoSuchClass']),
+                          child_field_def]
+
+        # concurrent first uses compile the class once, and every thread sees the same schema
+        schemas = []
+        errors = []
+
+        def construct():
+            try:
+                MyCompiledModel(my_int=1)
+                schemas.append(compile_schema(MyCompiledModel))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=construct) for x in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(errors, [])
+        eq_(len(set(id(s) for s in schemas)), 1)
+
+        # the class definition and its FieldDefs are left untouched
+        compiled_schema = schemas[0]
+        eq_(child_types, [MyJSONTranslatableModel])
+        ok_(MyCompiledModel.FIELD_DEFS[2] is child_field_def)
+        ok_(child_field_def not in compiled_schema.field_defs)
+        eq_([f.title for f in compiled_schema.field_defs], ['my_int', 'my_child'])
+        ok_(isinstance(MyCompiledModel.FIELD_DEFS, list))
+
+        # so subclasses can extend the FIELD_DEFS of a compiled class
+        class MyExtendedCompiledModel(MyCompiledModel):
+            FIELD_DEFS = MyCompiledModel.FIELD_DEFS + [FieldDef(title='my_str', allowed_types=[str])]
+        eq_(MyExtendedCompiledModel(my_int=1, my_str='foo').to_json(return_dict=True), {'my_int': 1, 'my_str': 'foo'})
+
+        eq_(compiled_schema.get_field_def('my_child_id').title, 'my_child')
+        assert_raises(AttributeError, setattr, compiled_schema, 'field_defs', ())
+
+        # repeated decoding does not grow the allowed types
+        my_child = compiled_schema.get_field_def('my_child')
+        allowed_types = my_child.allowed_types
+        for x in range(3):
+            MyCompiledModel(from_json='{"my_int": 1, "my_child": 5}')
+        eq_(my_child.allowed_types, allowed_types)
+
+        # the compiled FieldDefs share no mutable state with the class FieldDefs
+        translators = {'to_json': lambda value: '"%s"' % value}
+        choices = [(1, 'one'), (2, 'two')]
+        int_field_def = FieldDef(title='my_int', allowed_types=[int], choices=choices, custom_translators={'int': translators})
+
+        class MyFrozenModel(TinyModel):
+            FIELD_DEFS = [int_field_def]
+        frozen_field_def = compile_schema(MyFrozenModel).get_field_def('my_int')
+        int_field_def.allowed_types.append(str)
+        choices.append((3, 'three'))
+        translators['to_json'] = None
+        eq_(frozen_field_def.allowed_types, (int,))
+        eq_(frozen_field_def.choices, ((1, 'one'), (2, 'two')))
+        ok_(frozen_field_def.custom_translators['int']['to_json'] is not None)
+        ok_(isinstance(frozen_field_def.allowed_types, tuple))
+
+    def test_compile_all(self):
+        from tinymodel import compile_all
+        from tinymodel.internals.schema import COMPILED_SCHEMAS
+
+        class MyWarmedUpModel(TinyModel):
+            FIELD_DEFS = [FieldDef(title='my_int', allowed_types=[int]),
+                          FieldDef(title='my_child', allowed_types=['test.model_internals_test.MyJSONTranslatableModel'], relationship='has_one')]
+
+        report = compile_all()
+        ok_(MyWarmedUpModel in report['classes'])
+        ok_(MyWarmedUpModel in COMPILED_SCHEMAS)
+        eq_(COMPILED_SCHEMAS[MyWarmedUpModel].field_defs[1].allowed_types[0], MyJSONTranslatableModel)
+        ok_(MyDuplicateFieldTitlesModel in report['failures'])
+        ok_(MyDuplicateFieldTitlesModel not in COMPILED_SCHEMAS)
+        ok_(report['seconds'] >= 0)
+
+        report = compile_all(classes=[MyJSONTranslatableModel])
+        eq_(report['classes'], [MyJSONTranslatableModel])
+        eq_(report['failures'], {})
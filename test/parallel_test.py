@@ -0,0 +1,96 @@
+from datetime import datetime
+import json
+from StringIO import StringIO
+from unittest import TestCase
+
+import pytz
+from nose.tools import assert_raises, eq_, ok_
+
+from tinymodel import TinyModel, FieldDef
+from tinymodel import parallel
+from tinymodel.parallel import JSON_ARRAY, dump_many, iter_records, load_many, pack, unpack
+from tinymodel.utils import ModelException
+
+
+class MyParallelChildModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int]),
+        FieldDef('name', allowed_types=[unicode]),
+    ]
+
+
+class MyParallelModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int]),
+        FieldDef('seen_at', allowed_types=[datetime]),
+        FieldDef('scores', allowed_types=[{unicode: [float]}]),
+        FieldDef('children', allowed_types=[[MyParallelChildModel]], relationship='has_many'),
+    ]
+
+
+def make_models(count):
+    return [MyParallelModel(id=x, seen_at=datetime(2014, 1, 1, x % 24, tzinfo=pytz.utc), scores={u'a': [x * 0.5]},
+                            children=[MyParallelChildModel(id=x, name=u'child %d' % x)]) for x in range(count)]
+
+
+class ParallelTest(TestCase):
+    def setUp(self):
+        self.read_size = parallel.READ_SIZE
+
+    def tearDown(self):
+        parallel.READ_SIZE = self.read_size
+
+    def test_pack(self):
+        model = make_models(2)[1]
+        unpacked = unpack(pack(model))
+        eq_(unpacked.to_json(return_dict=True), model.to_json(return_dict=True))
+        ok_(isinstance(unpacked.children[0], MyParallelChildModel))
+
+        lazy = MyParallelModel(from_json=model.to_json(), lazy=True)
+        eq_(unpack(pack(lazy)).children[0].name, u'child 1')
+
+        # fields are set without going through __setattr__, and validated fields stay validated
+        model.validate()
+        packed = pack(model)
+        MyParallelModel.__setattr__ = lambda *args: self.fail('unpack set a field through __setattr__')
+        try:
+            unpacked = unpack(packed)
+        finally:
+            del MyParallelModel.__setattr__
+        eq_([field.field_def.title for field in unpacked.FIELDS], ['id', 'seen_at', 'scores', 'children'])
+        ok_(all(field.is_valid() for field in unpacked.FIELDS))
+        ok_(not unpack(pack(make_models(1)[0])).FIELDS[0].is_valid())
+
+    def test_iter_json_array(self):
+        # elements are parsed across reads, numbers included
+        parallel.READ_SIZE = 8
+        fp = StringIO(' [ {"id": 1, "name": "a long name, with [brackets]"} ,12345678901, [], "x"\n]\n')
+        eq_(list(iter_records(fp, chunk_size=3)), [[{'id': 1, 'name': u'a long name, with [brackets]'}, 12345678901, []], [u'x']])
+        eq_(list(iter_records(StringIO('[]'))), [])
+        for invalid in ('[{"id": 1}', '[{"id": 1} {"id": 2}]', '[{"id": }]'):
+            assert_raises(ModelException, list, iter_records(StringIO(invalid)))
+
+    def test_dump_and_load(self):
+        models = make_models(25)
+        for workers in (1, 3):
+            fp = StringIO()
+            eq_(dump_many(models, fp, workers=workers, chunk_size=4), 25)
+            lines = fp.getvalue().splitlines()
+            eq_([json.loads(line)['id'] for line in lines], range(25))
+
+            fp.seek(0)
+            loaded = load_many(fp, MyParallelModel, workers=workers, chunk_size=4)
+            eq_([model.id for model in loaded], range(25))
+            eq_(loaded[3].to_json(return_dict=True), models[3].to_json(return_dict=True))
+
+            fp = StringIO()
+            dump_many(models, fp, workers=workers, chunk_size=10, format=JSON_ARRAY)
+            eq_([record['id'] for record in json.loads(fp.getvalue())], range(25))
+            fp.seek(0)
+            eq_([model.children[0].name for model in load_many(fp, MyParallelModel, workers=workers)],
+                [u'child %d' % x for x in range(25)])
+
+        fp = StringIO()
+        dump_many([], fp, format=JSON_ARRAY, workers=1)
+        eq_(json.loads(fp.getvalue()), [])
+        assert_raises(ValueError, dump_many, models, fp, format='xml')
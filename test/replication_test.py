@@ -0,0 +1,91 @@
+import threading
+import time
+from unittest import TestCase
+
+from nose.tools import assert_raises, eq_, ok_
+
+from tinymodel.memory_service import InMemoryService
+from tinymodel.replication import ReplicatedService
+from tinymodel.service import Service
+from tinymodel.utils import ValidationError
+from test.api_test import MyOtherModel
+
+
+def RecordingService(name, calls, delay=0):
+    def find(**kwargs):
+        calls.append((name, 'find'))
+        time.sleep(delay)
+        return ['{"id": 1}']
+
+    def create(**kwargs):
+        calls.append((name, 'create'))
+        return '{"id": %d}' % kwargs.get('id', 7)
+
+    return Service(return_type='json', find=find, create=create, update=lambda **kwargs: [], delete=lambda **kwargs: [])
+
+
+class ReplicationTest(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.primary = RecordingService('primary', self.calls)
+        self.replicas = [RecordingService('replica-0', self.calls, 0.05), RecordingService('replica-1', self.calls, 0.05)]
+        self.service = ReplicatedService(self.primary, self.replicas, pin_seconds=0.2)
+
+    def test_routing(self):
+        MyOtherModel.find(self.service, id=1)
+        eq_(self.calls[-1][0][:7], 'replica')
+        MyOtherModel.create(self.service, my_float=1.0)
+        eq_(self.calls[-1], ('primary', 'create'))
+        assert_raises(ValidationError, ReplicatedService, self.primary, [])
+
+    def test_read_your_writes(self):
+        MyOtherModel.create(self.service, id=5)
+        MyOtherModel.find(self.service, id=5)
+        eq_(self.calls[-1], ('primary', 'find'))
+        MyOtherModel.find(self.service, my_float=1.0)
+        eq_(self.calls[-1], ('primary', 'find'))
+
+        # other sessions read from the replicas
+        with self.service.session():
+            MyOtherModel.find(self.service, id=5)
+            eq_(self.calls[-1][0][:7], 'replica')
+        MyOtherModel.find(self.service, id=5)
+        eq_(self.calls[-1], ('primary', 'find'))
+
+        # the pin expires
+        time.sleep(0.25)
+        MyOtherModel.find(self.service, id=5)
+        eq_(self.calls[-1][0][:7], 'replica')
+
+    def test_least_outstanding(self):
+        threads = [threading.Thread(target=MyOtherModel.find, args=(self.service,)) for x in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(sorted(self.calls), [('replica-0', 'find'), ('replica-1', 'find')])
+        eq_(self.service.outstanding, [0, 0])
+
+    def test_optional_methods(self):
+        primary = InMemoryService()
+        counting_replica = Service(return_type='json', find=primary.find,
+                                   count=lambda **kwargs: self.calls.append(('replica-0', 'count')) or primary.count(**kwargs))
+        service = ReplicatedService(primary, [counting_replica, Service(return_type='json', find=primary.find)], pin_seconds=0.2)
+        for method_name in ('create_many', 'upsert', 'upsert_many', 'count', 'exists'):
+            ok_(hasattr(service, method_name))
+        ok_(not hasattr(service, 'aggregate'))
+        # projections are only sent when every backend supports them
+        ok_(not service.supports_projection)
+        ok_(ReplicatedService(primary, [InMemoryService()]).supports_projection)
+
+        MyOtherModel.create_many(service, [{'id': 1}, {'id': 2}])
+        eq_(MyOtherModel.create_or_update_by(service, by=['id'], id=3, my_float=1.5)[1], True)
+        with service.session():
+            # count is read from the only replica that has it, and exists from the primary
+            eq_(MyOtherModel.count(service), 3)
+            eq_(self.calls, [('replica-0', 'count')])
+            eq_(MyOtherModel.exists(service, id=2), True)
+            eq_(self.calls, [('replica-0', 'count')])
+        # the written ids pin their reads to the primary
+        eq_(MyOtherModel.count(service, id=2), 1)
+        eq_(self.calls, [('replica-0', 'count')])
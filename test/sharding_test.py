@@ -0,0 +1,66 @@
+import json
+from unittest import TestCase
+
+from nose.tools import assert_raises, eq_, ok_
+
+from tinymodel.service import Service
+from tinymodel.sharding import HashRing, ShardedService
+from tinymodel.utils import ValidationError
+from test.api_test import MyOtherModel
+
+
+def DictService():
+    rows = {}
+
+    def find(endpoint_name, **kwargs):
+        found = [r for r in rows.values() if kwargs.get('id') in (None, r['id'])]
+        for (field_name, direction) in (kwargs.get('order_by') or {}).items():
+            found.sort(key=lambda r: r.get(field_name), reverse=direction == 'descending')
+        found = found[kwargs.get('offset') or 0:][:kwargs.get('limit')]
+        return [json.dumps(r) for r in found]
+
+    def create(endpoint_name, **kwargs):
+        rows[kwargs['id']] = kwargs
+        return json.dumps(kwargs)
+
+    def sum_fields(endpoint_name, return_fields, **kwargs):
+        return json.dumps(dict((f, sum(r.get(f) or 0 for r in rows.values())) for f in return_fields))
+
+    service = Service(return_type='json', find=find, create=create, sum=sum_fields)
+    service.rows = rows
+    return service
+
+
+class ShardingTest(TestCase):
+    def setUp(self):
+        self.shards = [DictService() for x in range(3)]
+        self.service = ShardedService(self.shards)
+        for x in range(30):
+            MyOtherModel.create(self.service, id=x, my_float=float(x % 7))
+
+    def test_routing(self):
+        eq_(sum(len(s.rows) for s in self.shards), 30)
+        ok_(all(s.rows for s in self.shards))
+        for x in range(30):
+            ok_(x in self.service.get_shard(x).rows)
+        eq_([m.id for m in MyOtherModel.find(self.service, id=12)], [12])
+        assert_raises(ValidationError, MyOtherModel.create, self.service, my_float=1.0)
+
+    def test_fan_out_merge(self):
+        eq_(sorted(m.id for m in MyOtherModel.find(self.service)), range(30))
+        found = MyOtherModel.find(self.service, order_by={'id': 'descending'}, offset=5, limit=10)
+        eq_([m.id for m in found], range(24, 14, -1))
+        found = MyOtherModel.find(self.service, order_by={'id': 'ascending'}, limit=3)
+        eq_([m.id for m in found], [0, 1, 2])
+        eq_(json.loads(self.service.sum(endpoint_name='my_other_model', return_fields=['my_float'])),
+            {'my_float': sum(float(x % 7) for x in range(30))})
+
+    def test_minimal_movement(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        before = dict((key, ring.get_node(key)) for key in range(2000))
+        ring.add_node('e')
+        moved = [key for key in before if ring.get_node(key) != before[key]]
+        ok_(all(ring.get_node(key) == 'e' for key in moved))
+        ok_(len(moved) < 2000 * 0.3)
+        ring.remove_node('e')
+        eq_(dict((key, ring.get_node(key)) for key in range(2000)), before)
@@ -1,7 +1,10 @@
 import cProfile, pstats, StringIO
+import os
+import subprocess
+import sys
 
 from unittest import TestCase
-from nose.tools import assert_raises, eq_
+from nose.tools import assert_raises, eq_, ok_
 
 from model_internals_test import MyValidTestModel
 
@@ -18,3 +21,19 @@ class SpeedTest(TestCase):
         ps = pstats.Stats(pr, stream=s).sort_stats(sortby)
         ps.print_stats()
         #print s.getvalue()
+
+    def test_import_time(self):
+        # heavy dependencies are only imported once they are needed
+        # the import time itself is tracked by the import.tinymodel benchmark
+        script = ("import sys\n"
+                  "import tinymodel\n"
+                  "print ' '.join(m for m in ('dateutil', 'pytz', 'inflection', 'json', 'inspect') if m in sys.modules)\n")
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=package_dir).splitlines()
+        eq_(output, [''])
+
+    def test_lazy_module(self):
+        from tinymodel.utils import LazyModule
+        lazy_json = LazyModule('json')
+        eq_(lazy_json.loads('[1]'), [1])
+        ok_('loads' in lazy_json.__dict__)
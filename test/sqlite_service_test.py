@@ -0,0 +1,145 @@
+from datetime import datetime
+from decimal import Decimal
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+import pytz
+from nose.tools import assert_raises, eq_, ok_
+
+from tinymodel import TinyModel, FieldDef
+from tinymodel.sqlite_service import SqliteService
+from tinymodel.utils import ValidationError
+
+
+class MySqliteModel(TinyModel):
+    FIELD_DEFS = [
+        FieldDef('id', allowed_types=[int, long]),
+        FieldDef('name', allowed_types=[unicode]),
+        FieldDef('size', allowed_types=[int]),
+        FieldDef('active', allowed_types=[bool]),
+        FieldDef('price', allowed_types=[Decimal]),
+        FieldDef('seen_at', allowed_types=[datetime]),
+        FieldDef('tags', allowed_types=[[unicode]]),
+    ]
+
+
+class SqliteServiceTest(TestCase):
+    def setUp(self):
+        self.service = SqliteService(':memory:', [MySqliteModel], indexes={'my_sqlite_model': ['name', 'size']})
+        self.service.create_many(endpoint_name='my_sqlite_model', records=[
+            {'name': u'Blue Whale', 'size': 30, 'active': True, 'seen_at': datetime(2014, 1, 1, tzinfo=pytz.utc)},
+            {'name': u'Grey Whale', 'size': 15, 'active': False, 'seen_at': datetime(2014, 1, 3, tzinfo=pytz.utc)},
+            {'name': u'Blue Shark', 'size': 5, 'tags': [u'fast'], 'seen_at': datetime(2014, 1, 2, tzinfo=pytz.utc)},
+            {'id': 10, 'name': u'Whale_Shark', 'size': 12, 'price': Decimal('1.50')},
+        ])
+
+    def tearDown(self):
+        self.service.close()
+
+    def ids(self, **kwargs):
+        return [model.id for model in MySqliteModel.find(self.service, **kwargs)]
+
+    def test_find(self):
+        eq_(self.ids(name=u'Grey Whale'), [2])
+        eq_(self.ids(size={'gte': 12, 'lt': 30}, order_by={'size': 'ascending'}), [10, 2])
+        eq_(self.ids(seen_at={'lt': datetime(2014, 1, 3, tzinfo=pytz.utc)}, order_by={'seen_at': 'descending'}), [3, 1])
+        eq_(self.ids(order_by={'size': 'descending'}, offset=1, limit=2), [2, 10])
+        eq_(self.ids(order_by={'id': 'ascending'}, offset=3), [10])
+        eq_(self.ids(name=u'the whale', fuzzy=['name'], fuzzy_match_exclude=['the'], order_by={'id': 'ascending'}), [1, 2, 10])
+        eq_(self.ids(name=u'e_s', fuzzy=['name']), [10])
+        eq_(self.ids(active=False), [2])
+
+        model = MySqliteModel.find(self.service, id=3)[0]
+        eq_((model.name, model.tags, model.seen_at), (u'Blue Shark', [u'fast'], datetime(2014, 1, 2, tzinfo=pytz.utc)))
+        eq_(MySqliteModel.find(self.service, id=10)[0].price, Decimal('1.50'))
+        eq_(json.loads(self.service.find(endpoint_name='my_sqlite_model', id=1, only=['name'])[0]), {'name': u'Blue Whale'})
+
+    def test_writes(self):
+        created = MySqliteModel.create(self.service, name=u'Orca', size=8)
+        eq_(created.id, 11)
+        MySqliteModel.update(self.service, id=created.id, size=9, active=True)
+        updated = MySqliteModel.find(self.service, id=created.id)[0]
+        eq_((updated.name, updated.size, updated.active), (u'Orca', 9, True))
+        eq_(json.loads(self.service.sum(endpoint_name='my_sqlite_model', return_fields=['size'], size={'lt': 10})), {'size': 14})
+        eq_(MySqliteModel.sum(self.service, return_fields=['size']).size, 71)
+
+        MySqliteModel.delete(self.service, name=u'Orca')
+        eq_(self.ids(name=u'Orca'), [])
+        (document, created) = self.service.get_or_create(endpoint_name='my_sqlite_model', name=u'Blue Whale')
+        eq_((json.loads(document)['id'], created), (1, False))
+        assert_raises(ValidationError, self.service.create, endpoint_name='my_sqlite_model', id=1)
+        assert_raises(ValidationError, self.service.update, endpoint_name='my_sqlite_model', size=1)
+
+        # a failed bulk write leaves nothing behind
+        assert_raises(ValidationError, self.service.create_many, endpoint_name='my_sqlite_model', records=[{'id': 50}, {'id': 1}])
+        eq_(self.ids(id=50), [])
+
+    def test_decimals(self):
+        for (id, price) in ((1, '9'), (2, '10'), (3, '100'), (10, '2.5')):
+            MySqliteModel.update(self.service, id=id, price=Decimal(price))
+        eq_(self.ids(price={'gt': Decimal('5')}, order_by={'price': 'ascending'}), [1, 2, 3])
+        eq_(self.ids(price={'lte': Decimal('10.0')}, order_by={'price': 'descending'}), [2, 1, 10])
+        eq_(self.ids(price=Decimal('2.50')), [10])
+        eq_(self.ids(order_by={'price': 'ascending'}), [10, 1, 2, 3])
+        total = MySqliteModel.sum(self.service, return_fields=['price']).price
+        eq_((total, type(total)), (Decimal('121.5'), Decimal))
+        eq_(MySqliteModel.sum(self.service, return_fields=['price'], size={'gt': 100}).price, Decimal('0'))
+
+    def test_count_and_exists(self):
+        eq_(MySqliteModel.count(self.service, size={'gt': 10}), 3)
+        eq_(MySqliteModel.count(self.service, name=u'whale', fuzzy=['name']), 3)
+        eq_(MySqliteModel.exists(self.service, name=u'Orca'), False)
+        eq_(MySqliteModel.exists(self.service, name=u'Blue Shark'), True)
+
+    def test_upsert(self):
+        model, created = MySqliteModel.create_or_update_by(self.service, by=['name'], name=u'Blue Whale', size=31)
+        eq_((model.id, model.size, created), (1, 31, False))
+        results = MySqliteModel.create_or_update_many_by(self.service, [{'name': u'Orca', 'size': 8}, {'name': u'Orca', 'size': 9},
+                                                                        {'name': u'Grey Whale', 'active': True}], by=['name'])
+        eq_([(model.id, model.size, created) for (model, created) in results], [(11, 8, True), (11, 9, False), (2, 15, False)])
+        eq_(MySqliteModel.find(self.service, id=2)[0].active, True)
+        model, created = MySqliteModel.get_or_create(self.service, name=u'Orca', size=1)
+        eq_((model.id, created), (12, True))
+
+    def test_statement_cache(self):
+        self.ids(name=u'Blue Whale')
+        count = len(self.service.statements)
+        self.ids(name=u'Grey Whale')
+        eq_(len(self.service.statements), count)
+        self.ids(size=5)
+        eq_(len(self.service.statements), count + 1)
+
+
+class SqliteFileTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_connection_pool(self):
+        path = os.path.join(self.directory, 'models.db')
+        service = SqliteService(path, {'models': MySqliteModel}, max_connections=2)
+        service.create(endpoint_name='models', name=u'Blue Whale', size=30)
+
+        def create(x):
+            service.create(endpoint_name='models', name=u'Whale %d' % x, size=x)
+            eq_(len(service.find(endpoint_name='models', size=x)), 1)
+        # short-lived threads share the pooled connections instead of opening one each
+        threads = [threading.Thread(target=create, args=(x,)) for x in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ok_(len(service.connections) <= 2)
+        eq_(len(service.idle_connections), len(service.connections))
+        service.close()
+        eq_(service.connections, [])
+
+        reopened = SqliteService(path, {'models': MySqliteModel})
+        eq_(len(reopened.find(endpoint_name='models')), 17)
+        reopened.close()
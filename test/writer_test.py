@@ -0,0 +1,104 @@
+import threading
+import time
+from unittest import TestCase
+
+from nose.tools import assert_raises, eq_, ok_
+
+from tinymodel.service import Service
+from tinymodel.utils import BufferFullError, ValidationError
+from tinymodel.writer import BufferedWriter
+from test.api_test import MyOtherModel
+
+
+class BufferedWriterTest(TestCase):
+    def setUp(self):
+        self.batches = []
+        self.calls = []
+        self.bulk_service = Service(return_type='json',
+                                    create=lambda **kwargs: self.calls.append(('create', kwargs)),
+                                    create_many=lambda endpoint_name, records: self.batches.append((endpoint_name, records)),
+                                    update=lambda **kwargs: self.calls.append(('update', kwargs)))
+        self.single_service = Service(return_type='json',
+                                      create=lambda **kwargs: self.calls.append(('create', kwargs)),
+                                      update=lambda **kwargs: self.calls.append(('update', kwargs)))
+
+    def test_flush_on_count(self):
+        writer = BufferedWriter(MyOtherModel, self.bulk_service, max_count=3, max_delay=10)
+        for x in range(7):
+            writer.create(id=x, my_float=1.0)
+        time.sleep(0.2)
+        eq_([len(records) for (endpoint_name, records) in self.batches], [3, 3])
+        eq_(self.batches[0][0], 'my_other_model')
+        eq_(self.batches[0][1][0], {'id': 0, 'my_float': 1.0})
+        writer.close()
+        eq_(sum(len(records) for (endpoint_name, records) in self.batches), 7)
+        assert_raises(BufferFullError, writer.create, id=8)
+
+    def test_flush_on_time_and_single_calls(self):
+        with BufferedWriter(MyOtherModel, self.single_service, max_delay=0.05) as writer:
+            writer.create(id=1)
+            writer.update(id=1, my_float=2.0)
+            time.sleep(0.3)
+            eq_(sorted(method_name for (method_name, kwargs) in self.calls), ['create', 'update'])
+            eq_(self.calls[-1][1]['endpoint_name'], 'my_other_model')
+
+    def test_order_per_record(self):
+        with BufferedWriter(MyOtherModel, self.single_service, max_delay=10) as writer:
+            writer.update(id=1, my_float=1.0)
+            writer.create(id=2, my_float=1.0)
+            writer.update(id=1, my_float=2.0)
+            writer.update(id=2, my_float=2.0)
+            writer.update(my_float=3.0)
+            writer.update(id=1, my_float=4.0)
+        # the updates of id 1 are merged, and the update of id 2 waits for its create, and the update without id for both
+        calls = [(method_name, kwargs.get('id'), kwargs['my_float']) for (method_name, kwargs) in self.calls]
+        eq_(sorted(calls[:2]), [('create', 2, 1.0), ('update', 1, 2.0)])
+        eq_(calls[2:], [('update', 2, 2.0), ('update', None, 3.0), ('update', 1, 4.0)])
+
+    def test_background_errors(self):
+        def update(**kwargs):
+            if kwargs['id'] == 2:
+                raise ValueError('update failed')
+            self.calls.append(('update', kwargs))
+        service = Service(return_type='json', create=lambda **kwargs: self.calls.append(('create', kwargs)), update=update)
+        writer = BufferedWriter(MyOtherModel, service, max_delay=0.05)
+        writer.create(id=1, my_float=1.0)
+        writer.update(id=2, my_float=2.0)
+        writer.update(id=1, my_float=3.0)
+        time.sleep(0.3)
+        # the create was written, so only the failed update and the wave after it are kept for a retry
+        eq_([(method_name, kwargs['id']) for (method_name, kwargs) in self.calls], [('create', 1)])
+        eq_([(method_name, params['id']) for (method_name, params) in writer.errors[0][1]], [('update', 2), ('update', 1)])
+        # the failure is raised by the next flush, once
+        assert_raises(ValueError, writer.close)
+        writer.flush()
+
+        failures = []
+        with BufferedWriter(MyOtherModel, service, max_delay=0.05, on_error=lambda e, calls: failures.append(calls)) as writer:
+            writer.update(id=2, my_float=2.0)
+            time.sleep(0.3)
+        eq_(len(failures), 1)
+
+    def test_flush_on_bytes(self):
+        writer = BufferedWriter(MyOtherModel, self.bulk_service, max_bytes=50, max_delay=10)
+        writer.create(id=1, my_float=1.0)
+        writer.create(id=2, my_float=1.0)
+        writer.create(id=3, my_float=1.0)
+        time.sleep(0.2)
+        ok_(self.batches)
+        writer.close()
+
+    def test_validation(self):
+        with BufferedWriter(MyOtherModel, self.bulk_service) as writer:
+            assert_raises(ValidationError, writer.create, id='foo')
+        eq_(self.batches, [])
+
+    def test_backpressure(self):
+        release = threading.Event()
+        service = Service(return_type='json', create=lambda **kwargs: release.wait())
+        writer = BufferedWriter(MyOtherModel, service, max_count=1, max_buffered=2, max_delay=10, block_timeout=0.1)
+        writer.create(id=1)
+        writer.create(id=2)
+        assert_raises(BufferFullError, writer.create, id=3)
+        release.set()
+        writer.close()
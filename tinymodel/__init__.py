@@ -1,20 +1,26 @@
 import copy
-import inflection
+import gc
+import time
 from datetime import datetime
-from dateutil import parser as date_parser
-from collections import Iterable
 
 from tinymodel.internals import(
     api,
+    binary_object,
+    change_tracking,
     defaults,
-    field_def_validation,
+    json_cache,
     json_object,
     random_object,
     foreign_object,
+    schema,
     validation,
 )
 
-from utils import ModelException
+from tinymodel import instrumentation
+from utils import LazyModule, ModelException, UnloadedFieldError
+
+date_parser = LazyModule('dateutil.parser')
+inflection = LazyModule('inflection')
 
 
 class FieldDef(object):
@@ -29,7 +35,7 @@ class FieldDef(object):
 
     def __init__(self, title, required=False, validate=True, allowed_types=None,
                  relationship='attribute', calculated=None, default_value=None, choices=[],
-                 custom_translators={}):
+                 custom_translators={}, depends_on=None):
         """
         Creates an instance of a FieldDef object
 
@@ -44,6 +50,10 @@ class FieldDef(object):
         :param object default_value: The default value assigned to required fields when they are sent to a data store
         :param list choices: A list of possible values that a field is constrained to.
         :param custom_translators: A dict of custom lambda functions that a field can use for to_json, from_json and random
+        :param list depends_on: Used in conjunction with calculated. The titles of the fields the calculated value depends on.
+                                If given, the calculated value is memoized per instance, and recalculated only after
+                                one of these fields is set or deleted. If None, the value is calculated on every access.
+                                Calculated fields listed here must declare depends_on too.
 
         Allowed types are represented by Python class definitions. Valid classes include
         all Python built-in types listed in TinyModel.SUPPORTED_BUILTINS. Also valid are
@@ -80,13 +90,15 @@ class FieldDef(object):
         self.validate = validate
         self.allowed_types = allowed_types
 
+        # build new lists, so that the list passed in by the caller is never modified
         if relationship == 'has_one':
-            self.allowed_types += [int, long, str, unicode]
+            self.allowed_types = list(allowed_types or []) + [int, long, str, unicode]
         elif relationship == 'has_many':
-            self.allowed_types += [[int], [long], [str], [unicode]]
+            self.allowed_types = list(allowed_types or []) + [[int], [long], [str], [unicode]]
 
         self.relationship = relationship
         self.calculated = calculated
+        self.depends_on = depends_on
         self.default_value = default_value
         self.choices = choices
         self.custom_translators = custom_translators
@@ -147,22 +159,28 @@ class TinyModel(object):
     It's recommended that any new SUPPORTED_METHODS that you define accept **kwargs in the method definition, to avoid parameter errors.
 
     """
-    VALIDATED_CLASSES = []
     COLLECTION_TYPES = defaults.COLLECTION_TYPES
+    SUPPORTED_METHODS = defaults.SUPPORTED_METHODS
+    SUPPORTED_BUILTINS = defaults.SUPPORTED_BUILTINS
     find = classmethod(api.find)
     create = classmethod(api.create)
+    create_many = classmethod(api.create_many)
     get_or_create = classmethod(api.get_or_create)
     update = classmethod(api.update)
     create_or_update_by = classmethod(api.create_or_update_by)
+    create_or_update_many_by = classmethod(api.create_or_update_many_by)
     delete = classmethod(api.delete)
     sum = classmethod(api.sum)
+    aggregate = schema.ModelMethod(api.aggregate, is_classmethod=True)
+    count = schema.ModelMethod(api.count, is_classmethod=True)
+    exists = schema.ModelMethod(api.exists, is_classmethod=True)
 
     def __repr__(self):
         """
         Override repr method for model
 
         """
-        fields_repr = '\n'.join(f.title + ": " + str(getattr(self, f.title)) for f in self.FIELD_DEFS if hasattr(self, f.title))
+        fields_repr = '\n'.join(f.title + ": " + str(getattr(self, f.title)) for f in schema.compile_schema(type(self)).field_defs if hasattr(self, f.title))
         return str(self.__class__) + "\nFIELDS:\n" + fields_repr + "\n"
 
     def __setattr__(self, key, value):
@@ -175,13 +193,25 @@ class TinyModel(object):
         If the key does not exist in FIELD_DEFS then an error is raised.
 
         """
-        this_field_def = next((f for f in self.FIELD_DEFS if f.title == key or f.alias == key), False)
+        this_field_def = schema.compile_schema(type(self)).get_field_def(key)
         if this_field_def:
             if type(value) in [str, unicode] and datetime in this_field_def.allowed_types:
+                if instrumentation.ENABLED:
+                    instrumentation.count('dateutil_parse', type(self))
                 try:
                     value = date_parser.parse(value)
                 except ValueError:
                     pass
+            if self.ORIGINAL_VALUES is not None:
+                if this_field_def.title in self.LAZY_FIELDS:
+                    json_object.load_lazy_field(self, this_field_def)
+                change_tracking.record_original(self, this_field_def.title, change_tracking.current_value(self, this_field_def.title))
+            if self.LAZY_FIELDS:
+                self.LAZY_FIELDS.pop(this_field_def.title, None)
+            if self.JSON_CACHE is not None:
+                json_cache.invalidate(self)
+            if self.CALCULATED_VALUES:
+                self.__invalidate_calculated_values(this_field_def.title)
             this_field = next((f for f in self.FIELDS if f.field_def.title == this_field_def.title), None)
             if not this_field:
                 self.FIELDS.append(Field(field_def=this_field_def, value=value))
@@ -196,15 +226,29 @@ class TinyModel(object):
         Overrides __getattr__ to get the field value
 
         """
-        my_field_defs = object.__getattribute__(self, 'FIELD_DEFS')
-        this_field_def = next((f for f in my_field_defs if f.title == name or f.alias == name), None)
+        this_field_def = schema.compile_schema(type(self)).get_field_def(name)
         if this_field_def and this_field_def.calculated:
-            return this_field_def.calculated(self)
+            if this_field_def.depends_on is None:
+                if instrumentation.ENABLED:
+                    instrumentation.count('calculated_evaluation', type(self))
+                return this_field_def.calculated(self)
+            calculated_values = object.__getattribute__(self, 'CALCULATED_VALUES')
+            if this_field_def.title not in calculated_values:
+                if instrumentation.ENABLED:
+                    instrumentation.count('calculated_evaluation', type(self))
+                calculated_values[this_field_def.title] = this_field_def.calculated(self)
+            return calculated_values[this_field_def.title]
 
         self_fields = object.__getattribute__(self, 'FIELDS')
         this_field = next((f for f in self_fields if f.field_def == this_field_def), None)
         if this_field:
             return this_field.value
+        elif this_field_def and this_field_def.title in object.__getattribute__(self, 'LAZY_FIELDS'):
+            return json_object.load_lazy_field(self, this_field_def)
+        elif this_field_def and object.__getattribute__(self, 'LOADED_FIELDS') is not None \
+                and this_field_def.title not in object.__getattribute__(self, 'LOADED_FIELDS'):
+            raise UnloadedFieldError('Field "' + this_field_def.title + '" was not loaded on this ' + str(self.__class__) +
+                                     " instance. Loaded fields are: " + str(sorted(self.LOADED_FIELDS)))
         else:
             raise AttributeError(str(self.__class__) + " has no field " + name)
 
@@ -213,15 +257,33 @@ class TinyModel(object):
         Overrides __delattr__ to remove the field
 
         """
+        if self.ORIGINAL_VALUES is not None and name in self.LAZY_FIELDS:
+            json_object.load_lazy_field(self, schema.compile_schema(type(self)).get_field_def(name))
         self_fields = super(TinyModel, self).__getattribute__('FIELDS')
         this_field = next((f for f in self_fields if f.field_def.title == name), None)
         if this_field:
+            change_tracking.record_original(self, name, this_field.value)
             self.FIELDS.remove(this_field)
+        elif name in self.LAZY_FIELDS:
+            del self.LAZY_FIELDS[name]
         else:
             raise AttributeError(str(type(self)) + " has no field " + name)
+        if self.JSON_CACHE is not None:
+            json_cache.invalidate(self)
+        if self.CALCULATED_VALUES:
+            self.__invalidate_calculated_values(name)
+
+    def __invalidate_calculated_values(self, title):
+        """
+        Drops the memoized values of the calculated fields that depend on the given field, directly or through
+        other calculated fields.
+
+        """
+        for dependent_title in schema.compile_schema(type(self)).get_dependents(title):
+            self.CALCULATED_VALUES.pop(dependent_title, None)
 
     def __init__(self, from_json=False, from_foreign_model=False, random=False,
-                 model_recursion_depth=1, attribs_only=False, preprocessed=False, set_defaults=True, **kwargs):
+                 model_recursion_depth=1, attribs_only=False, preprocessed=False, set_defaults=True, lazy=False, **kwargs):
         """
         Checks validity of type definitions and initializes the Model
 
@@ -230,6 +292,8 @@ class TinyModel(object):
         :param bool random: A flag indicating whether the model properties should be initialized to random values.
         :param int model_recursion_depth: Used in conjunction with random. Determines how many times to recurse when generating parents and children.
         :param bool preprocessed: A flag indicating whether from_json has already been through a JSON preprocessor
+        :param bool lazy: Used in conjunction with from_json. Keeps the parsed JSON values and translates each field
+                          only when it is first accessed.
         :param objects **kwargs: The initial values of each field can be passed in as a keyword parameter.
                                Values are not validated until you call Model.validate()
 
@@ -238,22 +302,19 @@ class TinyModel(object):
         object.__setattr__(self, 'VALIDATION_FAILURES', [])
         object.__setattr__(self, 'JSON_FAILURES', [])
         object.__setattr__(self, 'REMOVED_FIELDS', [])
-
-        # set supported methods and builtins
-        if not self.__dict__.get('SUPPORTED_METHODS'):
-            super(TinyModel, self).__setattr__('SUPPORTED_METHODS', defaults.SUPPORTED_METHODS)
-        if not self.__dict__.get('SUPPORTED_BUILTINS'):
-            super(TinyModel, self).__setattr__('SUPPORTED_BUILTINS', defaults.SUPPORTED_BUILTINS)
+        object.__setattr__(self, 'LAZY_FIELDS', {})
+        object.__setattr__(self, 'LOADED_FIELDS', None)
+        object.__setattr__(self, 'CALCULATED_VALUES', {})
+        object.__setattr__(self, 'ORIGINAL_VALUES', None)
+        object.__setattr__(self, 'JSON_CACHE', None)
+        object.__setattr__(self, 'JSON_PARENTS', None)
 
         # validate model definition if it hasn't been already
-        if type(self) not in self.VALIDATED_CLASSES:
-            field_def_validation.validate_builtin_method_support(self)
-            field_def_validation.validate_field_types(self)
-            self.VALIDATED_CLASSES.append(type(self))
+        schema.compile_schema(type(self))
 
         # set initial values
         if from_json:
-            initial_attributes = self.__from_json(from_json, preprocessed=preprocessed)
+            initial_attributes = self.__from_json(from_json, preprocessed=preprocessed, lazy=lazy)
         elif from_foreign_model:
             initial_attributes = self.__from_foreign_model(from_foreign_model)
         elif random:
@@ -266,7 +327,9 @@ class TinyModel(object):
             setattr(self, key, value)
         if set_defaults:
             # set default values for fields not passed
-            for this_field_def in set(self.FIELD_DEFS) - set(f.field_def for f in self.FIELDS):
+            for this_field_def in set(schema.compile_schema(type(self)).field_defs) - set(f.field_def for f in self.FIELDS):
+                if this_field_def.title in self.LAZY_FIELDS:
+                    continue
                 if this_field_def.has_valid_default_value() and not this_field_def.title in ['id']:  # if not, let it raise an Exception, warning about missing data
                     setattr(self, this_field_def.title, this_field_def.default_value)
 
@@ -274,10 +337,20 @@ class TinyModel(object):
     __from_foreign_model = foreign_object.from_foreign_model
     __from_random = random_object.random
     to_json = json_object.to_json
+    to_json_graph = classmethod(json_object.to_json_graph)
+    from_json_graph = classmethod(json_object.from_json_graph)
+    to_bytes = binary_object.to_bytes
+    from_bytes = classmethod(binary_object.from_bytes)
+    to_bytes_many = classmethod(binary_object.to_bytes_many)
+    from_bytes_many = classmethod(binary_object.from_bytes_many)
     validate = validation.validate
+    changes = schema.ModelMethod(change_tracking.changes)
+    mark_clean = schema.ModelMethod(change_tracking.mark_clean)
+    save = schema.ModelMethod(api.save)
+    update_changed = schema.ModelMethod(api.update_changed, is_classmethod=True)
 
-    def from_json(self, model_as_json, preprocessed=False):
-        return self.__from_json(self, model_as_json, preprocessed)
+    def from_json(self, model_as_json, preprocessed=False, lazy=False):
+        return self.__from_json(self, model_as_json, preprocessed, lazy)
 
     def random(self, model_recursion_depth=1, attribs_only=False):
         return self.__from_random(self, model_recursion_depth, attribs_only)
@@ -296,6 +369,7 @@ class TinyModel(object):
         else:
             copy_of_self = self
 
+        json_object.load_lazy_fields(copy_of_self)
         for field in copy_of_self.FIELDS:
             if field.field_def.relationship == 'has_one':
                 if hasattr(field.value, 'id'):
@@ -305,3 +379,55 @@ class TinyModel(object):
                     setattr(copy_of_self, field.field_def.title, [o.id for o in field.value])
 
         return copy_of_self
+
+
+def __model_classes(cls):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        for descendant in __model_classes(subclass):
+            yield descendant
+
+
+def compile_all(classes=None, freeze=False):
+    """
+    Compiles the schemas and binary serializers of TinyModel classes up front, instead of on their first use.
+
+    This is meant to be called once in a pre-forking master, after all of the model modules are imported.
+    Compiled schemas are never modified afterwards, so forked workers share them without redoing the work.
+    Classes without FIELD_DEFS are treated as abstract bases and skipped. Classes that fail validation are reported
+    and left uncompiled, so that the error is raised on their first use, as it would be without warm-up.
+
+    :param list(class) classes: The classes to compile. Defaults to every subclass of TinyModel that has been imported.
+    :param bool freeze: If True, and the garbage collector supports it (gc.freeze), moves every object tracked so far
+                        to the permanent generation, so that collections in the workers do not touch their pages.
+
+    :rtype dict: 'classes' holds the compiled classes, 'failures' maps classes that failed validation to the error,
+                 and 'seconds' holds how long the warm-up took.
+
+    """
+    started_at = time.time()
+    if classes is None:
+        classes = [cls for cls in __model_classes(TinyModel) if getattr(cls, 'FIELD_DEFS', None)]
+
+    compiled = []
+    failures = {}
+    for cls in classes:
+        if cls in compiled or cls in failures:
+            continue
+        try:
+            schema.compile_schema(cls)
+            binary_object.get_plan(cls)
+        except Exception as e:
+            failures[cls] = e
+        else:
+            compiled.append(cls)
+
+    if freeze and hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+    return {
+        'classes': compiled,
+        'failures': failures,
+        'seconds': time.time() - started_at,
+    }
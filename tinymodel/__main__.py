@@ -0,0 +1,6 @@
+import sys
+
+from tinymodel.cli import main
+
+
+sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Bulk validation, conversion and profiling of model dumps.
+
+Usage:
+    python -m tinymodel app.models.Post posts.ndjson
+    python -m tinymodel app.models.Post posts.ndjson --output posts.bin --to binary --workers 4
+    python -m tinymodel app.models.Post posts.bin --output posts.json --to array --chunk-size 5000
+
+The input holds NDJSON, a JSON array, or the binary format written by --to binary, and its format is detected.
+Every record is loaded and validated, in chunks processed by a pool of worker processes, and the valid records
+are written to the output, in order. The report gives the rows/sec, the number of records that failed to load
+or to validate, and the fields that took the longest to load. Fields are timed for JSON input only, since binary
+chunks are decoded at once.
+
+The binary format is a header followed by length-prefixed payloads of TinyModel.to_bytes_many, one per chunk.
+A binary chunk that cannot be decoded (e.g. written for another version of the model) counts as a single load error,
+and so does a truncated binary file or a malformed JSON array, which ends the input.
+
+"""
+import argparse
+import struct
+import sys
+import time
+
+from tinymodel.internals.field_def_validation import import_class
+from tinymodel.internals.json_object import load_lazy_field
+from tinymodel.internals.schema import compile_schema
+from tinymodel.parallel import JSON_ARRAY, NDJSON, iter_records, ordered_map
+from tinymodel.utils import LazyModule, ModelException, ValidationError
+
+j = LazyModule('json')
+
+BINARY = 'binary'
+FORMATS = (NDJSON, JSON_ARRAY, BINARY)
+BINARY_MAGIC = 'TMS\x01'
+CHUNK_LENGTH = struct.Struct('<Q')
+# the error messages kept per chunk, for the report
+MAX_MESSAGES = 5
+
+
+def load_model_class(path):
+    """
+    Returns the TinyModel class referenced by a dotted path, resolved like the string class references of FIELD_DEFS.
+
+    :raises ValueError: if the path does not reference a TinyModel class
+    """
+    from tinymodel import TinyModel
+    try:
+        cls = import_class(path)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise ValueError("Cannot import model class " + path + ": " + str(e))
+    if not isinstance(cls, type) or not issubclass(cls, TinyModel):
+        raise ValueError(path + " is not a TinyModel class")
+    return cls
+
+
+def __is_binary(fp):
+    position = fp.tell()
+    is_binary = fp.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+    if not is_binary:
+        fp.seek(position)
+    return is_binary
+
+
+def __iter_binary_chunks(fp):
+    """
+    Yields the to_bytes_many payloads of a binary file, after its header.
+    A truncated chunk is yielded as a ModelException, to be reported as a load error, and ends the file.
+    """
+    index = 0
+    while True:
+        length = fp.read(CHUNK_LENGTH.size)
+        if not length:
+            return
+        if len(length) < CHUNK_LENGTH.size:
+            yield ModelException('Truncated binary input: the length of chunk %d is cut short' % index)
+            return
+        size = CHUNK_LENGTH.unpack(length)[0]
+        payload = fp.read(size)
+        if len(payload) < size:
+            yield ModelException('Truncated binary input: chunk %d holds %d bytes out of %d' % (index, len(payload), size))
+            return
+        yield payload
+        index += 1
+
+
+def __load_models(cls, records, stats):
+    """ Loads the models of a chunk of records, timing the translation of every field. """
+    models = []
+    field_seconds = stats['field_seconds']
+    for (index, record) in enumerate(records):
+        try:
+            if isinstance(record, basestring):
+                record = j.loads(record)
+            tinymodel = cls(from_json=record, preprocessed=True, lazy=True)
+            for field_def in compile_schema(type(tinymodel)).field_defs:
+                if field_def.title in tinymodel.LAZY_FIELDS:
+                    started_at = time.time()
+                    load_lazy_field(tinymodel, field_def)
+                    field_seconds[field_def.title] = field_seconds.get(field_def.title, 0.0) + time.time() - started_at
+        except Exception as e:
+            stats['load_errors'] += 1
+            if len(stats['messages']) < MAX_MESSAGES:
+                stats['messages'].append((index, '%s: %s' % (type(e).__name__, e)))
+            models.append(None)
+        else:
+            models.append(tinymodel)
+    return models
+
+
+def __process_chunk(args):
+    """
+    Loads, validates and converts a chunk of records.
+
+    :rtype tuple: The converted valid records (a list of JSON strs, a to_bytes_many payload, or None), and the stats,
+                  with messages as (index of the record in the chunk, message) pairs. The index is None for the errors
+                  of a whole binary chunk, whose records are unknown.
+    """
+    (cls, records, validate, to_format) = args
+    stats = {'rows': 0, 'load_errors': 0, 'validation_errors': 0, 'messages': [], 'field_seconds': {}}
+    if isinstance(records, ModelException):
+        stats['load_errors'] += 1
+        stats['messages'].append((None, str(records)))
+        models = []
+    elif isinstance(records, str) and records.startswith('TMB'):
+        try:
+            models = cls.from_bytes_many(records)
+        except Exception as e:
+            stats['load_errors'] += 1
+            stats['messages'].append((None, 'Cannot decode binary chunk: %s: %s' % (type(e).__name__, e)))
+            models = []
+    else:
+        models = __load_models(cls, records, stats)
+    stats['rows'] = len(models)
+
+    valid_models = []
+    for (index, tinymodel) in enumerate(models):
+        if tinymodel is None:
+            continue
+        if validate:
+            try:
+                tinymodel.validate()
+            except ValidationError as e:
+                stats['validation_errors'] += 1
+                if len(stats['messages']) < MAX_MESSAGES:
+                    stats['messages'].append((index, str(e).replace('\n', ' ')))
+                continue
+        valid_models.append(tinymodel)
+
+    if to_format == BINARY:
+        return (cls.to_bytes_many(valid_models) if valid_models else None), stats
+    if to_format is not None:
+        return [tinymodel.to_json() for tinymodel in valid_models], stats
+    return None, stats
+
+
+def __tasks(cls, fp, chunk_size, validate, to_format):
+    chunks = __iter_binary_chunks(fp) if __is_binary(fp) else iter_records(fp, chunk_size)
+    try:
+        for records in chunks:
+            yield (cls, records, validate, to_format)
+    except ModelException as e:
+        # e.g. a truncated JSON array, reported as a load error like a truncated binary chunk
+        yield (cls, e, validate, to_format)
+
+
+def __write(output, converted, to_format, written):
+    if to_format == BINARY:
+        if converted:
+            output.write(CHUNK_LENGTH.pack(len(converted)) + converted)
+    elif converted:
+        if to_format == NDJSON:
+            output.write('\n'.join(converted) + '\n')
+        else:
+            output.write((',\n' if written else '\n') + ',\n'.join(converted))
+
+
+def run(cls, fp, output=None, to_format=NDJSON, validate=True, chunk_size=1000, workers=1):
+    """
+    Loads, validates and converts the records of a file.
+
+    :param class cls: The TinyModel class of the records
+    :param file fp: The input file, holding NDJSON, a JSON array or the binary format
+    :param file output: Optional. The file to write the valid records to, in to_format
+    :param bool validate: False to only load the records
+    :param int chunk_size: The number of JSON records processed per task
+    :param int workers: The number of worker processes
+
+    :rtype dict: The stats: rows, load_errors, validation_errors, seconds, messages, and field_seconds,
+                 the time spent loading every field
+    """
+    if to_format not in FORMATS:
+        raise ValueError('Unknown format %r. Supported formats are: %s' % (to_format, FORMATS))
+    totals = {'rows': 0, 'load_errors': 0, 'validation_errors': 0, 'messages': [], 'field_seconds': {}}
+    started_at = time.time()
+    if output is not None:
+        output.write(BINARY_MAGIC if to_format == BINARY else '[' if to_format == JSON_ARRAY else '')
+    written = 0
+    tasks = __tasks(cls, fp, chunk_size, validate, to_format if output is not None else None)
+    for (converted, stats) in ordered_map(__process_chunk, tasks, workers):
+        if output is not None:
+            __write(output, converted, to_format, written)
+            written += len(converted) if isinstance(converted, list) else 0
+        # the number of records of a binary chunk is only known once it is decoded, so records are numbered here
+        totals['messages'].extend(('record %d: %s' % (totals['rows'] + index, message)) if index is not None else
+                                  ('after record %d: %s' % (totals['rows'], message))
+                                  for (index, message) in stats['messages'][:MAX_MESSAGES - len(totals['messages'])])
+        for key in ('rows', 'load_errors', 'validation_errors'):
+            totals[key] += stats[key]
+        for (title, seconds) in stats['field_seconds'].items():
+            totals['field_seconds'][title] = totals['field_seconds'].get(title, 0.0) + seconds
+    if output is not None and to_format == JSON_ARRAY:
+        output.write('\n]\n')
+    totals['seconds'] = time.time() - started_at
+    return totals
+
+
+def format_report(stats, slowest=5):
+    """ Returns a human-readable report of the stats returned by run. """
+    lines = ['%d rows in %.2fs (%.1f rows/sec)' % (stats['rows'], stats['seconds'], stats['rows'] / max(stats['seconds'], 1e-6)),
+             '%d load errors, %d validation errors' % (stats['load_errors'], stats['validation_errors'])]
+    lines.extend('  ' + message for message in stats['messages'])
+    fields = sorted(stats['field_seconds'].items(), key=lambda (title, seconds): -seconds)[:slowest]
+    if fields:
+        lines.append('slowest fields to load:')
+        lines.extend('  %-30s %8.3fs %8.1f us/row' % (title, seconds, seconds * 1e6 / max(stats['rows'], 1))
+                     for (title, seconds) in fields)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tinymodel', description="Validates, converts and profiles model dumps.")
+    parser.add_argument('model', help="the import path of the TinyModel class, e.g. app.models.Post")
+    parser.add_argument('input', help="the input file: NDJSON, a JSON array, or the binary format")
+    parser.add_argument('-o', '--output', help="write the valid records to this file")
+    parser.add_argument('--to', choices=FORMATS, default=NDJSON, help="the format of the output (default: ndjson)")
+    parser.add_argument('--no-validate', action='store_true', help="only load the records, without validating them")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="the number of records per task (default: 1000)")
+    parser.add_argument('--workers', type=int, default=1, help="the number of worker processes (default: 1)")
+    parser.add_argument('--slowest', type=int, default=5, help="the number of slowest fields to report (default: 5)")
+    args = parser.parse_args(argv)
+
+    try:
+        cls = load_model_class(args.model)
+    except ValueError as e:
+        parser.error(str(e))
+    with open(args.input, 'rb') as fp:
+        if args.output:
+            with open(args.output, 'wb') as output:
+                stats = run(cls, fp, output, args.to, not args.no_validate, args.chunk_size, args.workers)
+        else:
+            stats = run(cls, fp, None, args.to, not args.no_validate, args.chunk_size, args.workers)
+    sys.stderr.write(format_report(stats, args.slowest) + '\n')
+    return 1 if stats['load_errors'] or stats['validation_errors'] else 0
@@ -0,0 +1,186 @@
+"""
+Opt-in instrumentation of the tinymodel hot paths.
+
+    from tinymodel import instrumentation
+    instrumentation.enable()
+    ...
+    instrumentation.snapshot()
+
+While enabled, __setattr__, __getattr__, from_json, to_json, validate, from_foreign_model and the api methods
+are counted and timed per model class (and per service endpoint, for api methods), and slow fallback paths
+(dateutil parses, JSON recasts in from_json, calculated field evaluations) are counted.
+
+When disabled, the wrappers are uninstalled and the slow path counters cost a single check of ENABLED.
+
+"""
+import threading
+import time
+
+from tinymodel.internals.schema import ModelMethod
+
+
+ENABLED = False
+METRICS = {}
+METRICS_LOCK = threading.Lock()
+SINK = None
+
+# TinyModel attributes that are wrapped while instrumentation is enabled, with the names they are reported as
+MODEL_METHODS = (
+    ('__setattr__', '__setattr__'),
+    ('__getattr__', '__getattr__'),
+    ('_TinyModel__from_json', 'from_json'),
+    ('to_json', 'to_json'),
+    ('validate', 'validate'),
+    ('_TinyModel__from_foreign_model', 'from_foreign_model'),
+)
+# the api methods are the TinyModel attributes defined in this module, found when instrumentation is enabled
+API_MODULE = 'tinymodel.internals.api'
+
+__originals = {}
+
+
+def __record(name, model, endpoint, seconds):
+    key = (name, model, endpoint)
+    with METRICS_LOCK:
+        metric = METRICS.get(key)
+        if metric is None:
+            metric = METRICS[key] = [0, 0.0]
+        metric[0] += 1
+        metric[1] += seconds
+
+
+def __metrics_list():
+    return [{'name': name, 'model': model, 'endpoint': endpoint, 'count': metric[0], 'seconds': metric[1]}
+            for ((name, model, endpoint), metric) in sorted(METRICS.items())]
+
+
+def count(name, cls, endpoint=None):
+    """
+    Counts an occurrence of a slow path. Callers check ENABLED first, so that nothing is called while disabled.
+
+    :param str name: The name of the metric
+    :param class cls: The model class, or None when the caller has no model at hand
+    :param str endpoint: The service endpoint, if any
+
+    """
+    __record(name, cls.__name__ if cls is not None else None, endpoint, 0.0)
+
+
+def __timed_method(name, method):
+    def timed(self, *args, **kwargs):
+        started_at = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            __record(name, type(self).__name__, None, time.time() - started_at)
+    timed.__name__ = method.__name__
+    timed.__doc__ = method.__doc__
+    return timed
+
+
+def __api_methods(model_class):
+    """ Yields the name, function and kind (class or instance method) of the api methods of a model class. """
+    for (name, attribute) in sorted(model_class.__dict__.items()):
+        function = getattr(attribute, '__func__', attribute)
+        if getattr(function, '__module__', None) == API_MODULE and callable(function):
+            yield (name, function, getattr(attribute, 'is_classmethod', isinstance(attribute, classmethod)))
+
+
+def __timed_api_method(name, function, is_classmethod):
+    import inflection
+    import inspect
+
+    def timed(receiver, service, *args, **kwargs):
+        # class methods are called on the model class, and instance methods (e.g. save) on a model
+        cls = receiver if is_classmethod else type(receiver)
+        endpoint = inspect.getcallargs(function, receiver, service, *args, **kwargs).get('endpoint_name') or inflection.underscore(cls.__name__)
+        started_at = time.time()
+        try:
+            return function(receiver, service, *args, **kwargs)
+        finally:
+            __record('api.' + name, cls.__name__, endpoint, time.time() - started_at)
+    timed.__name__ = function.__name__
+    timed.__doc__ = function.__doc__
+    return timed
+
+
+def enable(sink=None):
+    """
+    Installs the instrumentation wrappers on TinyModel and starts counting the slow paths.
+
+    :param callable sink: Optional. Receives the snapshot of the metrics every time flush() is called.
+
+    """
+    global ENABLED, SINK
+    from tinymodel import TinyModel
+    if sink is not None:
+        SINK = sink
+    if ENABLED:
+        return
+    for (attribute, name) in MODEL_METHODS:
+        __originals[attribute] = TinyModel.__dict__[attribute]
+        setattr(TinyModel, attribute, __timed_method(name, __originals[attribute]))
+    for (name, function, is_classmethod) in list(__api_methods(TinyModel)):
+        __originals[name] = TinyModel.__dict__[name]
+        timed = __timed_api_method(name, function, is_classmethod)
+        if isinstance(__originals[name], ModelMethod):
+            setattr(TinyModel, name, ModelMethod(timed, is_classmethod))
+        else:
+            setattr(TinyModel, name, classmethod(timed) if is_classmethod else timed)
+    ENABLED = True
+
+
+def disable():
+    """ Uninstalls the instrumentation wrappers. The metrics recorded so far are kept until reset(). """
+    global ENABLED
+    from tinymodel import TinyModel
+    if not ENABLED:
+        return
+    ENABLED = False
+    for (attribute, original) in __originals.items():
+        setattr(TinyModel, attribute, original)
+    __originals.clear()
+
+
+def snapshot():
+    """
+    Returns the metrics recorded so far.
+
+    :rtype list(dict): One dict per metric, model class and endpoint, with the keys
+                       'name', 'model', 'endpoint', 'count' and 'seconds' (the total time spent, 0 for counters)
+
+    """
+    with METRICS_LOCK:
+        return __metrics_list()
+
+
+def reset():
+    """ Clears the metrics recorded so far. """
+    with METRICS_LOCK:
+        METRICS.clear()
+
+
+def set_sink(sink):
+    """
+    Sets the callable that flush() sends snapshots to, e.g. to forward them to statsd or a log.
+
+    :param callable sink: Called with the list returned by snapshot(). None removes the sink.
+
+    """
+    global SINK
+    SINK = sink
+
+
+def flush():
+    """
+    Sends the metrics recorded so far to the sink, and resets them.
+
+    :rtype list(dict): The snapshot that was flushed
+
+    """
+    with METRICS_LOCK:
+        metrics = __metrics_list()
+        METRICS.clear()
+    if SINK is not None:
+        SINK(metrics)
+    return metrics
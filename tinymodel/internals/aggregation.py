@@ -0,0 +1,216 @@
+"""
+Client-side aggregation, for services without an <aggregate> method.
+
+Rows are added page by page, as dicts of the grouped and aggregated fields, into running per-group accumulators
+(counts, sums, minimums and maximums), so that memory grows with the number of groups and not with the number of rows.
+The accumulators of float fields are NumPy arrays updated with one vectorized operation per page when NumPy
+is installed, and arrays of the array module updated in a loop otherwise. Int fields are accumulated as python ints,
+which do not overflow, and Decimal fields are summed exactly, so that their results do not depend on NumPy.
+
+"""
+from array import array
+from decimal import Decimal
+
+
+NUMPY = []
+
+
+def get_numpy():
+    """ Returns the numpy module, or None if it is not installed. It is imported on first use, since it is slow to import. """
+    if not NUMPY:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        NUMPY.append(numpy)
+    return NUMPY[0]
+
+
+def value_kind(field_def):
+    """ Returns how the values of a field are accumulated: as 'int', 'float', 'decimal' or 'other' values. """
+    allowed_types = set(field_def.allowed_types)
+    if allowed_types and allowed_types <= set([int, long]):
+        return 'int'
+    if allowed_types and allowed_types <= set([int, long, float]):
+        return 'float'
+    if allowed_types and allowed_types <= set([int, long, float, Decimal]):
+        return 'decimal'
+    return 'other'
+
+
+def _sort_key(key):
+    return tuple((value is not None, value) for value in key)
+
+
+class Aggregator(object):
+
+    """
+    Aggregates rows by group.
+
+        aggregator = Aggregator(['country'], {'views': 'sum', 'score': 'avg'}, {'views': 'int', 'score': 'float'})
+        aggregator.add([{'country': u'FR', 'views': 10, 'score': 0.5}, ...])
+        aggregator.results()  # [{'country': u'FR', 'views': 10, 'score': 0.5}, ...]
+
+    """
+
+    def __init__(self, group_by, metrics, kinds, use_numpy=True):
+        """
+        :param list(str) group_by: The fields to group by
+        :param dict metrics: The operation to compute for every field: one of count, sum, avg, min or max
+        :param dict kinds: The value_kind of every aggregated field
+        :param bool use_numpy: False to use the array module even if NumPy is installed
+        """
+        self.group_by = tuple(group_by)
+        self.metrics = dict(metrics)
+        self.kinds = dict((field_name, kinds.get(field_name, 'other')) for field_name in self.metrics)
+        self.numpy = get_numpy() if use_numpy else None
+        self.group_keys = []
+        self.group_indexes = {}
+        self.counts = {}
+        self.sums = {}
+        self.extremes = {}
+        for field_name in self.metrics:
+            self.counts[field_name] = self.__new_accumulator('count', self.kinds[field_name])
+            if self.metrics[field_name] in ('sum', 'avg'):
+                self.sums[field_name] = self.__new_accumulator('sum', self.kinds[field_name])
+            elif self.metrics[field_name] in ('min', 'max'):
+                self.extremes[field_name] = self.__new_accumulator(self.metrics[field_name], self.kinds[field_name])
+
+    def __is_vectorized(self, kind):
+        # int64 accumulators would wrap around on overflow, so only floats are vectorized
+        return self.numpy is not None and kind == 'float'
+
+    def __new_accumulator(self, operation, kind):
+        """ Returns the accumulator of an operation on the values of a field of the given kind. """
+        if self.__is_vectorized(kind):
+            return self.numpy.zeros(0, dtype=self.numpy.int64 if operation == 'count' else self.numpy.float64)
+        if operation == 'count':
+            return array('l')
+        if kind == 'float' and operation == 'sum':
+            return array('d')
+        # python ints do not overflow, and Decimals stay exact
+        return []
+
+    def __grow(self, accumulators, count, operation=None):
+        """ Adds the accumulators of count new groups. The operation defaults to the metric of every field. """
+        for (field_name, accumulator) in accumulators.items():
+            this_operation = operation or self.metrics[field_name]
+            kind = 'int' if this_operation == 'count' else self.kinds[field_name]
+            if self.__is_vectorized(self.kinds[field_name]):
+                initial = 0
+                if this_operation in ('min', 'max'):
+                    limits = self.numpy.finfo(accumulator.dtype)
+                    initial = limits.max if this_operation == 'min' else limits.min
+                accumulators[field_name] = self.numpy.concatenate([accumulator, self.numpy.full(count, initial, dtype=accumulator.dtype)])
+            elif this_operation in ('min', 'max'):
+                accumulator.extend([None] * count)
+            else:
+                accumulator.extend([Decimal(0) if kind == 'decimal' else 0] * count)
+
+    @staticmethod
+    def __converter(kind):
+        if kind == 'int':
+            return int
+        if kind == 'float':
+            return float
+        if kind == 'decimal':
+            return lambda value: value if isinstance(value, Decimal) else Decimal(unicode(value))
+        return lambda value: value
+
+    def add(self, rows):
+        """
+        Adds rows to the aggregation.
+
+        :param list(dict) rows: The rows, with the values of the grouped and aggregated fields
+        """
+        indexes = []
+        new_groups = 0
+        for row in rows:
+            key = tuple(row.get(field_name) for field_name in self.group_by)
+            index = self.group_indexes.get(key)
+            if index is None:
+                index = self.group_indexes[key] = len(self.group_keys)
+                self.group_keys.append(key)
+                new_groups += 1
+            indexes.append(index)
+        if new_groups:
+            self.__grow(self.counts, new_groups, 'count')
+            self.__grow(self.sums, new_groups, 'sum')
+            self.__grow(self.extremes, new_groups)
+
+        for field_name in self.metrics:
+            convert = self.__converter(self.kinds[field_name])
+            present = [(index, convert(row[field_name])) for (index, row) in zip(indexes, rows) if row.get(field_name) is not None]
+            if self.__is_vectorized(self.kinds[field_name]):
+                self.__add_vectorized(field_name, present)
+            else:
+                self.__add_iterated(field_name, present)
+
+    def __add_vectorized(self, field_name, present):
+        if not present:
+            return
+        numpy = self.numpy
+        group_indexes = numpy.fromiter((index for (index, value) in present), dtype=numpy.int64, count=len(present))
+        counts = self.counts[field_name]
+        counts += numpy.bincount(group_indexes, minlength=len(counts))
+        operation = self.metrics[field_name]
+        if operation == 'count':
+            return
+        accumulator = self.sums.get(field_name, self.extremes.get(field_name))
+        values = numpy.fromiter((value for (index, value) in present), dtype=accumulator.dtype, count=len(present))
+        if operation in ('sum', 'avg'):
+            numpy.add.at(accumulator, group_indexes, values)
+        elif operation == 'min':
+            numpy.minimum.at(accumulator, group_indexes, values)
+        else:
+            numpy.maximum.at(accumulator, group_indexes, values)
+
+    def __add_iterated(self, field_name, present):
+        counts = self.counts[field_name]
+        operation = self.metrics[field_name]
+        for (index, value) in present:
+            counts[index] += 1
+        if operation in ('sum', 'avg'):
+            sums = self.sums[field_name]
+            for (index, value) in present:
+                sums[index] += value
+        elif operation == 'min':
+            extremes = self.extremes[field_name]
+            for (index, value) in present:
+                if extremes[index] is None or value < extremes[index]:
+                    extremes[index] = value
+        elif operation == 'max':
+            extremes = self.extremes[field_name]
+            for (index, value) in present:
+                if extremes[index] is None or value > extremes[index]:
+                    extremes[index] = value
+
+    def __python_value(self, value):
+        return value.item() if self.numpy is not None and isinstance(value, self.numpy.generic) else value
+
+    def results(self):
+        """
+        :rtype list(dict): One dict per group, sorted by the values of the grouped fields, with the values of
+                           the grouped fields and the result of every metric. Metrics of groups without values are None,
+                           except counts.
+        """
+        if not self.group_by and not self.group_indexes:
+            # like SQL, an aggregation without groups has a row even if there are no records
+            return [dict((field_name, 0 if operation == 'count' else None) for (field_name, operation) in self.metrics.items())]
+        results = []
+        for (key, index) in sorted(self.group_indexes.items(), key=lambda (key, index): _sort_key(key)):
+            result = dict(zip(self.group_by, key))
+            for (field_name, operation) in self.metrics.items():
+                count = int(self.counts[field_name][index])
+                if operation == 'count':
+                    value = count
+                elif operation == 'sum':
+                    value = self.__python_value(self.sums[field_name][index]) if count else None
+                elif operation == 'avg':
+                    total = self.__python_value(self.sums[field_name][index])
+                    value = (total / count if isinstance(total, Decimal) else float(total) / count) if count else None
+                else:
+                    value = self.__python_value(self.extremes[field_name][index]) if count else None
+                result[field_name] = value
+            results.append(result)
+        return results
@@ -1,14 +1,30 @@
-import inflection
-from tinymodel.internals import defaults
+import datetime
+import decimal
+
+from tinymodel.internals import change_tracking, defaults, json_cache
+from tinymodel.internals.aggregation import Aggregator, value_kind
+from tinymodel.internals.concurrency import call_all
+from tinymodel.internals.schema import compile_schema
 from tinymodel.internals.validation import (
     match_field_values,
     remove_calculated_values,
     remove_has_many_values,
     remove_float_values,
     remove_datetime_values,
+    validate_aggregation,
     validate_order_by,
     validate_fuzzy_fields,
+    validate_projection,
 )
+from tinymodel.utils import LazyModule
+
+inflection = LazyModule('inflection')
+j = LazyModule('json')
+
+# only reads are hedged, since a duplicated write could be applied twice
+HEDGED_METHODS = ('find', 'sum')
+# the types whose values bound the <find> of create_or_update_many_by with a range lookup
+RANGE_TYPES = (int, long, decimal.Decimal, datetime.datetime)
 
 
 def render_to_response(cls, response, return_type='json', *alien_params):
@@ -57,6 +73,8 @@ def render_to_response(cls, response, return_type='json', *alien_params):
             is_list = False
             response = [cls(from_json=response)]
 
+    for o in response:
+        change_tracking.mark_clean(o)
     response = [response] if is_list else response
     response.extend(alien_params)
     return response
@@ -81,6 +99,74 @@ def __get_resp_with_alien_params(response):
     return response, alien_params
 
 
+def __resolve_projection(cls, only=None, exclude=None):
+    """
+    Resolves only/exclude to the list of stored fields a service should fetch. The id field is always fetched unless excluded.
+
+    :rtype list(str)|None: The titles of the fields to fetch, or None if there is no projection.
+
+    """
+    projection = validate_projection(cls, only, exclude)
+    if projection is None:
+        return None
+    if 'id' not in (exclude or []) and 'id' in [f.title for f in compile_schema(cls).field_defs]:
+        projection.append('id')
+    return [f.title for f in compile_schema(cls).field_defs if f.title in projection and not f.calculated]
+
+
+def __copy_model(model):
+    """ Returns a new instance with the fields of a model, so that the model itself is left untouched. """
+    from tinymodel import Field
+    copied = type(model)(set_defaults=False)
+    copied.FIELDS.extend(Field(field_def=field.field_def, value=field.value) for field in model.FIELDS)
+    copied.LAZY_FIELDS.update(model.LAZY_FIELDS)
+    return copied
+
+
+def __apply_projection(response, projection, return_type='json'):
+    """
+    Marks models as projected, so that accessing a field outside of the projection raises an UnloadedFieldError.
+    Fields outside of the projection (e.g. filled in from default values) are removed.
+    The models of a 'tinymodel' response belong to the service (e.g. to its cache), so copies of them are projected.
+
+    :param [tinymodel.TinyModel|list(tinymodel.TinyModel)] response: The model or models to mark
+    :param list(str) projection: The titles of the loaded fields
+    :param str return_type: The return_type of the service the response comes from
+
+    :rtype [tinymodel.TinyModel|list(tinymodel.TinyModel)]: The projected model or models
+    """
+    loaded_fields = frozenset(projection)
+    if return_type == 'tinymodel':
+        response = [__copy_model(model) for model in response] if isinstance(response, list) else __copy_model(response)
+    for model in (response if isinstance(response, list) else [response]):
+        for field in [f for f in model.FIELDS if f.field_def.title not in loaded_fields]:
+            model.FIELDS.remove(field)
+        for title in [t for t in model.LAZY_FIELDS if t not in loaded_fields]:
+            del model.LAZY_FIELDS[title]
+        object.__setattr__(model, 'LOADED_FIELDS', loaded_fields)
+        json_cache.invalidate(model)
+        change_tracking.mark_clean(model)
+    return response
+
+
+def normalize_params(cls, set_model_defaults=False, **kwargs):
+    """
+    Translates and validates the params of a service call the way every api method does:
+    through a model instance, without calculated values, and matched against the field types.
+
+    :param tinymodel.TinyModel cls: The class the params belong to.
+    :param boolean set_model_defaults: True to fill in the default values of the missing fields.
+    :param dict kwargs: The params to normalize.
+
+    :rtype dict: The params to send to the service.
+
+    """
+    kwargs = cls(set_defaults=set_model_defaults, **kwargs).to_json(return_raw=True)
+    kwargs = remove_calculated_values(cls, **kwargs)
+    match_field_values(cls, **kwargs)
+    return kwargs
+
+
 def __call_api_method(cls, service, method_name, endpoint_name=None,
                       set_model_defaults=False, return_fields=[], **kwargs):
     """
@@ -99,6 +185,9 @@ def __call_api_method(cls, service, method_name, endpoint_name=None,
     """
     # find special params
     extra_params = {}
+    projection = kwargs.pop('only', None)
+    if projection is not None:
+        extra_params['only'] = projection
     if method_name == 'find':
         extra_params['limit'] = kwargs.pop('limit')
         extra_params['offset'] = kwargs.pop('offset')
@@ -113,9 +202,7 @@ def __call_api_method(cls, service, method_name, endpoint_name=None,
         if 'fuzzy_match_exclude' in kwargs:
             extra_params['fuzzy_match_exclude'] = kwargs.pop('fuzzy_match_exclude')
 
-    kwargs = cls(set_defaults=set_model_defaults, **kwargs).to_json(return_raw=True)
-    kwargs = remove_calculated_values(cls, **kwargs)
-    match_field_values(cls, **kwargs)
+    kwargs = normalize_params(cls, set_model_defaults, **kwargs)
 
     if not hasattr(service, method_name):
         raise AttributeError('The given service need a "%s" method!' % method_name)
@@ -123,17 +210,30 @@ def __call_api_method(cls, service, method_name, endpoint_name=None,
     if endpoint_name is None:
         endpoint_name = inflection.underscore(cls.__name__)
     kwargs.update(extra_params)
+    kwargs['endpoint_name'] = endpoint_name
     if method_name == 'sum':
-        response = getattr(service, method_name)(endpoint_name=endpoint_name, return_fields=return_fields, **kwargs)
+        kwargs['return_fields'] = return_fields
+    hedging_policy = getattr(service, 'hedging_policy', None)
+    if hedging_policy is not None and method_name in HEDGED_METHODS:
+        response = hedging_policy.call(method_name, getattr(service, method_name), **kwargs)
     else:
-        response = getattr(service, method_name)(endpoint_name=endpoint_name, **kwargs)
+        response = getattr(service, method_name)(**kwargs)
     response, alien_params = __get_resp_with_alien_params(response)
-    return render_to_response(cls, response, service.return_type, *alien_params)
+    response = render_to_response(cls, response, service.return_type, *alien_params)
+    if projection is not None:
+        response[0] = __apply_projection(response[0], projection, service.return_type)
+    return response
 
 
 def find(cls, service, endpoint_name=None, limit=None, offset=None, order_by={},
-         fuzzy=[], fuzzy_match_exclude=[], expand_related=False, **kwargs):
-    """ Performs a search operation given the passed arguments. """
+         fuzzy=[], fuzzy_match_exclude=[], expand_related=False, only=None, exclude=None, **kwargs):
+    """
+    Performs a search operation given the passed arguments.
+    If only or exclude are given, they are validated and sent to the service as the list of fields to fetch.
+    """
+    projection = __resolve_projection(cls, only, exclude)
+    if projection is not None:
+        kwargs['only'] = projection
     kwargs = remove_has_many_values(cls, **kwargs)
     kwargs = remove_float_values(cls, **kwargs)
     validate_order_by(cls, order_by)
@@ -153,6 +253,26 @@ def create(cls, service, endpoint_name=None, **kwargs):
     return __call_api_method(cls, service, 'create', endpoint_name, True, **kwargs)[0]
 
 
+def create_many(cls, service, records, endpoint_name=None):
+    """
+    Performs a bulk create of several records, each given as a dict of params.
+    The records are validated like in create. Services with a <create_many(endpoint_name, records)> method
+    create them in one call, other services get one <create> call per record.
+
+    :rtype list(tinymodel.TinyModel): The created models, in order.
+    """
+    if endpoint_name is None:
+        endpoint_name = inflection.underscore(cls.__name__)
+    records = [normalize_params(cls, True, **record) for record in records]
+    if not records:
+        return []
+    if hasattr(service, 'create_many'):
+        response = service.create_many(endpoint_name=endpoint_name, records=records)
+    else:
+        response = [service.create(endpoint_name=endpoint_name, **record) for record in records]
+    return render_to_response(cls, list(response), service.return_type)[0]
+
+
 def delete(cls, service, endpoint_name=None, **kwargs):
     """Performs a delete operation given the passed arguments, ignoring default values."""
     kwargs = remove_has_many_values(cls, **kwargs)
@@ -161,26 +281,67 @@ def delete(cls, service, endpoint_name=None, **kwargs):
     return __call_api_method(cls, service, 'delete', endpoint_name, **kwargs)[0]
 
 
-def get_or_create(cls, service, endpoint_name=None, **kwargs):
+def get_or_create(cls, service, endpoint_name=None, only=None, exclude=None, **kwargs):
     """
-    Performs a <get_or_create> operation. Optionally <find> and <create> service
-    methods may be used instead of a service-specific <get_or_create>
+    Performs a <get_or_create> operation. With a service-specific <upsert> method, it is a single call that creates
+    the record unless one matches, and leaves a matching record unchanged. Otherwise, <find> and <create> service
+    methods are used.
+    A projection given by only or exclude is used by the <find>, and applied to the created model as well.
     """
-    found = find(cls, service, endpoint_name, **kwargs)
+    projection = __resolve_projection(cls, only, exclude)
+    if hasattr(service, 'upsert') and not kwargs.get('fuzzy'):
+        params = normalize_params(cls, False, **kwargs)
+        # matched like find matches, i.e. without float and has_many values
+        by = remove_float_values(cls, **remove_has_many_values(cls, **dict(params))).keys()
+        if by:
+            model, created = __upsert(cls, service, endpoint_name, by, params, update=False)
+            if projection is not None:
+                model = __apply_projection(model, projection, service.return_type)
+            return model, created
+
+    found = find(cls, service, endpoint_name, limit=1, only=only, exclude=exclude, **kwargs)
     if found:
         return found[0], False
-    return create(cls, service, endpoint_name, **kwargs), True
+    created = create(cls, service, endpoint_name, **kwargs)
+    if projection is not None:
+        created = __apply_projection(created, projection, service.return_type)
+    return created, True
 
 
-def update(cls, service, endpoint_name=None, **kwargs):
-    """ Performs an update matching the given arguments. """
+def update(cls, service, endpoint_name=None, only=None, exclude=None, **kwargs):
+    """ Performs an update matching the given arguments, fetching back only the projected fields if a projection is given. """
+    projection = __resolve_projection(cls, only, exclude)
+    if projection is not None:
+        kwargs['only'] = projection
     return __call_api_method(cls, service, 'update', endpoint_name, False, **kwargs)[0]
 
 
+def __upsert(cls, service, endpoint_name, by, params, update=True):
+    """ Calls the <upsert> method of a service, and returns the rendered (model, created) pair. """
+    item, created = service.upsert(endpoint_name=endpoint_name or inflection.underscore(cls.__name__), by=list(by),
+                                   update=update, **params)
+    return render_to_response(cls, item, service.return_type)[0], created
+
+
 def create_or_update_by(cls, service, by=[], endpoint_name=None, **kwargs):
+    """
+    Updates the record whose values of the fields in by match the given arguments, or creates it if there is none.
+
+    Services with an <upsert(endpoint_name, by, update, **kwargs)> method do both in a single call, which returns
+    the (record, created) pair. Other services get a <find> call, then an <update> or <create> call. Services that
+    support projections only fetch the id of the existing record.
+
+    :rtype tuple: The created or updated model, and True if it was created
+    """
     kwargs_find = filter(lambda (k, v): k in by, kwargs.items())
     if not kwargs_find:
         raise ValueError("Missing values for 'by' parameter.")
+    if hasattr(service, 'upsert'):
+        return __upsert(cls, service, endpoint_name, by, normalize_params(cls, False, **kwargs))
+    # only the id of the existing record is needed
+    projection = __id_projection(cls, service)
+    if projection is not None:
+        kwargs_find.extend([('limit', 1), ('only', projection)])
     found_objects = find(cls=cls, service=service, endpoint_name=endpoint_name, **dict(kwargs_find))
     if found_objects:
         kwargs_update = filter(lambda (k, v): k not in by, kwargs.items())
@@ -189,6 +350,195 @@ def create_or_update_by(cls, service, by=[], endpoint_name=None, **kwargs):
     return create(cls, service, endpoint_name, **kwargs), True
 
 
+def __by_key(cls, values):
+    """ Returns a hashable key of the values of the by fields of a record, as translated by its model. """
+    return j.dumps(sorted(cls(set_defaults=False, **values).to_json(return_raw=True).items()), default=unicode)
+
+
+def __batch_filter(cls, records, by):
+    """
+    Returns the filter of a <find> that fetches the records matching any of the given values of the by fields:
+    the values shared by all of the records, and the range of the values of ordered types (e.g. ints or datetimes).
+
+    :rtype dict|None: The params of the <find>, or None if it cannot filter on every by field, e.g. for a field
+                      missing from a record, or for strs that differ between records
+    """
+    field_defs = dict((field_def.title, field_def) for field_def in compile_schema(cls).field_defs)
+    params = {}
+    for field_name in by:
+        values = [record.get(field_name) for record in records]
+        field_def = field_defs.get(field_name)
+        # find does not filter on floats and has_many fields
+        if None in values or field_def is None or float in field_def.allowed_types or field_def.relationship == 'has_many':
+            return None
+        if all(value == values[0] for value in values[1:]):
+            params[field_name] = values[0]
+        elif all(type(value) in RANGE_TYPES and type(value) in field_def.allowed_types for value in values):
+            params[field_name] = {'gte': min(values), 'lte': max(values)}
+        else:
+            return None
+    return params
+
+
+def create_or_update_many_by(cls, service, records, by=[], endpoint_name=None, concurrency=8, page_size=1000):
+    """
+    The batch form of create_or_update_by.
+
+    Services with an <upsert_many(endpoint_name, by, records)> method get a single call, which returns a (record, created)
+    pair per record. Otherwise, records with the same values of the fields in by are merged (later values win),
+    and the existing records are looked up with a single <find>, fetched page_size at a time and matched on the values
+    of the fields in by. The find is filtered by the values of these fields that all records share, and by the range
+    of the values of ordered types, such as ints or datetimes. If it cannot filter on every field in by (e.g. for strs
+    that differ between records), the existing records are looked up with one <find> per distinct key instead,
+    up to concurrency at a time. The missing records are created in one create_many, and the existing ones that have
+    values to set are updated, up to concurrency at a time.
+
+    :param list(dict) records: The params of every record
+    :param int concurrency: The maximum number of concurrent <find> and <update> calls, without <upsert_many>
+    :param int page_size: The number of records to fetch per <find> call, without <upsert_many>
+
+    :rtype list(tuple): The created or updated model, and True if it was created, for every record, in order
+    """
+    if not records:
+        return []
+    for record in records:
+        if not [k for k in by if k in record]:
+            raise ValueError("Missing values for 'by' parameter.")
+    if endpoint_name is None:
+        endpoint_name = inflection.underscore(cls.__name__)
+    if hasattr(service, 'upsert_many'):
+        params = [normalize_params(cls, False, **record) for record in records]
+        response = service.upsert_many(endpoint_name=endpoint_name, by=list(by), records=params)
+        return [(render_to_response(cls, item, service.return_type)[0], created) for (item, created) in response]
+
+    keys = []
+    record_keys = []
+    merged = {}
+    # the by fields of every key, since records may not all have the same ones
+    key_fields = set()
+    for record in records:
+        fields = tuple(k for k in by if k in record)
+        key = __by_key(cls, dict((k, record[k]) for k in fields))
+        record_keys.append(key)
+        if key not in merged:
+            keys.append(key)
+            merged[key] = {}
+            key_fields.add(fields)
+        merged[key].update(record)
+
+    found = {}
+    params = __batch_filter(cls, records, by)
+    if params is not None:
+        order_by = {'id': 'ascending'} if __has_id(cls) else {}
+        offset = 0
+        while True:
+            page = find(cls, service, endpoint_name, limit=page_size, offset=offset, order_by=order_by, **params)
+            for model in page:
+                for fields in key_fields:
+                    key = __by_key(cls, dict((k, getattr(model, k, None)) for k in fields))
+                    # the first match wins, like the find of create_or_update_by
+                    if key in merged and key not in found:
+                        found[key] = model
+            if len(page) < page_size:
+                break
+            offset += page_size
+    else:
+        def find_call(key):
+            return lambda: find(cls, service, endpoint_name, limit=1, **dict((k, v) for (k, v) in merged[key].items() if k in by))
+        for start in range(0, len(keys), concurrency):
+            batch = keys[start:start + concurrency]
+            for (key, models) in zip(batch, call_all([find_call(key) for key in batch])):
+                if models:
+                    found[key] = models[0]
+
+    results = {}
+    missing = [key for key in keys if key not in found]
+    for (key, model) in zip(missing, create_many(cls, service, [merged[key] for key in missing], endpoint_name)):
+        results[key] = (model, True)
+
+    def update_call(key):
+        params = dict((k, v) for (k, v) in merged[key].items() if k not in by)
+        if not params:
+            return lambda: found[key]
+        params['id'] = found[key].id
+
+        def call():
+            updated = update(cls, service, endpoint_name, **params)
+            # services may return the updated record in a list
+            if isinstance(updated, list):
+                return updated[0] if updated else found[key]
+            return updated
+        return call
+    existing = [key for key in keys if key in found]
+    for start in range(0, len(existing), concurrency):
+        batch = existing[start:start + concurrency]
+        for (key, model) in zip(batch, call_all([update_call(key) for key in batch])):
+            results[key] = (model, False)
+
+    return [results[key] for key in record_keys]
+
+
+def __changed_params(tinymodel):
+    """
+    Returns the params of an update that saves the changes of a model: its id and the current values of its changed fields.
+    Deleted fields are left out, since service updates only set values.
+
+    :rtype dict|None: The params, or None if nothing changed
+    """
+    params = dict((title, current) for (title, (original, current)) in change_tracking.changes(tinymodel).items()
+                  if change_tracking.current_value(tinymodel, title) is not change_tracking.ABSENT)
+    if not params:
+        return None
+    if change_tracking.current_value(tinymodel, 'id') in (None, change_tracking.ABSENT):
+        raise ValueError('Cannot save the changes of a model without an id.')
+    params['id'] = tinymodel.id
+    return params
+
+
+def save(tinymodel, service, endpoint_name=None):
+    """
+    Saves a model. A model loaded from the service is saved by an <update> call with its id and its changed fields only,
+    or not at all if nothing changed. Other models are saved by a <create> call with all of their fields,
+    and get the values of the created record (e.g. its id).
+    Either way, the saved values become the original values of the model, see TinyModel.changes.
+
+    :rtype tinymodel.TinyModel: The saved model
+    """
+    cls = type(tinymodel)
+    if tinymodel.ORIGINAL_VALUES is None and change_tracking.current_value(tinymodel, 'id') in (None, change_tracking.ABSENT):
+        params = dict((title, current) for (title, (original, current)) in change_tracking.changes(tinymodel).items())
+        created = create(cls, service, endpoint_name, **params)
+        for field in created.FIELDS:
+            setattr(tinymodel, field.field_def.title, field.value)
+    else:
+        params = __changed_params(tinymodel)
+        if params is not None:
+            update(cls, service, endpoint_name, **params)
+    return change_tracking.mark_clean(tinymodel)
+
+
+def update_changed(cls, service, models, endpoint_name=None, concurrency=8):
+    """
+    Saves the changes of several models loaded from a service, with one <update> call per changed model,
+    up to concurrency at a time. Every call sends the id and the changed fields of its model only.
+
+    :param list(tinymodel.TinyModel) models: The models to save
+    :param int concurrency: The maximum number of concurrent service calls
+
+    :rtype list(tinymodel.TinyModel): The models that changed, and were updated
+    """
+    changed = [(model, __changed_params(model)) for model in models]
+    changed = [(model, params) for (model, params) in changed if params is not None]
+
+    def update_call(params):
+        return lambda: update(cls, service, endpoint_name, **params)
+    for start in range(0, len(changed), concurrency):
+        call_all([update_call(params) for (model, params) in changed[start:start + concurrency]])
+    for (model, params) in changed:
+        change_tracking.mark_clean(model)
+    return [model for (model, params) in changed]
+
+
 def sum(cls, service, endpoint_name=None, return_fields=[], **kwargs):
     """
     Performs a sum aggregation over return_fields matching the given arguments.
@@ -201,3 +551,147 @@ def sum(cls, service, endpoint_name=None, return_fields=[], **kwargs):
     kwargs = remove_float_values(cls, **kwargs)
     return __call_api_method(cls, service, 'sum', endpoint_name,
                              return_fields=return_fields, **kwargs)[0]
+
+
+def __aggregation_rows(response):
+    """ Returns the rows of an <aggregate> response, whether it is a JSON str, a list of JSON strs or a list of dicts. """
+    if isinstance(response, basestring):
+        response = j.loads(response)
+    return [j.loads(row) if isinstance(row, basestring) else row for row in (response or [])]
+
+
+def __item_values(item, field_names):
+    """ Reads fields from an item of a <find> response, whether it is a JSON str, a dict or an object. """
+    if isinstance(item, basestring):
+        item = j.loads(item)
+    if isinstance(item, dict):
+        return dict((field_name, item.get(field_name)) for field_name in field_names)
+    return dict((field_name, getattr(item, field_name, None)) for field_name in field_names)
+
+
+def aggregate(cls, service, group_by=[], metrics={}, endpoint_name=None, page_size=1000, **kwargs):
+    """
+    Computes count, sum, avg, min or max aggregations of the records matching the given arguments, grouped by the values of group_by.
+
+    The aggregation is pushed down to the <aggregate(endpoint_name, group_by, metrics, **kwargs)> method of the service
+    if it has one. Otherwise, the records are fetched with <find>, page_size at a time and only with the grouped
+    and aggregated fields if the service supports projections, and aggregated on the client without building models.
+
+        MyModel.aggregate(service, group_by=['country'], metrics={'views': 'sum', 'score': 'avg'}, active=True)
+        # [{'country': u'FR', 'views': 1200, 'score': 0.75}, {'country': u'US', 'views': 3400, 'score': 0.5}]
+
+    :param list(str) group_by: The fields to group by. Without them, the result has a single row.
+    :param dict metrics: The aggregation of every field: one of count, sum, avg, min or max
+    :param int page_size: The number of records to fetch per <find> call, for services without an <aggregate> method
+
+    :rtype list(dict): One dict per group, sorted by the values of group_by, with the values of the grouped fields
+                       and the result of every metric.
+    """
+    validate_aggregation(cls, group_by, metrics)
+    if endpoint_name is None:
+        endpoint_name = inflection.underscore(cls.__name__)
+    kwargs = remove_has_many_values(cls, **kwargs)
+    kwargs = remove_float_values(cls, **kwargs)
+    kwargs = normalize_params(cls, False, **kwargs)
+
+    if hasattr(service, 'aggregate'):
+        rows = __aggregation_rows(service.aggregate(endpoint_name=endpoint_name, group_by=list(group_by), metrics=dict(metrics), **kwargs))
+    else:
+        field_defs = dict((field_def.title, field_def) for field_def in compile_schema(cls).field_defs)
+        aggregator = Aggregator(group_by, metrics, dict((field_name, value_kind(field_defs[field_name])) for field_name in metrics))
+        field_names = list(group_by) + [field_name for field_name in metrics if field_name not in group_by]
+        # a stable order, so that pages neither skip nor repeat records
+        order_by = {'id': 'ascending'} if 'id' in field_defs else {}
+        if getattr(service, 'supports_projection', False):
+            kwargs['only'] = field_names
+        offset = 0
+        while True:
+            page = service.find(endpoint_name=endpoint_name, limit=page_size, offset=offset, order_by=order_by, fuzzy=[],
+                                fuzzy_match_exclude=[], expand_related=False, **kwargs) or []
+            aggregator.add([__item_values(item, field_names) for item in page])
+            if len(page) < page_size:
+                break
+            offset += page_size
+        rows = aggregator.results()
+
+    # group values, minimums and maximums are field values, which JSON responses give as strs (e.g. datetimes)
+    field_names = list(group_by) + [field_name for (field_name, operation) in metrics.items() if operation in ('min', 'max')]
+    for row in rows:
+        encoded = dict((field_name, row[field_name]) for field_name in field_names if isinstance(row.get(field_name), basestring))
+        if encoded:
+            decoded = cls(from_json=j.dumps(encoded))
+            row.update((field_name, getattr(decoded, field_name)) for field_name in encoded)
+    return rows
+
+
+def __filter_params(cls, endpoint_name, fuzzy, fuzzy_match_exclude, **kwargs):
+    """ Validates and translates the filters of a query the way find does, and returns the params to send to the service. """
+    kwargs = remove_has_many_values(cls, **kwargs)
+    kwargs = remove_float_values(cls, **kwargs)
+    if fuzzy:
+        validate_fuzzy_fields(cls, fuzzy)
+    kwargs = normalize_params(cls, False, **kwargs)
+    kwargs.update({
+        'endpoint_name': endpoint_name or inflection.underscore(cls.__name__),
+        'fuzzy': fuzzy,
+        'fuzzy_match_exclude': fuzzy_match_exclude,
+    })
+    return kwargs
+
+
+def __has_id(cls):
+    return compile_schema(cls).get_field_def('id') is not None
+
+
+def __id_projection(cls, service):
+    """ Returns the projection of the calls that only need ids, for services that support projections. """
+    return ['id'] if getattr(service, 'supports_projection', False) and __has_id(cls) else None
+
+
+def count(cls, service, endpoint_name=None, fuzzy=[], fuzzy_match_exclude=[], page_size=1000, **kwargs):
+    """
+    Counts the records matching the given arguments, which are validated like in find.
+
+    Uses the <count> method of the service if it has one. Otherwise, the ids of the matching records are fetched
+    with <find>, page_size at a time, and counted without building models. Services that support projections only fetch the ids.
+
+    :rtype int: The number of matching records
+    """
+    kwargs = __filter_params(cls, endpoint_name, fuzzy, fuzzy_match_exclude, **kwargs)
+    if hasattr(service, 'count'):
+        response = service.count(**kwargs)
+        return int(j.loads(response) if isinstance(response, basestring) else response)
+
+    kwargs.update({'limit': page_size, 'expand_related': False, 'order_by': {'id': 'ascending'} if __has_id(cls) else {}})
+    projection = __id_projection(cls, service)
+    if projection is not None:
+        kwargs['only'] = projection
+    total = 0
+    while True:
+        page = service.find(offset=total, **kwargs) or []
+        total += len(page)
+        if len(page) < page_size:
+            return total
+
+
+def exists(cls, service, endpoint_name=None, fuzzy=[], fuzzy_match_exclude=[], **kwargs):
+    """
+    Checks whether any record matches the given arguments, which are validated like in find.
+
+    Uses the <exists> method of the service if it has one, then its <count> method.
+    Otherwise, the id of a single record is fetched with <find>.
+
+    :rtype bool: True if a record matches
+    """
+    kwargs = __filter_params(cls, endpoint_name, fuzzy, fuzzy_match_exclude, **kwargs)
+    if hasattr(service, 'exists'):
+        response = service.exists(**kwargs)
+        return bool(j.loads(response) if isinstance(response, basestring) else response)
+    if hasattr(service, 'count'):
+        response = service.count(**kwargs)
+        return int(j.loads(response) if isinstance(response, basestring) else response) > 0
+    kwargs.update({'limit': 1, 'offset': 0, 'order_by': {}, 'expand_related': False})
+    projection = __id_projection(cls, service)
+    if projection is not None:
+        kwargs['only'] = projection
+    return bool(service.find(**kwargs))
@@ -0,0 +1,405 @@
+import hashlib
+import struct
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from tinymodel.internals import defaults
+from tinymodel.internals.json_object import load_lazy_fields
+from tinymodel.internals.schema import SCHEMA_LOCK, compile_schema
+from tinymodel.utils import LazyModule, ModelException
+
+j = LazyModule('json')
+pytz = LazyModule('pytz')
+
+
+MAGIC = 'TMB'
+FORMAT_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 1 + 8
+EPOCH = datetime(1970, 1, 1)
+
+# value tags
+(TAG_NONE, TAG_TRUE, TAG_FALSE, TAG_INT, TAG_LONG, TAG_FLOAT, TAG_DECIMAL, TAG_STR, TAG_UNICODE,
+ TAG_NAIVE_DATETIME, TAG_AWARE_DATETIME, TAG_LIST, TAG_TUPLE, TAG_SET, TAG_DICT, TAG_MODEL, TAG_OBJECT) = range(17)
+
+COLLECTION_TAGS = {list: TAG_LIST, tuple: TAG_TUPLE, set: TAG_SET}
+FLOAT_FORMAT = struct.Struct('<d')
+
+__PLANS = {}
+
+
+class BinaryPlan(object):
+
+    """
+    Per-class encoding plan, derived once from FIELD_DEFS.
+    Holds the stored (non-calculated) field defs in position order, the user-defined classes
+    each field may contain, and the schema fingerprint written into every header.
+
+    """
+
+    def __init__(self, field_defs, classes, fingerprint):
+        self.field_defs = field_defs
+        self.positions = dict((f.title, index) for index, f in enumerate(field_defs))
+        self.classes = classes
+        self.bitmap_size = (len(field_defs) + 7) // 8
+        self.fingerprint = fingerprint
+        self.header = MAGIC + chr(FORMAT_VERSION) + fingerprint
+
+
+def __user_classes(cls, allowed_types, found=None):
+    """
+    Collects every user-defined class referenced by a (possibly nested) allowed_types structure.
+    The position of a class in the result is what gets written to the stream for TAG_MODEL / TAG_OBJECT values.
+
+    """
+    found = [] if found is None else found
+    for field_type in allowed_types:
+        if isinstance(field_type, dict):
+            __user_classes(cls, field_type.keys() + field_type.values(), found)
+        elif type(field_type) in (list, tuple, set):
+            __user_classes(cls, list(field_type), found)
+        elif isinstance(field_type, type) and field_type not in defaults.SUPPORTED_BUILTINS and field_type not in found:
+            found.append(field_type)
+    return found
+
+
+def __type_signature(field_type):
+    if isinstance(field_type, dict):
+        return '{' + ','.join(__type_signature(k) + ':' + __type_signature(v) for (k, v) in field_type.items()) + '}'
+    elif type(field_type) in (list, tuple, set):
+        return type(field_type).__name__ + '(' + ','.join(__type_signature(t) for t in field_type) + ')'
+    elif isinstance(field_type, type):
+        return field_type.__module__ + '.' + field_type.__name__
+    return repr(field_type)
+
+
+def __fingerprint(cls, field_defs):
+    """
+    An 8-byte digest of the stored fields: their order, titles, relationships and allowed types.
+    Any change to one of these produces a new fingerprint, and old payloads are rejected instead of misread.
+
+    """
+    description = '|'.join(f.title + ':' + f.relationship + ':' + ','.join(__type_signature(t) for t in f.allowed_types)
+                           for f in field_defs)
+    return hashlib.md5(description).digest()[:8]
+
+
+def get_plan(cls):
+    """
+    Returns the BinaryPlan for a TinyModel class, validating the class definition first if needed.
+
+    """
+    plan = __PLANS.get(cls)
+    if plan is None:
+        with SCHEMA_LOCK:
+            plan = __PLANS.get(cls)
+            if plan is None:
+                field_defs = tuple(f for f in compile_schema(cls).field_defs if not f.calculated)
+                classes = tuple(tuple(__user_classes(cls, f.allowed_types)) for f in field_defs)
+                plan = __PLANS[cls] = BinaryPlan(field_defs, classes, __fingerprint(cls, field_defs))
+    return plan
+
+
+def schema_fingerprint(cls):
+    """ Returns the hex schema fingerprint that versions the binary format of a TinyModel class. """
+    return get_plan(cls).fingerprint.encode('hex')
+
+
+def __write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def __write_signed(out, value):
+    __write_varint(out, value << 1 if value >= 0 else ((-value) << 1) - 1)
+
+
+def __read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def __read_signed(data, pos):
+    value, pos = __read_varint(data, pos)
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1), pos
+
+
+def __write_bytes(out, value):
+    __write_varint(out, len(value))
+    out.extend(value)
+
+
+def __write_value(tinymodel, out, value, classes):
+    """
+    Appends the tagged binary representation of a field value to out.
+    Nested collection types are written by recursion.
+
+    :param bytearray out: The output buffer
+    :param object value: The value to write
+    :param tuple classes: The user-defined classes the enclosing field is allowed to contain
+
+    """
+    type_of_value = type(value)
+    if value is None:
+        out.append(TAG_NONE)
+    elif type_of_value is bool:
+        out.append(TAG_TRUE if value else TAG_FALSE)
+    elif type_of_value in (int, long):
+        out.append(TAG_INT if type_of_value is int else TAG_LONG)
+        __write_signed(out, value)
+    elif type_of_value is float:
+        out.append(TAG_FLOAT)
+        out.extend(FLOAT_FORMAT.pack(value))
+    elif type_of_value is str:
+        out.append(TAG_STR)
+        __write_bytes(out, value)
+    elif type_of_value is unicode:
+        out.append(TAG_UNICODE)
+        __write_bytes(out, value.encode('utf-8'))
+    elif type_of_value is datetime:
+        offset = value.utcoffset()
+        if offset is None:
+            out.append(TAG_NAIVE_DATETIME)
+            delta = value - EPOCH
+        else:
+            out.append(TAG_AWARE_DATETIME)
+            delta = value.replace(tzinfo=None) - offset - EPOCH
+            __write_signed(out, (offset.days * 86400 + offset.seconds) // 60)
+        __write_signed(out, (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+    elif type_of_value is Decimal:
+        out.append(TAG_DECIMAL)
+        __write_bytes(out, str(value))
+    elif type_of_value in COLLECTION_TAGS:
+        out.append(COLLECTION_TAGS[type_of_value])
+        __write_varint(out, len(value))
+        for element in value:
+            __write_value(tinymodel, out, element, classes)
+    elif type_of_value is dict:
+        out.append(TAG_DICT)
+        __write_varint(out, len(value))
+        for (key, element) in value.items():
+            __write_value(tinymodel, out, key, classes)
+            __write_value(tinymodel, out, element, classes)
+    else:
+        class_index = next((index for (index, c) in enumerate(classes) if isinstance(value, c)), None)
+        if class_index is None:
+            raise ModelException("to_bytes translation error: " + str(type_of_value) + " is not one of the allowed types " + str(list(classes)))
+        if hasattr(value, 'FIELD_DEFS'):
+            out.append(TAG_MODEL)
+            __write_varint(out, class_index)
+            __write_bytes(out, __encode_body(value, get_plan(classes[class_index])))
+        else:
+            out.append(TAG_OBJECT)
+            __write_varint(out, class_index)
+            __write_bytes(out, value.to_json())
+
+
+def __read_value(cls, data, pos, classes):
+    """
+    Reads one tagged value from data, starting at pos.
+
+    :rtype tuple: The decoded value, and the position right after it
+
+    """
+    tag = ord(data[pos])
+    pos += 1
+    if tag == TAG_NONE:
+        return None, pos
+    elif tag == TAG_TRUE:
+        return True, pos
+    elif tag == TAG_FALSE:
+        return False, pos
+    elif tag == TAG_INT:
+        return __read_signed(data, pos)
+    elif tag == TAG_LONG:
+        value, pos = __read_signed(data, pos)
+        return long(value), pos
+    elif tag == TAG_FLOAT:
+        return FLOAT_FORMAT.unpack_from(data, pos)[0], pos + 8
+    elif tag in (TAG_STR, TAG_UNICODE, TAG_DECIMAL):
+        size, pos = __read_varint(data, pos)
+        value = data[pos:pos + size]
+        if tag == TAG_UNICODE:
+            value = value.decode('utf-8')
+        elif tag == TAG_DECIMAL:
+            value = Decimal(value)
+        return value, pos + size
+    elif tag == TAG_NAIVE_DATETIME:
+        micros, pos = __read_signed(data, pos)
+        return EPOCH + timedelta(microseconds=micros), pos
+    elif tag == TAG_AWARE_DATETIME:
+        minutes, pos = __read_signed(data, pos)
+        micros, pos = __read_signed(data, pos)
+        tz = pytz.FixedOffset(minutes) if minutes else pytz.utc
+        return (EPOCH + timedelta(minutes=minutes, microseconds=micros)).replace(tzinfo=tz), pos
+    elif tag in (TAG_LIST, TAG_TUPLE, TAG_SET):
+        count, pos = __read_varint(data, pos)
+        elements = []
+        for x in xrange(count):
+            element, pos = __read_value(cls, data, pos, classes)
+            elements.append(element)
+        if tag == TAG_TUPLE:
+            return tuple(elements), pos
+        elif tag == TAG_SET:
+            return set(elements), pos
+        return elements, pos
+    elif tag == TAG_DICT:
+        count, pos = __read_varint(data, pos)
+        value = {}
+        for x in xrange(count):
+            key, pos = __read_value(cls, data, pos, classes)
+            value[key], pos = __read_value(cls, data, pos, classes)
+        return value, pos
+    elif tag in (TAG_MODEL, TAG_OBJECT):
+        class_index, pos = __read_varint(data, pos)
+        size, pos = __read_varint(data, pos)
+        this_class = classes[class_index]
+        if tag == TAG_MODEL:
+            return this_class(**__decode_body(this_class, get_plan(this_class), data, pos)), pos + size
+        return this_class(from_json=j.loads(data[pos:pos + size]), preprocessed=True), pos + size
+    raise ModelException("from_bytes translation error in " + str(cls) + ": unknown value tag " + str(tag))
+
+
+def __encode_body(tinymodel, plan):
+    """
+    Encodes the stored fields of a model as a presence bitmap followed by the tagged values of the present fields,
+    in FIELD_DEFS order.
+
+    """
+    present = [None] * len(plan.field_defs)
+    load_lazy_fields(tinymodel)
+    for field in tinymodel.FIELDS:
+        index = plan.positions.get(field.field_def.title)
+        if index is not None:
+            present[index] = field
+    out = bytearray(plan.bitmap_size)
+    for (index, field) in enumerate(present):
+        if field is not None:
+            out[index >> 3] |= 1 << (index & 7)
+            __write_value(tinymodel, out, field.value, plan.classes[index])
+    return out
+
+
+def __decode_body(cls, plan, data, pos=0):
+    """
+    Decodes a body written by __encode_body.
+
+    :rtype dict: A dict of keys and values for the fields to set.
+
+    """
+    fields_to_set = {}
+    bitmap = bytearray(data[pos:pos + plan.bitmap_size])
+    pos += plan.bitmap_size
+    for (index, field_def) in enumerate(plan.field_defs):
+        if bitmap[index >> 3] & (1 << (index & 7)):
+            fields_to_set[field_def.title], pos = __read_value(cls, data, pos, plan.classes[index])
+    return fields_to_set
+
+
+def __check_header(cls, plan, data):
+    if len(data) < HEADER_SIZE or data[:len(MAGIC)] != MAGIC:
+        raise ModelException("from_bytes translation error: payload is not in tinymodel binary format")
+    if ord(data[len(MAGIC)]) != FORMAT_VERSION:
+        raise ModelException("from_bytes translation error: unsupported format version " + str(ord(data[len(MAGIC)])))
+    if data[len(MAGIC) + 1:HEADER_SIZE] != plan.fingerprint:
+        raise ModelException("from_bytes translation error: payload schema " + data[len(MAGIC) + 1:HEADER_SIZE].encode('hex') +
+                             " does not match the schema of " + str(cls) + " (" + plan.fingerprint.encode('hex') + ")")
+
+
+def to_bytes(tinymodel):
+    """
+    Creates a compact binary representation of a model.
+    The payload starts with a header carrying the schema fingerprint of the model class,
+    followed by a presence bitmap over FIELD_DEFS and the tagged values of the fields that are set.
+    Calculated fields are not stored.
+
+    :rtype str: The binary representation of this model
+
+    """
+    plan = get_plan(type(tinymodel))
+    return plan.header + str(__encode_body(tinymodel, plan))
+
+
+def from_bytes(cls, data):
+    """
+    Creates a model from its binary representation, as produced by to_bytes.
+    Raises a ModelException if the payload was written with a different schema.
+
+    :param str data: The binary representation of the model
+
+    :rtype TinyModel: The decoded model
+
+    """
+    data = str(data)
+    plan = get_plan(cls)
+    __check_header(cls, plan, data)
+    return cls(**__decode_body(cls, plan, data, HEADER_SIZE))
+
+
+def to_bytes_many(cls, models):
+    """
+    Creates a single binary payload for a list of models of the same class.
+    The header is written once and each record is length-prefixed.
+
+    :param list(TinyModel) models: The models to encode
+
+    :rtype str: The binary representation of the models
+
+    """
+    plan = get_plan(cls)
+    out = bytearray(plan.header)
+    __write_varint(out, len(models))
+    for tinymodel in models:
+        __write_bytes(out, __encode_body(tinymodel, plan))
+    return str(out)
+
+
+def from_bytes_many(cls, data):
+    """
+    Decodes a payload produced by to_bytes_many.
+
+    :param str data: The binary representation of the models
+
+    :rtype list(TinyModel): The decoded models, in their original order
+
+    """
+    data = str(data)
+    plan = get_plan(cls)
+    __check_header(cls, plan, data)
+    count, pos = __read_varint(data, HEADER_SIZE)
+    models = []
+    for x in xrange(count):
+        size, pos = __read_varint(data, pos)
+        models.append(cls(**__decode_body(cls, plan, data, pos)))
+        pos += size
+    return models
+
+
+def encode_record(tinymodel):
+    """
+    Encodes a model without the header, for containers that store the schema fingerprint once (see tinymodel.model_file).
+
+    :rtype bytearray: The encoded fields of this model
+
+    """
+    return __encode_body(tinymodel, get_plan(type(tinymodel)))
+
+
+def decode_record(cls, data, pos=0):
+    """
+    Decodes a record written by encode_record. data may be any object supporting
+    indexing and slicing, such as a str or a buffer over a memory map.
+
+    :rtype TinyModel: The decoded model
+
+    """
+    return cls(**__decode_body(cls, get_plan(cls), data, pos))
@@ -0,0 +1,84 @@
+"""
+Field-level change tracking for TinyModel instances.
+
+Tracking starts when a model is marked clean, e.g. when the api layer loads it from a service. The original value of a
+field is captured when the field is first set or deleted afterwards, so loading a model costs nothing for fields
+that are never modified. Only the values of mutable collections (lists, dicts, sets) are copied when the model is
+marked clean, so that their in-place modifications are detected as well.
+
+"""
+
+
+class _Absent(object):
+
+    """ The original value of a field that was not set when the model was marked clean. """
+
+    def __repr__(self):
+        return '<absent>'
+
+ABSENT = _Absent()
+MUTABLE_TYPES = (list, dict, set)
+__CONTAINER_TYPES = (list, dict, set, tuple)
+
+
+def snapshot(value):
+    """ Returns a copy of a field value that in-place modifications of the value do not affect. Models are not copied. """
+    if isinstance(value, list):
+        return [snapshot(v) if isinstance(v, __CONTAINER_TYPES) else v for v in value]
+    if isinstance(value, dict):
+        return dict((k, snapshot(v) if isinstance(v, __CONTAINER_TYPES) else v) for (k, v) in value.iteritems())
+    if isinstance(value, set):
+        return set(value)
+    if isinstance(value, tuple):
+        return tuple(snapshot(v) if isinstance(v, __CONTAINER_TYPES) else v for v in value)
+    return value
+
+
+def current_value(tinymodel, title):
+    """ Returns the value of a field, or ABSENT if it is not set. """
+    field = next((f for f in tinymodel.FIELDS if f.field_def.title == title), None)
+    if field is None:
+        return ABSENT
+    return field.value
+
+
+def mark_clean(tinymodel):
+    """
+    Starts tracking the changes of a model, with its current values as the original values.
+
+    Fields still held as raw JSON values (from_json with lazy=True) are captured when they are translated.
+
+    """
+    originals = {}
+    for field in tinymodel.FIELDS:
+        if isinstance(field.value, MUTABLE_TYPES):
+            originals[field.field_def.title] = snapshot(field.value)
+    object.__setattr__(tinymodel, 'ORIGINAL_VALUES', originals)
+    return tinymodel
+
+
+def record_original(tinymodel, title, value):
+    """ Captures the original value of a field before it is modified, unless it was captured already. """
+    originals = tinymodel.ORIGINAL_VALUES
+    if originals is not None and title not in originals:
+        originals[title] = snapshot(value) if isinstance(value, MUTABLE_TYPES) else value
+
+
+def changes(tinymodel):
+    """
+    Returns the fields whose values changed since the model was marked clean, i.e. since it was loaded from a service.
+    A model that was never marked clean (e.g. created with keyword arguments) reports all of its fields as changed.
+
+    :rtype dict: Maps the title of every changed field to its (original, current) values.
+                 Fields that were not set are reported with None.
+    """
+    originals = tinymodel.ORIGINAL_VALUES
+    if originals is None:
+        return dict((title, (None, getattr(tinymodel, title))) for title in
+                    [f.field_def.title for f in tinymodel.FIELDS] + tinymodel.LAZY_FIELDS.keys())
+    changed = {}
+    for (title, original) in originals.items():
+        current = current_value(tinymodel, title) if title not in tinymodel.LAZY_FIELDS else original
+        if current != original:
+            changed[title] = (None if original is ABSENT else original, None if current is ABSENT else current)
+    return changed
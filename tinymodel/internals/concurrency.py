@@ -0,0 +1,118 @@
+import Queue
+import sys
+import threading
+
+
+class WorkerPool(object):
+
+    """
+    Daemon threads that are reused across calls. A thread is only started when every worker is busy,
+    so the pool grows to the peak number of concurrent calls, and then stays at that size.
+
+    """
+
+    def __init__(self):
+        self.tasks = Queue.Queue()
+        self.idle = 0
+        self.lock = threading.Lock()
+
+    def submit(self, function, *args):
+        """ Calls function(*args) in a worker thread. """
+        with self.lock:
+            if self.idle:
+                # an idle worker is reserved for the task
+                self.idle -= 1
+                self.tasks.put((function, args))
+                return
+        thread = threading.Thread(target=self.__work, args=(function, args))
+        thread.daemon = True
+        thread.start()
+
+    def __work(self, function, args):
+        while True:
+            function(*args)
+            with self.lock:
+                self.idle += 1
+            # waits without a timeout, since a timed wait polls, and fails at interpreter shutdown
+            (function, args) = self.tasks.get()
+
+
+class Call(object):
+
+    """
+    A function call running in a daemon thread.
+
+    Python 2 has no concurrent.futures, so this is the minimal future the service wrappers need:
+    wait for the call with a deadline, then read its result or re-raise its exception.
+    A call that misses its deadline cannot be cancelled. It keeps running, and its result is discarded.
+
+    """
+
+    def __init__(self, function, args=(), kwargs=None, done_event=None, pool=None):
+        """
+        Starts the call.
+
+        :param callable function: The function to call
+        :param tuple args: The positional arguments of the call
+        :param dict kwargs: The keyword arguments of the call
+        :param threading.Event done_event: Optional. Set when the call finishes, so that one event can wait on several calls.
+        :param WorkerPool pool: Optional. Runs the call on a reused worker thread instead of a new thread.
+
+        """
+        self.function = function
+        self.value = None
+        self.exc_info = None
+        self.finished = threading.Event()
+        self.done_event = done_event
+        if pool is not None:
+            pool.submit(self.__run, args, kwargs or {})
+            return
+        thread = threading.Thread(target=self.__run, args=(args, kwargs or {}))
+        thread.daemon = True
+        thread.start()
+
+    def __run(self, args, kwargs):
+        try:
+            self.value = self.function(*args, **kwargs)
+        except BaseException:
+            self.exc_info = sys.exc_info()
+        finally:
+            self.finished.set()
+            if self.done_event is not None:
+                self.done_event.set()
+
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the call to finish.
+
+        :param float timeout: The maximum time to wait, in seconds. None waits until the call finishes.
+
+        :rtype bool: True if the call has finished
+        """
+        return self.finished.wait(timeout) or self.finished.is_set()
+
+    def result(self):
+        """ Returns the value returned by the finished call, or re-raises the exception it raised. """
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+
+def call_all(functions):
+    """
+    Calls functions in parallel, one thread each, and returns their results in order.
+    If any of the calls raises, the first exception (in order) is re-raised once all of the calls have finished.
+
+    :param list(callable) functions: The functions to call, without arguments
+
+    :rtype list: The results of the calls
+    """
+    if len(functions) == 1:
+        return [functions[0]()]
+    calls = [Call(function) for function in functions]
+    for call in calls:
+        call.wait()
+    return [call.result() for call in calls]
@@ -1,10 +1,7 @@
-import pytz
 import random as r
 import string as s
-import json as j
 
 from decimal import Decimal
-from dateutil import parser as date_parser
 from datetime import datetime, timedelta
 
 from tinymodel.internals.random_object import __random_field
@@ -12,13 +9,26 @@ from tinymodel.internals.json_object import(
     __field_to_json,
     __field_from_json,
 )
+from tinymodel import instrumentation
+from tinymodel.utils import LazyModule
+
+date_parser = LazyModule('dateutil.parser')
+j = LazyModule('json')
+pytz = LazyModule('pytz')
 
 
 COLLECTION_TYPES = (dict, list, tuple, set)
 SUPPORTED_METHODS = ['to_json', 'from_json', 'random']
 
+
+def __datetime_from_json(json_value):
+    if instrumentation.ENABLED:
+        instrumentation.count('dateutil_parse', None)
+    return date_parser.parse(j.loads(json_value))
+
+
 DATETIME_TRANSLATORS = {'to_json': lambda obj: obj.replace(microsecond=0).isoformat(),
-                        'from_json': lambda json_value: date_parser.parse(j.loads(json_value)),
+                        'from_json': __datetime_from_json,
                         'random': lambda: (datetime.utcnow() - timedelta(seconds=r.randrange(2592000))).replace(tzinfo=pytz.utc),
                        }
 
@@ -1,3 +1,4 @@
+import copy
 import warnings
 import collections
 
@@ -6,58 +7,102 @@ from importlib import import_module
 from tinymodel.utils import ValidationError
 
 
-def validate_builtin_method_support(tinymodel):
+# string class references that have been resolved, shared by all TinyModel classes
+CLASS_REFS = {}
+
+
+def import_class(path):
+    """
+    Returns the class referenced by a dotted path such as "package.module.ClassName", memoized in CLASS_REFS.
+
+    :raises ImportError: if the module does not exist
+    :raises AttributeError: if the module has no such class
+    :raises ValueError: if the path has no module
+    """
+    if path not in CLASS_REFS:
+        module_name, class_name = path.rsplit(".", 1)
+        CLASS_REFS[path] = getattr(import_module(module_name), class_name)
+    return CLASS_REFS[path]
+
+
+def validate_builtin_method_support(cls):
     """
     Checks that all of the builtins defined in SUPPORTED_BUILTINS support all of methods defined in SUPPORTED_METHODS
     Raises an Exception if support is missing for any method, on any builtin
 
     """
-    for method in tinymodel.SUPPORTED_METHODS:
-        for (builtin, builtin_supported_methods) in tinymodel.SUPPORTED_BUILTINS.items():
+    validation_failures = []
+    for method in cls.SUPPORTED_METHODS:
+        for (builtin, builtin_supported_methods) in cls.SUPPORTED_BUILTINS.items():
             if method not in builtin_supported_methods:
-                tinymodel.VALIDATION_FAILURES.append(method + " not supported by builtin type: " + str(builtin))
-    if tinymodel.VALIDATION_FAILURES:
-        raise ValidationError("Supported methods validation failed on TinyModel of class " + str(type(tinymodel)) + "\nUnsupported methods:\n" + "\n".join(tinymodel.VALIDATION_FAILURES))
+                validation_failures.append(method + " not supported by builtin type: " + str(builtin))
+    if validation_failures:
+        raise ValidationError("Supported methods validation failed on TinyModel of class " + str(cls) + "\nUnsupported methods:\n" + "\n".join(validation_failures))
 
 
-def validate_field_types(tinymodel):
+def validate_field_types(cls):
     """
     Checks that all of the type definitions fields defined in the FIELD_DEFS array are structured correctly,
     and that they contain valid builtins and user-defined classes. Classes defined with input strings are evaluated and replaced.
 
+    The FieldDefs of the class are not modified. Validated copies of them are returned instead,
+    with class references substituted and optional fields with unresolvable class references left out.
+    The copies share no mutable state with the class: allowed_types, choices and depends_on are tuples,
+    and custom_translators is a deep copy.
+
     Raises an Exception if any invalid fields are found.
 
+    :rtype list(FieldDef): The validated copies of the FIELD_DEFS, in order.
+
     """
-    if getattr(tinymodel, 'FIELD_DEFS', False):
-        duplicate_field_titles = [x for x, y in collections.Counter([field.title for field in tinymodel.FIELD_DEFS]).items() if y > 1]
+    if getattr(cls, 'FIELD_DEFS', False):
+        duplicate_field_titles = [x for x, y in collections.Counter([field.title for field in cls.FIELD_DEFS]).items() if y > 1]
         if duplicate_field_titles:
-            raise ValidationError("Duplicate field titles in FIELD_DEFS for TinyModel " + str(tinymodel) + ": " + " ".join(duplicate_field_titles))
-        for field in tinymodel.FIELD_DEFS:
+            raise ValidationError("Duplicate field titles in FIELD_DEFS for TinyModel " + str(cls) + ": " + " ".join(duplicate_field_titles))
+        removed_fields = []
+        validated_field_defs = []
+        for field in cls.FIELD_DEFS:
             if not field.title:
-                raise ValidationError("Field validation failed on TinyModel of class " + str(type(tinymodel)) + ". Field name cannot be empty!")
-            for index, field_type in enumerate(field.allowed_types):
-                field.allowed_types[index] = __substitute_class_refs(tinymodel, field_name=field.title, required=field.required, field_type=field_type)
-
-        new_fields_list = []
-        for key, val in enumerate(tinymodel.FIELD_DEFS):
-            if val.title in tinymodel.REMOVED_FIELDS:
-                del tinymodel.FIELD_DEFS[key]
-
-        for field_def in tinymodel.FIELD_DEFS:
+                raise ValidationError("Field validation failed on TinyModel of class " + str(cls) + ". Field name cannot be empty!")
+            if field.depends_on is not None:
+                if not field.calculated:
+                    raise ValidationError("Field validation failed on TinyModel of class " + str(cls) + ". Field " + field.title + " declares depends_on but is not calculated")
+                unknown_fields = set(field.depends_on) - set(f.title for f in cls.FIELD_DEFS)
+                if unknown_fields:
+                    raise ValidationError("Field validation failed on TinyModel of class " + str(cls) + ". Field " + field.title + " depends on undefined fields: " + " ".join(unknown_fields))
+                # the fields read by a calculated field without depends_on are unknown, so nothing would invalidate the memoized value
+                unmemoized_fields = [f.title for f in cls.FIELD_DEFS if f.title in field.depends_on and f.calculated and f.depends_on is None]
+                if unmemoized_fields:
+                    raise ValidationError("Field validation failed on TinyModel of class " + str(cls) + ". Field " + field.title + " depends on calculated fields without depends_on: " + " ".join(unmemoized_fields))
+            validated_field = copy.copy(field)
+            validated_field.allowed_types = tuple([__substitute_class_refs(cls, field_name=field.title, required=field.required, field_type=field_type, removed_fields=removed_fields)
+                                                   for field_type in field.allowed_types])
+            validated_field.choices = tuple(field.choices or ())
+            validated_field.custom_translators = copy.deepcopy(field.custom_translators)
+            if field.depends_on is not None:
+                validated_field.depends_on = tuple(field.depends_on)
+            validated_field_defs.append(validated_field)
+
+        validated_field_defs = [field_def for field_def in validated_field_defs if field_def.title not in removed_fields]
+
+        validation_failures = []
+        for field_def in validated_field_defs:
             for field_type in field_def.allowed_types:
                 if field_def.validate:
-                    __validate_type(tinymodel, field_name=field_def.title, field_type=field_type)
-        if tinymodel.VALIDATION_FAILURES:
-            raise ValidationError("Field types validation failed on TinyModel of class " + str(type(tinymodel)) + "\nInvalid types:\n" + "\n".join(tinymodel.VALIDATION_FAILURES))
+                    __validate_type(cls, validation_failures, field_name=field_def.title, field_type=field_type)
+        if validation_failures:
+            raise ValidationError("Field types validation failed on TinyModel of class " + str(cls) + "\nInvalid types:\n" + "\n".join(validation_failures))
+        return validated_field_defs
     else:
-        raise ValidationError("FIELD_DEFS list is missing or empty on TinyModel of class " + str(type(tinymodel)))
+        raise ValidationError("FIELD_DEFS list is missing or empty on TinyModel of class " + str(cls))
 
 
-def __validate_type(tinymodel, field_name, field_type):
+def __validate_type(cls, validation_failures, field_name, field_type):
     """
     Checks the validity of a field type. Collection types (i.e. dict, list, tuple and set) are handled recursively.
-    Any failures encountered are added to the private attribute VALIDATION_FAILURES
+    Any failures encountered are added to validation_failures
 
+    :param list validation_failures: The list of failures found so far
     :param str field_name: The name of the field we are validating
     :param class | {class: class} | [class] | (class,) | {class,} field_type: The field type, as a Python class definition
 
@@ -65,64 +110,63 @@ def __validate_type(tinymodel, field_name, field_type):
 
     if type(field_type) in (list, tuple, set):
         for element in field_type:
-            __validate_type(tinymodel, field_name=field_name, field_type=element)
+            __validate_type(cls, validation_failures, field_name=field_name, field_type=element)
     elif isinstance(field_type, dict):
         for key, value in field_type.iteritems():
-            __validate_type(tinymodel, field_name=field_name, field_type=key)
-            __validate_type(tinymodel, field_name=field_name, field_type=value)
+            __validate_type(cls, validation_failures, field_name=field_name, field_type=key)
+            __validate_type(cls, validation_failures, field_name=field_name, field_type=value)
     elif isinstance(field_type, type):
-        if field_type not in tinymodel.SUPPORTED_BUILTINS:
-            for required_method in tinymodel.SUPPORTED_METHODS:
+        if field_type not in cls.SUPPORTED_BUILTINS:
+            for required_method in cls.SUPPORTED_METHODS:
                 if required_method not in dir(field_type):
-                    tinymodel.VALIDATION_FAILURES.append(field_name + ": " + str(field_type) + " missing required method " + required_method)
+                    validation_failures.append(field_name + ": " + str(field_type) + " missing required method " + required_method)
     else:
-        tinymodel.VALIDATION_FAILURES.append(field_name + ": " + str(type(field_type)) + " not a recognized type")
+        validation_failures.append(field_name + ": " + str(type(field_type)) + " not a recognized type")
 
 
-def __substitute_class_refs(tinymodel, field_name, required, field_type):
+def __substitute_class_refs(cls, field_name, required, field_type, removed_fields):
     """
     Recurses through field_type and replaces references to classes with the actual class definitions.
     An error is raised if the class module cannot be found. In the case of an optional FIELD_DEF, a warning is raised
     instead of an error, and the field is removed from the Model.
+    Resolved references are memoized in CLASS_REFS, so that every module is looked up once per process.
 
     :param str field_name: The name of the field
     :param bool required: True indicates a required field. False indicates and optional field
     :param class | {class: class} | [class] | (class,) | {class,} field_type: The field type, as a Python class definition
+    :param list removed_fields: Optional fields whose class references cannot be resolved are added to this list
 
     """
-    if type(field_type) in tinymodel.COLLECTION_TYPES and len(field_type) > 1:
-        raise Exception(str(type(field_type)) + " field types can only have one element: " + field_name + " on TinyModel " + str(type(tinymodel)))
+    if type(field_type) in cls.COLLECTION_TYPES and len(field_type) > 1:
+        raise Exception(str(type(field_type)) + " field types can only have one element: " + field_name + " on TinyModel " + str(cls))
     elif isinstance(field_type, list):
-        return [__substitute_class_refs(tinymodel, field_name=field_name, required=required, field_type=field_type[0])]
+        return [__substitute_class_refs(cls, field_name=field_name, required=required, removed_fields=removed_fields, field_type=field_type[0])]
     elif isinstance(field_type, tuple):
-        return tuple([__substitute_class_refs(tinymodel, field_name=field_name, required=required, field_type=field_type[0])])
+        return tuple([__substitute_class_refs(cls, field_name=field_name, required=required, removed_fields=removed_fields, field_type=field_type[0])])
     elif isinstance(field_type, set):
-        return set([__substitute_class_refs(tinymodel, field_name=field_name, required=required, field_type=iter(field_type).next())])
+        return set([__substitute_class_refs(cls, field_name=field_name, required=required, removed_fields=removed_fields, field_type=iter(field_type).next())])
     elif isinstance(field_type, dict):
         key, value = field_type.items()[0]
-        return_key = __substitute_class_refs(tinymodel, field_name=field_name, required=required, field_type=key)
-        return_value = __substitute_class_refs(tinymodel, field_name=field_name, required=required, field_type=value)
+        return_key = __substitute_class_refs(cls, field_name=field_name, required=required, removed_fields=removed_fields, field_type=key)
+        return_value = __substitute_class_refs(cls, field_name=field_name, required=required, removed_fields=removed_fields, field_type=value)
         return {return_key: return_value}
     elif isinstance(field_type, str):
-        this_module_name = ""
-        this_class_name = ""
+        this_module_name = field_type.rsplit(".", 1)[0]
         try:
-            this_module_name, this_class_name = field_type.rsplit(".", 1)
-            this_module = import_module(this_module_name)
-            return getattr(this_module, this_class_name)
+            return import_class(field_type)
         except ImportError:
             if required:
-                raise Exception("Tried to import non-existent module " + this_module_name + " on field " + field_name + " of TinyModel " + str(type(tinymodel)))
+                raise Exception("Tried to import non-existent module " + this_module_name + " on field " + field_name + " of TinyModel " + str(cls))
             else:
-                warnings.warn("Tried to import non-existent module " + this_module_name + " on field " + field_name + " of TinyModel " + str(type(tinymodel)) + "\nThis field will be removed from the model.")
-                tinymodel.REMOVED_FIELDS.append(field_name)
+                warnings.warn("Tried to import non-existent module " + this_module_name + " on field " + field_name + " of TinyModel " + str(cls) + "\nThis field will be removed from the model.")
+                removed_fields.append(field_name)
                 return field_type
         except AttributeError:
             if required:
-                raise Exception("Tried to access non-existent class " + field_type + " on field " + field_name + " of TinyModel " + str(type(tinymodel)))
+                raise Exception("Tried to access non-existent class " + field_type + " on field " + field_name + " of TinyModel " + str(cls))
             else:
-                warnings.warn("Tried to access non-existent class " + field_type + " on field " + field_name + " of TinyModel " + str(type(tinymodel)) + "\nThis field will be removed from the model.")
-                tinymodel.REMOVED_FIELDS.append(field_name)
+                warnings.warn("Tried to access non-existent class " + field_type + " on field " + field_name + " of TinyModel " + str(cls) + "\nThis field will be removed from the model.")
+                removed_fields.append(field_name)
                 return field_type
         except Exception as e:
             raise e
@@ -1,3 +1,6 @@
+from tinymodel.internals.schema import compile_schema
+
+
 def from_foreign_model(tinymodel, foreign_model):
     """
     Translates field values from a foreign model to a TinyModel.
@@ -13,7 +16,7 @@ def from_foreign_model(tinymodel, foreign_model):
     if foreign_model is None:
         return attrs_to_set
 
-    for field_def in tinymodel.FIELD_DEFS:
+    for field_def in compile_schema(type(tinymodel)).field_defs:
         try:
             foreign_value = getattr(foreign_model, field_def.title)
         except AttributeError:
@@ -0,0 +1,173 @@
+"""
+Caching of to_json results on unchanged models.
+
+to_json keeps its results on the model, one per variant (string, dict or raw, naive_datetimes, projection),
+and returns them again while the model is unchanged. The cache of a model is dropped when one of its fields is set
+or deleted, and before it is used if a field was modified in place: the values of mutable collection fields are
+copied with the cache, and compared to the current values. The models nested in the fields of a model are tracked
+the same way, and dropping the cache of a nested model drops the caches of the models that contain it, so the cached
+result of a parent is never outdated, and the serialization of a parent reuses the cached results of its children.
+
+Results are cached from the second serialization of an unchanged model on, so that models serialized only once
+do not pay for the copies. Models with calculated fields that do not declare depends_on are never cached,
+since their values can change without any field changing.
+
+"""
+import weakref
+
+from tinymodel.internals.change_tracking import MUTABLE_TYPES, current_value, snapshot
+from tinymodel.internals.schema import compile_schema
+
+
+NESTING_TITLES = {}
+# the JSON_CACHE of a model that was serialized once, and not changed since
+SERIALIZED_ONCE = object()
+
+
+def __allows_models(allowed_type, builtins):
+    """ Checks whether values of an allowed type can hold models: user-defined types, and collections of unknown types. """
+    if isinstance(allowed_type, dict):
+        return any(__allows_models(t, builtins) for t in allowed_type.items()[0])
+    if isinstance(allowed_type, (list, tuple, set)):
+        return any(__allows_models(t, builtins) for t in allowed_type)
+    return allowed_type not in builtins or allowed_type in (dict, list, tuple, set)
+
+
+def __nesting_titles(cls):
+    """ Returns the titles of the fields of a class whose values can hold models. """
+    titles = NESTING_TITLES.get(cls)
+    if titles is None:
+        titles = NESTING_TITLES[cls] = frozenset(f.title for f in compile_schema(cls).field_defs
+                                                 if any(__allows_models(t, cls.SUPPORTED_BUILTINS) for t in f.allowed_types))
+    return titles
+
+
+class _Entry(object):
+
+    """ The cached to_json results of a model, with the copies of its mutable values and its nested models. """
+
+    __slots__ = ('snapshots', 'children', 'results')
+
+    def __init__(self, snapshots, children):
+        self.snapshots = snapshots
+        self.children = children
+        self.results = {}
+
+
+def __collect_models(value, models):
+    from tinymodel import TinyModel
+    if isinstance(value, TinyModel):
+        models.append(value)
+    elif isinstance(value, dict):
+        for (k, v) in value.items():
+            __collect_models(k, models)
+            __collect_models(v, models)
+    elif isinstance(value, (list, tuple, set)):
+        for v in value:
+            __collect_models(v, models)
+
+
+def __track(tinymodel, seen):
+    """ Returns the cache entry of a model, creating it and the entries of its nested models if needed. """
+    entry = tinymodel.JSON_CACHE
+    if entry is not None and entry is not SERIALIZED_ONCE:
+        return entry
+    snapshots = {}
+    children = []
+    nesting_titles = __nesting_titles(type(tinymodel))
+    for field in tinymodel.FIELDS:
+        if isinstance(field.value, MUTABLE_TYPES):
+            snapshots[field.field_def.title] = snapshot(field.value)
+        if field.field_def.title in nesting_titles:
+            __collect_models(field.value, children)
+    entry = _Entry(snapshots, children)
+    object.__setattr__(tinymodel, 'JSON_CACHE', entry)
+    for child in children:
+        if child.JSON_PARENTS is None:
+            object.__setattr__(child, 'JSON_PARENTS', weakref.WeakSet())
+        child.JSON_PARENTS.add(tinymodel)
+        if id(child) not in seen:
+            seen.add(id(child))
+            __track(child, seen)
+    return entry
+
+
+def __is_unchanged(tinymodel, seen):
+    """ Checks that a model and its nested models were not modified in place since they were cached. """
+    entry = tinymodel.JSON_CACHE
+    if entry is None or entry is SERIALIZED_ONCE:
+        return False
+    for (title, value) in entry.snapshots.items():
+        if current_value(tinymodel, title) != value:
+            return False
+    for child in entry.children:
+        if id(child) not in seen:
+            seen.add(id(child))
+            if not __is_unchanged(child, seen):
+                return False
+    return True
+
+
+def get(tinymodel, variant):
+    """
+    Returns the cached to_json result of a model, or None if it is not cached or outdated.
+    Dicts are returned as copies, so that callers can modify them: deep copies of JSON dicts, and shallow copies
+    of raw dicts, whose values are the field values themselves, as without the cache.
+
+    :param tuple variant: The to_json arguments the result was computed with, starting with return_dict and return_raw
+    """
+    entry = tinymodel.JSON_CACHE
+    if entry is None or entry is SERIALIZED_ONCE or variant not in entry.results:
+        return None
+    if not __is_unchanged(tinymodel, set([id(tinymodel)])):
+        invalidate(tinymodel)
+        return None
+    result = entry.results[variant]
+    if variant[1]:
+        return dict(result)
+    return snapshot(result) if variant[0] else result
+
+
+def put(tinymodel, variant, result):
+    """
+    Caches a to_json result of a model that was serialized before, unless its class has calculated fields
+    without depends_on.
+    """
+    if tinymodel.JSON_CACHE is None:
+        object.__setattr__(tinymodel, 'JSON_CACHE', SERIALIZED_ONCE)
+    elif compile_schema(type(tinymodel)).json_cacheable:
+        if variant[1]:
+            result = dict(result)
+        elif variant[0]:
+            result = snapshot(result)
+        __track(tinymodel, set([id(tinymodel)])).results[variant] = result
+
+
+def invalidate(tinymodel):
+    """ Drops the cached results of a model, and of the models that contain it, directly or indirectly. """
+    pending = [tinymodel]
+    seen = set()
+    while pending:
+        model = pending.pop()
+        if id(model) in seen:
+            continue
+        seen.add(id(model))
+        object.__setattr__(model, 'JSON_CACHE', None)
+        if model.JSON_PARENTS:
+            pending.extend(model.JSON_PARENTS)
+
+
+def clear(tinymodel):
+    """ Drops the cached results of a model, and of the models nested in it, e.g. to time an uncached to_json. """
+    pending = [tinymodel]
+    seen = set()
+    while pending:
+        model = pending.pop()
+        if id(model) in seen:
+            continue
+        seen.add(id(model))
+        object.__setattr__(model, 'JSON_CACHE', None)
+        nesting_titles = __nesting_titles(type(model))
+        for field in model.FIELDS:
+            if field.field_def.title in nesting_titles:
+                __collect_models(field.value, pending)
@@ -1,7 +1,60 @@
 import collections
 from datetime import datetime
-import json as j
-from tinymodel.utils import ModelException
+import threading
+from tinymodel import instrumentation
+from tinymodel.utils import LazyModule, ModelException
+from tinymodel.internals import change_tracking, json_cache
+from tinymodel.internals.schema import compile_schema
+
+j = LazyModule('json')
+
+# the state of the to_json or to_json_graph call running in this thread, shared by the nested to_json calls
+ENCODING = threading.local()
+
+
+class _Graph(object):
+
+    """ The models of a to_json_graph call: each distinct (class, id) is serialized once, and referenced elsewhere. """
+
+    def __init__(self):
+        self.keys = {}
+        self.serialized = set()
+        self.models = []
+        self.pending = collections.deque()
+
+    def reference(self, tinymodel):
+        """ Returns the JSON reference to a model, and queues the model for serialization if it is new. """
+        key = self.keys.get(id(tinymodel))
+        if key is None:
+            path = type(tinymodel).__module__ + '.' + type(tinymodel).__name__
+            try:
+                model_id = tinymodel.id
+            except AttributeError:
+                model_id = None
+            # models without an id are only de-duplicated by identity
+            key = path + '#' + str(len(self.models)) if model_id is None else path + ':' + unicode(model_id)
+            if key not in self.serialized:
+                self.serialized.add(key)
+                self.pending.append((key, tinymodel))
+            self.keys[id(tinymodel)] = key
+            # keeps the model alive, so that its id() is not reused during the call
+            self.models.append(tinymodel)
+        return '{"$ref": ' + j.dumps(key) + '}'
+
+
+class _EncodingContext(object):
+
+    """
+    The state of a top-level to_json or to_json_graph call: the JSON of the nested objects serialized so far,
+    by identity, so that an object that appears several times is serialized once, and the graph of a to_json_graph call.
+
+    """
+
+    __slots__ = ('memo', 'graph')
+
+    def __init__(self, graph=None):
+        self.memo = {}
+        self.graph = graph
 
 
 def __field_from_json(tinymodel, allowed_types, json_value, this_field_def=None):
@@ -19,9 +72,9 @@ def __field_from_json(tinymodel, allowed_types, json_value, this_field_def=None)
 
     type_of_value = type(json_value)
     if this_field_def.relationship == "has_one":
-        allowed_types += [long, int, unicode, str]
+        allowed_types = list(allowed_types) + [long, int, unicode, str]
     elif this_field_def.relationship == "has_many":
-        allowed_types += [[long], [int], [unicode], [str]]
+        allowed_types = list(allowed_types) + [[long], [int], [unicode], [str]]
 
     if type_of_value == dict:
         # Use first allowed dict type or user-defined type
@@ -48,6 +101,8 @@ def __field_from_json(tinymodel, allowed_types, json_value, this_field_def=None)
         if first_usable_type:
             if issubclass(first_usable_type, type(tinymodel).__bases__[0]):
                 return first_usable_type(from_json=json_value)
+            if instrumentation.ENABLED:
+                instrumentation.count('json_recast', type(tinymodel))
             json_value = j.dumps(json_value)
             if this_field_def.custom_translators:
                 return tinymodel.SUPPORTED_BUILTINS[first_usable_type]['from_json'](json_value, this_field_def.custom_translators)
@@ -67,6 +122,8 @@ def __field_from_json(tinymodel, allowed_types, json_value, this_field_def=None)
         else:
             try:
                 # Did not translate to an allowed type. Cast it back to JSON, find the allowed type, and translate to that.
+                if instrumentation.ENABLED:
+                    instrumentation.count('json_recast', type(tinymodel))
                 first_usable_type = next(iter([allowed_type for allowed_type in allowed_types]))
                 if this_field_def.custom_translators:
                     return tinymodel.SUPPORTED_BUILTINS[first_usable_type]['from_json'](j.dumps(json_value), this_field_def.custom_translators)
@@ -120,10 +177,56 @@ def __field_to_json(tinymodel, this_value, raw=False, naive_datetimes=False, cus
             if hasattr(this_value, 'id'):
                 return this_value.id
         else:
-            return this_value.to_json()
+            return __nested_to_json(this_value)
+
+
+def __nested_to_json(this_value):
+    """ Serializes a user-defined object nested in a field, once per top-level to_json call, or references it in a graph. """
+    from tinymodel import TinyModel
+    context = getattr(ENCODING, 'context', None)
+    if context is None:
+        return this_value.to_json()
+    if context.graph is not None and isinstance(this_value, TinyModel):
+        return context.graph.reference(this_value)
+    memoized = context.memo.get(id(this_value))
+    if memoized is None:
+        # the object is kept with its JSON, so that its id() is not reused during the call
+        memoized = context.memo[id(this_value)] = (this_value, this_value.to_json())
+    return memoized[1]
+
+
+def load_lazy_field(tinymodel, this_field_def):
+    """
+    Translates a field that was kept as a raw JSON value by from_json(lazy=True), and sets it on the model.
 
+    :param FieldDef this_field_def: The field to translate
+
+    :rtype object: The translated value of the field
 
-def from_json(tinymodel, model_as_json, preprocessed=False):
+    """
+    json_value = tinymodel.LAZY_FIELDS.pop(this_field_def.title)
+    originals = tinymodel.ORIGINAL_VALUES
+    setattr(tinymodel, this_field_def.title, __field_from_json(tinymodel,
+                                                               allowed_types=this_field_def.allowed_types,
+                                                               json_value=json_value,
+                                                               this_field_def=this_field_def))
+    value = getattr(tinymodel, this_field_def.title)
+    if originals is not None and originals.get(this_field_def.title) is change_tracking.ABSENT:
+        # translating a field is not a change: the translated value is the original one
+        del originals[this_field_def.title]
+        if isinstance(value, change_tracking.MUTABLE_TYPES):
+            originals[this_field_def.title] = change_tracking.snapshot(value)
+    return value
+
+
+def load_lazy_fields(tinymodel):
+    """ Translates every field that is still held as a raw JSON value. """
+    for field_def in compile_schema(type(tinymodel)).field_defs:
+        if field_def.title in tinymodel.LAZY_FIELDS:
+            load_lazy_field(tinymodel, field_def)
+
+
+def from_json(tinymodel, model_as_json, preprocessed=False, lazy=False):
     """
     Creates an object from its JSON representation
     Simultaneously iterates over the FIELD_DEFS attribute and the passed-in JSON representation
@@ -139,6 +242,8 @@ def from_json(tinymodel, model_as_json, preprocessed=False):
 
     :param str model_as_json: A representation of the model in JSON format
     :param bool preprocessed: A flag indicating whether model_as_json has already been through a JSON preprocessor
+    :param bool lazy: If True, the parsed JSON values of non-calculated fields are stored in tinymodel.LAZY_FIELDS
+                      and translated by load_lazy_field on first access, instead of being returned.
 
     :rtype dict: A dict of keys and values for the fields to set.
 
@@ -152,9 +257,12 @@ def from_json(tinymodel, model_as_json, preprocessed=False):
     else:
         json_fields = model_as_json
 
+    compiled_schema = compile_schema(type(tinymodel))
     for (json_field_name, json_field_value) in json_fields.items():
-        this_field_def = next((f for f in tinymodel.FIELD_DEFS if json_field_name in [f.title, f.alias]), None)
-        if this_field_def:
+        this_field_def = compiled_schema.get_field_def(json_field_name)
+        if this_field_def and lazy and not this_field_def.calculated:
+            tinymodel.LAZY_FIELDS[this_field_def.title] = json_field_value
+        elif this_field_def:
             fields_to_set[json_field_name] = __field_from_json(tinymodel,
                                                                allowed_types=this_field_def.allowed_types,
                                                                json_value=json_field_value,
@@ -162,7 +270,7 @@ def from_json(tinymodel, model_as_json, preprocessed=False):
     return fields_to_set
 
 
-def to_json(tinymodel, return_dict=False, return_raw=False, naive_datetimes=False):
+def to_json(tinymodel, return_dict=False, return_raw=False, naive_datetimes=False, only=None, exclude=None):
     """
     Creates a JSON representation of a model
     Iterates over the FIELD_DEFS attribute to translate each field value into its corresponding JSON representation.
@@ -170,13 +278,47 @@ def to_json(tinymodel, return_dict=False, return_raw=False, naive_datetimes=Fals
     Please note that JSON supports ONLY STRINGS AS DICT KEYS!
     Dict-type fields with key types other than str are not guaranteed to work with this method.
 
+    Fields that are still held as raw JSON values by a lazy from_json are passed through as they are,
+    unless return_raw or naive_datetimes require the translated value.
+
+    The results are cached on the model until it changes, see json_cache.
+
+    :param list(str) only: If given, only these fields are serialized
+    :param list(str) exclude: If given, these fields are not serialized
+
     :rtype str: A JSON-formatted str representation of this model
 
     """
+    from tinymodel.internals.validation import validate_projection
+    projection = validate_projection(type(tinymodel), only, exclude)
+    variant = (bool(return_dict), bool(return_raw), bool(naive_datetimes), None if projection is None else tuple(sorted(projection)))
+    result = json_cache.get(tinymodel, variant)
+    if result is None:
+        if return_raw or getattr(ENCODING, 'context', None) is not None:
+            result = __model_to_json(tinymodel, return_dict, return_raw, naive_datetimes, projection)
+        else:
+            ENCODING.context = _EncodingContext()
+            try:
+                result = __model_to_json(tinymodel, return_dict, return_raw, naive_datetimes, projection)
+            finally:
+                ENCODING.context = None
+        json_cache.put(tinymodel, variant, result)
+    return result
+
+
+def __model_to_json(tinymodel, return_dict, return_raw, naive_datetimes, projection):
     json_fields = {}
     object_as_json = ''
-
-    for field_def in filter(lambda f: hasattr(tinymodel, f.title), tinymodel.FIELD_DEFS):
+    lazy_fields = tinymodel.LAZY_FIELDS if not (return_raw or naive_datetimes) else {}
+
+    for field_def in compile_schema(type(tinymodel)).field_defs:
+        if projection is not None and field_def.title not in projection:
+            continue
+        if field_def.title in lazy_fields:
+            json_fields[field_def.title] = j.dumps(lazy_fields[field_def.title])
+            continue
+        if not hasattr(tinymodel, field_def.title):
+            continue
         json_fields.update({field_def.title: __field_to_json(
             tinymodel,
             this_value=getattr(tinymodel, field_def.title),
@@ -198,3 +340,92 @@ def to_json(tinymodel, return_dict=False, return_raw=False, naive_datetimes=Fals
             return object_as_dict
         else:
             return object_as_json
+
+
+def to_json_graph(cls, models):
+    """
+    Creates a JSON representation of several models, where every model nested in their fields is serialized once,
+    even if several models share it. Each distinct (class, id) is serialized once in the "objects" table,
+    and is referenced everywhere else, as {"$ref": key}:
+
+        {"models": [{"$ref": "app.models.Post:1"}, ...],
+         "objects": {"app.models.Post:1": {"id": 1, "author": {"$ref": "app.models.User:7"}}, ...}}
+
+    Models without an id are keyed by identity instead. Use from_json_graph to load it back.
+
+    :param list(TinyModel) models: The models to serialize
+
+    :rtype str: A JSON-formatted str representation of the models
+    """
+    graph = _Graph()
+    previous_context = getattr(ENCODING, 'context', None)
+    ENCODING.context = _EncodingContext(graph)
+    try:
+        references = [graph.reference(tinymodel) for tinymodel in models]
+        objects = []
+        while graph.pending:
+            (key, tinymodel) = graph.pending.popleft()
+            objects.append(j.dumps(key) + ': ' + __model_to_json(tinymodel, False, False, False, None))
+    finally:
+        ENCODING.context = previous_context
+    return '{"models": [' + ','.join(references) + '], "objects": {' + ','.join(objects) + '}}'
+
+
+def __related_classes(cls):
+    """ Returns the TinyModel classes that the fields of a class can hold, directly or indirectly, including the class. """
+    from tinymodel import TinyModel
+    found = [cls]
+    pending = [cls]
+    while pending:
+        field_types = [t for f in compile_schema(pending.pop()).field_defs for t in f.allowed_types]
+        while field_types:
+            field_type = field_types.pop()
+            if isinstance(field_type, dict):
+                field_types.extend(field_type.items()[0])
+            elif isinstance(field_type, (list, tuple, set)):
+                field_types.extend(field_type)
+            elif isinstance(field_type, type) and issubclass(field_type, TinyModel) and field_type not in found:
+                found.append(field_type)
+                pending.append(field_type)
+    return found
+
+
+def __resolve_references(json_value, instances):
+    if isinstance(json_value, dict):
+        if json_value.keys() == ['$ref']:
+            if json_value['$ref'] not in instances:
+                raise ModelException("Unknown reference " + repr(json_value['$ref']) + " in JSON graph")
+            return instances[json_value['$ref']]
+        return dict((key, __resolve_references(value, instances)) for (key, value) in json_value.items())
+    if isinstance(json_value, list):
+        return [__resolve_references(value, instances) for value in json_value]
+    return json_value
+
+
+def from_json_graph(cls, graph_as_json):
+    """
+    Loads models from their to_json_graph representation. Every key of the objects table becomes a single instance,
+    shared by all the models that reference it. The classes of the objects must be cls, or classes its fields can hold.
+
+    :param str | dict graph_as_json: The representation of the models, as returned by to_json_graph, or parsed
+
+    :rtype list(TinyModel): The models, in order
+    """
+    graph = j.loads(graph_as_json) if isinstance(graph_as_json, basestring) else graph_as_json
+    classes = dict((c.__module__ + '.' + c.__name__, c) for c in __related_classes(cls))
+    instances = {}
+    for key in graph['objects']:
+        path = key.split(':', 1)[0].split('#', 1)[0]
+        if path not in classes:
+            raise ModelException("Unexpected class " + path + " in JSON graph of " + str(cls))
+        instances[key] = classes[path](set_defaults=False)
+    # instances are created first, and filled in afterwards, so that references can form cycles
+    for (key, json_fields) in graph['objects'].items():
+        tinymodel = instances[key]
+        for (title, value) in from_json(tinymodel, __resolve_references(json_fields, instances), preprocessed=True).items():
+            setattr(tinymodel, title, value)
+        # set default values for the missing fields, like TinyModel.__init__
+        for this_field_def in set(compile_schema(type(tinymodel)).field_defs) - set(f.field_def for f in tinymodel.FIELDS):
+            if this_field_def.has_valid_default_value() and this_field_def.title != 'id':
+                setattr(tinymodel, this_field_def.title, this_field_def.default_value)
+    return [__resolve_references(reference, instances) for reference in graph['models']]
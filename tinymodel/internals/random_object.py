@@ -1,5 +1,7 @@
 import random as r
 
+from tinymodel.internals.schema import compile_schema
+
 class RecursionDepthError(Exception):
     pass
 
@@ -53,7 +55,7 @@ def random(tinymodel, model_recursion_depth=1, attribs_only=False):
     """
     attrs_to_set = {}
 
-    for field_def in tinymodel.FIELD_DEFS:
+    for field_def in compile_schema(type(tinymodel)).field_defs:
         if attribs_only and field_def.relationship != 'attribute':
             pass
         else:
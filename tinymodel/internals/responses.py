@@ -0,0 +1,19 @@
+import json
+
+
+def response_items(response):
+    """ Returns the items of a service response as a list, whether the service returned one item, several or None. """
+    if response is None:
+        return []
+    if isinstance(response, (list, tuple, set)):
+        return list(response)
+    return [response]
+
+
+def field_value(item, field_name):
+    """ Reads a field from an item of a service response, whether it is a JSON str, a dict or an object. """
+    if isinstance(item, basestring):
+        item = json.loads(item)
+    if isinstance(item, dict):
+        return item.get(field_name)
+    return getattr(item, field_name, None)
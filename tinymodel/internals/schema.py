@@ -0,0 +1,137 @@
+import threading
+
+from tinymodel.internals import field_def_validation
+
+
+COMPILED_SCHEMAS = {}
+SCHEMA_LOCK = threading.RLock()
+
+
+class CompiledSchema(object):
+
+    """
+    The validated, immutable definition of a TinyModel class.
+
+    A CompiledSchema is built once per class by compile_schema, from validated copies of the class FIELD_DEFS.
+    Neither the class FIELD_DEFS attribute nor the FieldDefs it holds are modified, so subclasses can still extend it
+    (e.g. FIELD_DEFS = Base.FIELD_DEFS + [...]). The compiled FieldDefs are read through compile_schema(cls).field_defs.
+
+    """
+
+    __slots__ = ('model_class', 'field_defs', 'json_cacheable', '_field_defs_by_name', '_dependents')
+
+    def __init__(self, model_class, field_defs):
+        """
+        :param class model_class: The TinyModel class this schema was compiled from
+        :param list(FieldDef) field_defs: The validated FieldDefs, in order
+
+        """
+        field_defs = tuple(field_defs)
+
+        # titles and aliases, where the first FieldDef to use a name wins
+        field_defs_by_name = {}
+        for field_def in reversed(field_defs):
+            field_defs_by_name[field_def.alias] = field_def
+        for field_def in reversed(field_defs):
+            field_defs_by_name[field_def.title] = field_def
+
+        # calculated fields to invalidate when a field changes, including calculated fields that depend on those
+        dependents = {}
+        for field_def in field_defs:
+            for title in (field_def.depends_on or []):
+                dependents.setdefault(title, []).append(field_def.title)
+        for title in dependents.keys():
+            found = []
+            pending = list(dependents[title])
+            while pending:
+                dependent = pending.pop(0)
+                if dependent not in found:
+                    found.append(dependent)
+                    pending.extend(dependents.get(dependent, []))
+            dependents[title] = tuple(found)
+
+        object.__setattr__(self, 'model_class', model_class)
+        object.__setattr__(self, 'field_defs', field_defs)
+        # calculated fields without depends_on are evaluated on every access, so their serialization can't be cached
+        object.__setattr__(self, 'json_cacheable', not [f for f in field_defs if f.calculated and f.depends_on is None])
+        object.__setattr__(self, '_field_defs_by_name', field_defs_by_name)
+        object.__setattr__(self, '_dependents', dependents)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledSchema is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("CompiledSchema is immutable")
+
+    def __repr__(self):
+        return unicode('<tinymodel.CompiledSchema "%s">' % self.model_class.__name__)
+
+    def get_field_def(self, name):
+        """
+        Returns the FieldDef with the given title or alias, or None.
+
+        :param str name: The title or alias of the field
+
+        """
+        return self._field_defs_by_name.get(name)
+
+    def get_dependents(self, title):
+        """
+        Returns the titles of the calculated fields whose memoized values depend on the given field, directly or indirectly.
+
+        :param str title: The title of the field
+
+        """
+        return self._dependents.get(title, ())
+
+
+class ModelMethod(object):
+
+    """
+    A method of TinyModel that gives way to a field with the same title.
+
+    Models can declare fields named like the methods added to TinyModel over time (e.g. aggregate or count).
+    On the instances of such a model, the attribute is the field, as it was before the method existed: reading it
+    returns the field value. The method is still available on the class, and through the module that defines it.
+
+    """
+
+    def __init__(self, function, is_classmethod=False):
+        """
+        :param function function: The function of the method, whose name is the name of the attribute
+        :param bool is_classmethod: True to bind the function to the class, like classmethod
+
+        """
+        self.__func__ = function
+        self.is_classmethod = is_classmethod
+
+    def __get__(self, instance, owner):
+        if instance is not None and compile_schema(owner).get_field_def(self.__func__.__name__) is not None:
+            return owner.__getattr__(instance, self.__func__.__name__)
+        if self.is_classmethod:
+            return self.__func__.__get__(owner, type(owner))
+        return self.__func__.__get__(instance, owner)
+
+
+def compile_schema(cls):
+    """
+    Returns the CompiledSchema of a TinyModel class, compiling it on first use.
+
+    Compilation validates the class definition and resolves class references. It happens exactly once per class:
+    concurrent first uses from several threads wait on a lock while one of them compiles,
+    and a class whose validation fails is not registered, so the error is raised again on the next use.
+
+    :param class cls: A TinyModel class
+
+    :rtype CompiledSchema: The compiled schema of the class
+
+    """
+    schema = COMPILED_SCHEMAS.get(cls)
+    if schema is None:
+        with SCHEMA_LOCK:
+            schema = COMPILED_SCHEMAS.get(cls)
+            if schema is None:
+                field_def_validation.validate_builtin_method_support(cls)
+                schema = CompiledSchema(cls, field_def_validation.validate_field_types(cls))
+                COMPILED_SCHEMAS[cls] = schema
+    return schema
@@ -1,9 +1,12 @@
 import datetime
-from dateutil import parser as date_parser
-import inspect
+import decimal
 import warnings
-from tinymodel.internals.field_def_validation import __substitute_class_refs
-from tinymodel.utils import ValidationError
+from tinymodel.internals.json_object import load_lazy_fields
+from tinymodel.internals.schema import compile_schema
+from tinymodel.utils import LazyModule, ValidationError
+
+date_parser = LazyModule('dateutil.parser')
+inspect = LazyModule('inspect')
 
 
 def __validate_field_value(tinymodel, this_field, original_value, allowed_types, value):
@@ -58,11 +61,12 @@ def validate(tinymodel, prior_errors=[], warning_only=False):
     data_validation_errors = []
 
     # Test missing required fields
-    for field_def in tinymodel.FIELD_DEFS:
+    for field_def in compile_schema(type(tinymodel)).field_defs:
         if field_def.required and not hasattr(tinymodel, field_def.title):
             data_validation_errors.append("Missing required field: " + field_def.title)
 
     # Test invalid field values
+    load_lazy_fields(tinymodel)
     for field in tinymodel.FIELDS:
         if field.field_def.validate and not field.is_valid():
             if not __validate_field_value(tinymodel, this_field=field, original_value=field.value, allowed_types=field.field_def.allowed_types, value=field.value):
@@ -96,13 +100,10 @@ def __match_field_value(cls, name, value):
 
         else:
             try:
-                field_def = filter(lambda f: f.title == name, cls.FIELD_DEFS)[0]
+                field_def = filter(lambda f: f.title == name, compile_schema(cls).field_defs)[0]
             except IndexError:
                 # name can be fk with '_id' at the end
-                field_def = filter(lambda f: f.title == name[:-3], cls.FIELD_DEFS)[0]
-
-            for index, allowed_type in enumerate(field_def.allowed_types):
-                field_def.allowed_types[index] = __substitute_class_refs(cls, field_name=field_def.title, required=field_def.required, field_type=allowed_type)
+                field_def = filter(lambda f: f.title == name[:-3], compile_schema(cls).field_defs)[0]
 
             if value and isinstance(value, dict):
                 if is_lookup_dict(value):
@@ -132,12 +133,12 @@ def __match_field_value(cls, name, value):
                         raise new_validation_error(value, name, field_def.allowed_types)
     else:
         try:
-            field_def = filter(lambda f: f.title == name, cls.FIELD_DEFS)[0]
+            field_def = filter(lambda f: f.title == name, compile_schema(cls).field_defs)[0]
         except IndexError:  # the id is expanded with _id, remove _id
-            field_def = filter(lambda f: f.title == name[:-3], cls.FIELD_DEFS)[0]
+            field_def = filter(lambda f: f.title == name[:-3], compile_schema(cls).field_defs)[0]
 
         if name.endswith('_id') and field_def.relationship != 'attribute':
-            if value_type not in set(field_def.allowed_types[1:] + [long, int, str, unicode]):
+            if value_type not in set(field_def.allowed_types[1:]) | set([long, int, str, unicode]):
                 raise new_validation_error(value, name, [long, int, str, unicode])
             if value_type in (str, unicode) and not value == None:
                 try:
@@ -145,9 +146,7 @@ def __match_field_value(cls, name, value):
                 except ValueError:
                     raise new_validation_error(value, name, [long, int, str, unicode])
         else:
-            field_def = filter(lambda f: f.title == name, cls.FIELD_DEFS)[0]
-            for index, allowed_type in enumerate(field_def.allowed_types):
-                field_def.allowed_types[index] = __substitute_class_refs(cls, field_name=field_def.title, required=field_def.required, field_type=allowed_type)
+            field_def = filter(lambda f: f.title == name, compile_schema(cls).field_defs)[0]
             if value_type not in field_def.allowed_types:
                 raise new_validation_error(value, name, field_def.allowed_types)
 
@@ -159,7 +158,7 @@ def match_field_values(cls, **kwargs):
 
 def __remove_values(cls, condition, **kwargs):
     keys = set(kwargs.keys())
-    for field_def in cls.FIELD_DEFS:
+    for field_def in compile_schema(cls).field_defs:
         field_names = set([field_def.title, field_def.alias])
         if condition(field_def) and (field_names & keys):
             del kwargs[(field_names & keys).pop()]
@@ -169,14 +168,14 @@ def __remove_values(cls, condition, **kwargs):
 def validate_order_by(cls, order_by):
     ORDER_BY_VALUES = ['ascending', 'descending', None]
     for key, value in order_by.items():
-        if key not in [title for title in [field_def.title for field_def in cls.FIELD_DEFS]]:
+        if key not in [title for title in [field_def.title for field_def in compile_schema(cls).field_defs]]:
             raise ValidationError(str(key) + " is not valid searchable field")
         if value not in ORDER_BY_VALUES:
             raise ValidationError(str(value) + " is not a valid ordering option, valid options are: " + str(ORDER_BY_VALUES))
 
 
 def validate_fuzzy_fields(cls, fields=[]):
-    fuzzy_fields = filter(lambda f: f.title in fields, cls.FIELD_DEFS)
+    fuzzy_fields = filter(lambda f: f.title in fields, compile_schema(cls).field_defs)
     if not fuzzy_fields:
         raise ValidationError('One or more fields indicated for fuzzy search, is not a field of %r' % cls)
     allowed_types = set([unicode, str])
@@ -185,6 +184,49 @@ def validate_fuzzy_fields(cls, fields=[]):
             raise ValidationError('%r is not a text field. Field not compatible with fuzzy search!' % field_def.title)
 
 
+def validate_projection(cls, only=None, exclude=None):
+    """
+    Validates the fields of a projection against FIELD_DEFS and resolves them to the list of fields to load.
+
+    :param list(str) only: The only fields to load. All fields are loaded if None.
+    :param list(str) exclude: Fields not to load.
+
+    :rtype list(str)|None: The titles of the fields to load, in FIELD_DEFS order, or None if there is no projection.
+
+    """
+    if only is None and exclude is None:
+        return None
+    titles = [field_def.title for field_def in compile_schema(cls).field_defs]
+    for field_name in list(only or []) + list(exclude or []):
+        if field_name not in titles:
+            raise ValidationError(str(field_name) + " is not a field of %r. Valid fields are: %s" % (cls, titles))
+    return [title for title in titles if (only is None or title in only) and title not in (exclude or [])]
+
+
+def validate_aggregation(cls, group_by=[], metrics={}):
+    """
+    Validates the fields of an aggregation against FIELD_DEFS.
+
+    :param list(str) group_by: The fields to group by
+    :param dict metrics: The operation to compute for every field: one of count, sum, avg, min or max.
+                         sum and avg are only valid for numeric fields.
+
+    """
+    field_defs = dict((field_def.title, field_def) for field_def in compile_schema(cls).field_defs
+                      if not field_def.calculated and field_def.relationship != 'has_many')
+    if not metrics:
+        raise ValidationError("Missing values for 'metrics' parameter.")
+    for field_name in list(group_by) + metrics.keys():
+        if field_name not in field_defs:
+            raise ValidationError(str(field_name) + " is not a field of %r that can be aggregated" % cls)
+    numeric_types = set([int, long, float, decimal.Decimal])
+    for (field_name, operation) in metrics.items():
+        if operation not in ('count', 'sum', 'avg', 'min', 'max'):
+            raise ValidationError(str(operation) + " is not a valid aggregation, valid aggregations are: count, sum, avg, min, max")
+        if operation in ('sum', 'avg') and not (set(field_defs[field_name].allowed_types) <= numeric_types):
+            raise ValidationError('%r is not a numeric field. Field not compatible with %s!' % (field_name, operation))
+
+
 def validate_range_lookup(lookup_dict, allowed_types):
     """
     Validates the contents of a dictionary meant for looking up objects by a range of values.
@@ -0,0 +1,344 @@
+import bisect
+import json
+import threading
+from datetime import date, datetime
+
+from tinymodel.service import Service
+from tinymodel.utils import ValidationError
+
+
+# params the api layer sends along with the field values of a find
+EXTRA_PARAMS = ('limit', 'offset', 'order_by', 'fuzzy', 'fuzzy_match_exclude', 'expand_related', 'only')
+RANGE_LOOKUPS = ('lt', 'lte', 'gt', 'gte')
+
+
+def _to_json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return unicode(value)
+
+
+def _is_range_lookup(value):
+    return isinstance(value, dict) and value and set(value) <= set(RANGE_LOOKUPS)
+
+
+def _sort_key(value):
+    """ Sorts None before any other value, without comparing it to them (datetimes cannot be compared to None). """
+    return (value is not None, value)
+
+
+class _Last(object):
+
+    """ Sorts after any other value, to bisect past every entry of the sorted index with a given value. """
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return other is not self
+
+    def __eq__(self, other):
+        return other is self
+
+_LAST = _Last()
+
+
+class _Table(object):
+
+    """
+    The rows of one endpoint, by id, with the indexes built for them so far.
+
+    Hash indexes (value -> set of ids) are built for a field the first time it is queried by equality,
+    and sorted indexes (a sorted list of (value, id)) the first time it is queried by range or ordered by.
+    Both are kept up to date by every write from then on.
+
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.documents = {}
+        self.next_id = 1
+        self.hash_indexes = {}
+        self.sorted_indexes = {}
+        self.unhashable_fields = set()
+
+    def document(self, id):
+        """ Returns the JSON document of a row, encoding it on first use. """
+        document = self.documents.get(id)
+        if document is None:
+            document = self.documents[id] = json.dumps(self.rows[id], default=_to_json_default)
+        return document
+
+    def hash_index(self, field_name):
+        if field_name in self.unhashable_fields:
+            return None
+        index = self.hash_indexes.get(field_name)
+        if index is None:
+            index = {}
+            try:
+                for (id, row) in self.rows.iteritems():
+                    index.setdefault(row.get(field_name), set()).add(id)
+            except TypeError:
+                self.unhashable_fields.add(field_name)
+                return None
+            self.hash_indexes[field_name] = index
+        return index
+
+    def sorted_index(self, field_name):
+        index = self.sorted_indexes.get(field_name)
+        if index is None:
+            index = self.sorted_indexes[field_name] = sorted((_sort_key(row.get(field_name)), id) for (id, row) in self.rows.iteritems())
+        return index
+
+    def insert(self, row):
+        id = row['id']
+        self.rows[id] = row
+        self.documents.pop(id, None)
+        for (field_name, index) in self.hash_indexes.items():
+            try:
+                index.setdefault(row.get(field_name), set()).add(id)
+            except TypeError:
+                del self.hash_indexes[field_name]
+                self.unhashable_fields.add(field_name)
+        for (field_name, index) in self.sorted_indexes.items():
+            bisect.insort(index, (_sort_key(row.get(field_name)), id))
+
+    def remove(self, id):
+        row = self.rows.pop(id)
+        self.documents.pop(id, None)
+        for (field_name, index) in self.hash_indexes.items():
+            ids = index.get(row.get(field_name))
+            ids.discard(id)
+            if not ids:
+                del index[row.get(field_name)]
+        for (field_name, index) in self.sorted_indexes.items():
+            position = bisect.bisect_left(index, (_sort_key(row.get(field_name)), id))
+            del index[position]
+        return row
+
+    def range_ids(self, field_name, lookup):
+        """ Returns the ids of the rows whose value of field_name is in the range of a lookup dict. """
+        index = self.sorted_index(field_name)
+        # (key, ) sorts before every (key, id), and (key, _LAST) after every one of them. None values are never in range.
+        start, end = bisect.bisect_right(index, (_sort_key(None), _LAST)), len(index)
+        if 'gt' in lookup:
+            start = bisect.bisect_right(index, (_sort_key(lookup['gt']), _LAST))
+        elif 'gte' in lookup:
+            start = bisect.bisect_left(index, (_sort_key(lookup['gte']),))
+        if 'lt' in lookup:
+            end = bisect.bisect_left(index, (_sort_key(lookup['lt']),))
+        elif 'lte' in lookup:
+            end = bisect.bisect_right(index, (_sort_key(lookup['lte']), _LAST))
+        return set(id for (key, id) in index[start:end])
+
+
+class InMemoryService(Service):
+
+    """
+    A Service that keeps records in memory, one table per endpoint, implementing the whole contract of the api layer:
+    find (with limit, offset, order_by, fuzzy fields and lt/lte/gt/gte lookup dicts), create, create_many, update,
+    delete, get_or_create, sum, count, exists, upsert and upsert_many.
+
+    Equality and range queries use hash and sorted indexes instead of scanning, so that find stays fast with
+    millions of rows. Records are returned as JSON documents (return_type 'json'), encoded once per write.
+
+    Fuzzy fields match when every word of the queried value, except the words in fuzzy_match_exclude,
+    is found in the stored value, ignoring case.
+
+    """
+
+    def __init__(self, middlewares=None, hedging_policy=None):
+        self.tables = {}
+        self.lock = threading.RLock()
+        super(InMemoryService, self).__init__(return_type='json', middlewares=middlewares, hedging_policy=hedging_policy,
+                                              supports_projection=True,
+                                              find=self.__find, create=self.__create, create_many=self.__create_many,
+                                              update=self.__update, delete=self.__delete,
+                                              get_or_create=self.__get_or_create, sum=self.__sum,
+                                              count=self.__count, exists=self.__exists,
+                                              upsert=self.__upsert, upsert_many=self.__upsert_many)
+
+    def table(self, endpoint_name):
+        """ Returns the table of an endpoint, creating it if needed. """
+        table = self.tables.get(endpoint_name)
+        if table is None:
+            with self.lock:
+                table = self.tables.setdefault(endpoint_name, _Table())
+        return table
+
+    def __matching_ids(self, table, kwargs):
+        """ Returns the ids of the rows matching the field values of a query, or None if the query matches every row. """
+        filters = dict((key, value) for (key, value) in kwargs.items() if key not in EXTRA_PARAMS)
+        fuzzy_fields = [field_name for field_name in (kwargs.get('fuzzy') or []) if field_name in filters]
+        candidates = None
+
+        def narrow(candidates, ids):
+            return ids if candidates is None else candidates & ids
+
+        if 'id' in filters and not _is_range_lookup(filters['id']):
+            candidates = set([filters['id']]) if filters['id'] in table.rows else set()
+        scans = []
+        for (field_name, value) in filters.items():
+            if field_name in fuzzy_fields or (field_name == 'id' and not _is_range_lookup(value)):
+                continue
+            if _is_range_lookup(value):
+                candidates = narrow(candidates, table.range_ids(field_name, value))
+                continue
+            index = table.hash_index(field_name)
+            try:
+                hash(value)
+            except TypeError:
+                index = None
+            if index is None:
+                scans.append((field_name, value))
+            else:
+                candidates = narrow(candidates, index.get(value, set()))
+            if candidates is not None and not candidates:
+                return set()
+
+        if fuzzy_fields:
+            excluded_words = set(word.lower() for word in (kwargs.get('fuzzy_match_exclude') or []))
+            for field_name in fuzzy_fields:
+                words = [word for word in unicode(filters[field_name]).lower().split() if word not in excluded_words]
+                scans.append((field_name, _FuzzyMatch(words)))
+        if scans:
+            ids = table.rows.iterkeys() if candidates is None else candidates
+            candidates = set(id for id in ids if all(_matches(table.rows[id].get(field_name), value) for (field_name, value) in scans))
+        return candidates
+
+    def __find(self, endpoint_name, **kwargs):
+        table = self.table(endpoint_name)
+        with self.lock:
+            ids = self.__matching_ids(table, kwargs)
+            ordering = [(field_name, direction) for (field_name, direction) in (kwargs.get('order_by') or {}).items() if direction is not None]
+            offset = kwargs.get('offset') or 0
+            limit = kwargs.get('limit')
+            end = offset + limit if limit is not None else None
+
+            if len(ordering) == 1:
+                # walk the sorted index, which is cheaper than sorting when most rows match
+                (field_name, direction) = ordering[0]
+                index = table.sorted_index(field_name)
+                if ids is not None and len(ids) * 10 < len(index):
+                    ordered = sorted(ids, key=lambda id: (_sort_key(table.rows[id].get(field_name)), id), reverse=direction == 'descending')
+                else:
+                    entries = reversed(index) if direction == 'descending' else iter(index)
+                    ordered = (id for (key, id) in entries if ids is None or id in ids)
+                page = []
+                for (position, id) in enumerate(ordered):
+                    if end is not None and position >= end:
+                        break
+                    if position >= offset:
+                        page.append(id)
+            else:
+                ordered = sorted(table.rows if ids is None else ids)
+                for (field_name, direction) in reversed(ordering):
+                    ordered.sort(key=lambda id: _sort_key(table.rows[id].get(field_name)), reverse=direction == 'descending')
+                page = ordered[offset:end]
+
+            only = kwargs.get('only')
+            if only is not None:
+                return [json.dumps(dict((key, value) for (key, value) in table.rows[id].items() if key in only), default=_to_json_default)
+                        for id in page]
+            return [table.document(id) for id in page]
+
+    def __create(self, endpoint_name, **kwargs):
+        return self.__create_many(endpoint_name, [kwargs])[0]
+
+    def __create_many(self, endpoint_name, records):
+        table = self.table(endpoint_name)
+        with self.lock:
+            created = []
+            for record in records:
+                row = dict(record)
+                if row.get('id') is None:
+                    row['id'] = table.next_id
+                elif row['id'] in table.rows:
+                    raise ValidationError('A record with id %r already exists on endpoint "%s"' % (row['id'], endpoint_name))
+                if isinstance(row['id'], (int, long)):
+                    table.next_id = max(table.next_id, row['id'] + 1)
+                table.insert(row)
+                created.append(table.document(row['id']))
+            return created
+
+    def __update(self, endpoint_name, **kwargs):
+        table = self.table(endpoint_name)
+        if kwargs.get('id') is None:
+            raise ValidationError('InMemoryService needs the id of the record to update on endpoint "%s"' % endpoint_name)
+        with self.lock:
+            if kwargs['id'] not in table.rows:
+                return []
+            row = table.remove(kwargs['id'])
+            row.update((key, value) for (key, value) in kwargs.items() if key not in EXTRA_PARAMS)
+            table.insert(row)
+            return [table.document(row['id'])]
+
+    def __delete(self, endpoint_name, **kwargs):
+        table = self.table(endpoint_name)
+        with self.lock:
+            ids = self.__matching_ids(table, kwargs)
+            deleted = [table.document(id) for id in (table.rows.keys() if ids is None else ids)]
+            for id in (table.rows.keys() if ids is None else list(ids)):
+                table.remove(id)
+            return deleted
+
+    def __get_or_create(self, endpoint_name, **kwargs):
+        """ Returns the (document, created) pair for the first record matching kwargs, creating it if there is none. """
+        with self.lock:
+            found = self.__find(endpoint_name, limit=1, **kwargs)
+            if found:
+                return found[0], False
+            return self.__create(endpoint_name, **dict((k, v) for (k, v) in kwargs.items() if k not in EXTRA_PARAMS)), True
+
+    def __sum(self, endpoint_name, return_fields, **kwargs):
+        table = self.table(endpoint_name)
+        with self.lock:
+            ids = self.__matching_ids(table, kwargs)
+            rows = [table.rows[id] for id in (table.rows if ids is None else ids)]
+            totals = dict((field_name, sum(row.get(field_name) or 0 for row in rows)) for field_name in return_fields)
+            return json.dumps(totals, default=_to_json_default)
+
+
+    def __count(self, endpoint_name, **kwargs):
+        table = self.table(endpoint_name)
+        with self.lock:
+            ids = self.__matching_ids(table, kwargs)
+            return len(table.rows if ids is None else ids)
+
+    def __exists(self, endpoint_name, **kwargs):
+        return self.__count(endpoint_name, **kwargs) > 0
+
+
+    def __upsert(self, endpoint_name, by, update=True, **kwargs):
+        """ Returns the (document, created) pair of the record matching the by fields, updated, or created if there is none. """
+        table = self.table(endpoint_name)
+        values = dict((key, value) for (key, value) in kwargs.items() if key not in EXTRA_PARAMS)
+        with self.lock:
+            ids = self.__matching_ids(table, dict((key, value) for (key, value) in values.items() if key in by))
+            if ids is None or not ids:
+                return self.__create(endpoint_name, **values), True
+            id = min(ids)
+            if update:
+                row = table.remove(id)
+                row.update((key, value) for (key, value) in values.items() if key != 'id')
+                table.insert(row)
+            return table.document(id), False
+
+    def __upsert_many(self, endpoint_name, by, records):
+        with self.lock:
+            return [self.__upsert(endpoint_name, by, **record) for record in records]
+
+
+class _FuzzyMatch(object):
+
+    __slots__ = ('words',)
+
+    def __init__(self, words):
+        self.words = words
+
+
+def _matches(value, expected):
+    if isinstance(expected, _FuzzyMatch):
+        value = unicode(value or '').lower()
+        return all(word in value for word in expected.words)
+    return value == expected
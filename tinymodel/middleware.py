@@ -0,0 +1,270 @@
+"""
+Middlewares for tinymodel.service.Service.
+
+A middleware is a callable that receives the name of the service method, the next callable in the chain,
+and the arguments of the call (the api layer passes endpoint_name and the query as keyword arguments):
+
+    def log_calls(method_name, call, *args, **kwargs):
+        print method_name, kwargs.get('endpoint_name')
+        return call(*args, **kwargs)
+
+    service = Service(return_type='json', middlewares=[log_calls, Timeout(2.0)], find=..., create=...)
+
+Middlewares return what the service method returns, so that the return_type of the service,
+and the rendering of its responses by the api layer, are unchanged.
+
+"""
+import math
+import random
+import threading
+import time
+
+from tinymodel.internals.concurrency import Call, WorkerPool
+from tinymodel.utils import ServiceTimeoutError, ValidationError
+
+
+READ_METHODS = ('find', 'sum')
+# the errors Retry retries by default: timeouts, and I/O errors such as socket errors. Programming and validation
+# errors would fail again.
+TRANSIENT_ERRORS = (ServiceTimeoutError, IOError)
+
+
+class LatencyHistogram(object):
+
+    """
+    Records the latency of every call, per endpoint and method, in logarithmic buckets.
+    Each bucket is 5% wider than the previous one, so reported percentiles are within 5% of the exact value,
+    and memory does not grow with the number of calls.
+
+    """
+
+    MIN_LATENCY = 1e-5
+    GROWTH = 1.05
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.log_growth = math.log(self.GROWTH)
+
+    def __call__(self, method_name, call, *args, **kwargs):
+        started_at = time.time()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            self.record(kwargs.get('endpoint_name'), method_name, time.time() - started_at)
+
+    def record(self, endpoint_name, method_name, seconds):
+        """
+        Records the latency of a call.
+
+        :param str endpoint_name: The endpoint that was called
+        :param str method_name: The service method that was called
+        :param float seconds: The latency of the call
+
+        """
+        bucket = int(math.log(max(seconds, self.MIN_LATENCY) / self.MIN_LATENCY) / self.log_growth)
+        with self.lock:
+            buckets = self.histograms.setdefault((endpoint_name, method_name), {})
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    def count(self, endpoint_name=None, method_name=None):
+        """ Returns the number of calls recorded for the endpoint and method. None matches any endpoint or method. """
+        return sum(self.__merged_buckets(endpoint_name, method_name).values())
+
+    def percentile(self, percent, endpoint_name=None, method_name=None):
+        """
+        Returns a latency percentile.
+
+        :param float percent: The percentile, e.g. 95
+        :param str endpoint_name: Optional. Only calls to this endpoint are considered.
+        :param str method_name: Optional. Only calls to this service method are considered.
+
+        :rtype float|None: The latency in seconds, or None if no call was recorded
+        """
+        buckets = self.__merged_buckets(endpoint_name, method_name)
+        total = sum(buckets.values())
+        if not total:
+            return None
+        rank = max(1, int(math.ceil(total * percent / 100.0)))
+        seen = 0
+        for bucket in sorted(buckets):
+            seen += buckets[bucket]
+            if seen >= rank:
+                return self.MIN_LATENCY * self.GROWTH ** (bucket + 1)
+
+    def percentiles(self, endpoint_name=None, method_name=None):
+        """
+        :rtype dict: The p50, p95 and p99 latencies in seconds, with None values if no call was recorded
+        """
+        return dict(('p%d' % percent, self.percentile(percent, endpoint_name, method_name)) for percent in (50, 95, 99))
+
+    def snapshot(self):
+        """
+        :rtype dict: Maps (endpoint_name, method_name) to the call count and percentiles of every endpoint and method called so far
+        """
+        with self.lock:
+            keys = self.histograms.keys()
+        snapshot = {}
+        for (endpoint_name, method_name) in keys:
+            snapshot[(endpoint_name, method_name)] = dict(self.percentiles(endpoint_name, method_name),
+                                                          count=self.count(endpoint_name, method_name))
+        return snapshot
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def __merged_buckets(self, endpoint_name, method_name):
+        merged = {}
+        with self.lock:
+            for ((this_endpoint_name, this_method_name), buckets) in self.histograms.items():
+                if endpoint_name not in (None, this_endpoint_name) or method_name not in (None, this_method_name):
+                    continue
+                for (bucket, count) in buckets.items():
+                    merged[bucket] = merged.get(bucket, 0) + count
+        return merged
+
+
+class Retry(object):
+
+    """
+    Retries failed calls to idempotent read methods, sleeping between attempts with exponential backoff and full jitter.
+    Calls to other methods (create, update, delete...) are never retried.
+
+    """
+
+    def __init__(self, attempts=3, base_delay=0.05, max_delay=1.0, methods=READ_METHODS, exceptions=TRANSIENT_ERRORS):
+        """
+        :param int attempts: The maximum number of attempts, including the first one
+        :param float base_delay: The maximum delay before the first retry, in seconds. It doubles with every retry.
+        :param float max_delay: The cap on the maximum delay, in seconds
+        :param tuple(str) methods: The service methods that are safe to retry
+        :param tuple(class) exceptions: The exceptions that trigger a retry. Other exceptions are raised immediately.
+
+        """
+        if attempts < 1:
+            raise ValidationError('Retry needs at least one attempt, got %r' % attempts)
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.methods = methods
+        self.exceptions = exceptions
+
+    def __call__(self, method_name, call, *args, **kwargs):
+        if method_name not in self.methods:
+            return call(*args, **kwargs)
+        for attempt in range(self.attempts):
+            try:
+                return call(*args, **kwargs)
+            except self.exceptions:
+                if attempt == self.attempts - 1:
+                    raise
+            time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+
+class Timeout(object):
+
+    """
+    Enforces a deadline on every call. The call runs in another thread, and ServiceTimeoutError is raised if it has
+    not returned in time. Python threads cannot be interrupted, so the late call runs to completion and its result is discarded.
+
+    """
+
+    def __init__(self, seconds, methods=None):
+        """
+        :param float seconds: The deadline of a call, in seconds
+        :param tuple(str) methods: Optional. Only calls to these service methods get a deadline.
+
+        """
+        self.seconds = seconds
+        self.methods = methods
+
+    def __call__(self, method_name, call, *args, **kwargs):
+        if self.methods is not None and method_name not in self.methods:
+            return call(*args, **kwargs)
+        pending_call = Call(call, args, kwargs)
+        if not pending_call.wait(self.seconds):
+            raise ServiceTimeoutError('Service method "%s" on endpoint "%s" did not return within %.3f seconds' %
+                                      (method_name, kwargs.get('endpoint_name'), self.seconds))
+        return pending_call.result()
+
+
+class HedgingPolicy(object):
+
+    """
+    Hedges slow reads: if a call has not returned after a delay, a duplicate call is issued,
+    and the result of whichever call succeeds first is used. The other call is left to finish in the background
+    and its result is discarded.
+
+    The delay is either fixed, or a percentile of the latencies recorded by a LatencyHistogram for the same endpoint
+    and method (e.g. the p95), so that only the slowest calls are hedged. Hedged calls are capped by a budget:
+    every call earns `budget` tokens, up to `max_tokens`, and every hedge spends one.
+
+    The api layer uses the hedging_policy of a service for find and sum only. Writes are never hedged.
+    Calls run on a pool of reused worker threads, so that the calls that are not hedged do not start a thread each.
+
+    """
+
+    def __init__(self, delay=0.05, histogram=None, percentile=95, min_samples=100, budget=0.05, max_tokens=10):
+        """
+        :param float delay: The delay before hedging, in seconds. Used as is without a histogram,
+                            and until the histogram has min_samples calls for the endpoint and method.
+        :param LatencyHistogram histogram: Optional. The latencies to compute the delay from.
+        :param float percentile: The percentile of the recorded latencies to use as the delay
+        :param int min_samples: The number of recorded calls needed before the percentile is used
+        :param float budget: The share of calls that can be hedged in the long run, e.g. 0.05 for 5% extra load
+        :param float max_tokens: The maximum number of hedges that can be saved up for a burst of slow calls
+
+        """
+        self.delay = delay
+        self.histogram = histogram
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget = budget
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.calls = 0
+        self.hedged = 0
+        self.lock = threading.Lock()
+        self.workers = WorkerPool()
+
+    def get_delay(self, method_name, endpoint_name):
+        """ Returns the time to wait for a call before hedging it, in seconds. """
+        if self.histogram is not None and self.histogram.count(endpoint_name, method_name) >= self.min_samples:
+            return self.histogram.percentile(self.percentile, endpoint_name, method_name)
+        return self.delay
+
+    def __spend_token(self):
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.hedged += 1
+                return True
+            return False
+
+    def call(self, method_name, method, *args, **kwargs):
+        """
+        Calls a service method, hedging it if it is slow and the budget allows it.
+
+        :param str method_name: The name of the service method
+        :param callable method: The service method
+        """
+        with self.lock:
+            self.calls += 1
+            self.tokens = min(self.max_tokens, self.tokens + self.budget)
+
+        done_event = threading.Event()
+        calls = [Call(method, args, kwargs, done_event=done_event, pool=self.workers)]
+        if calls[0].wait(self.get_delay(method_name, kwargs.get('endpoint_name'))) or not self.__spend_token():
+            calls[0].wait()
+            return calls[0].result()
+
+        calls.append(Call(method, args, kwargs, done_event=done_event, pool=self.workers))
+        while True:
+            done_event.clear()
+            succeeded = next((c for c in calls if c.done() and c.exc_info is None), None)
+            if succeeded is not None:
+                return succeeded.value
+            if all(c.done() for c in calls):
+                return calls[0].result()
+            done_event.wait()
@@ -0,0 +1,246 @@
+import mmap
+import os
+import struct
+
+from tinymodel.internals.binary_object import (
+    decode_record,
+    encode_record,
+    get_plan,
+)
+from tinymodel.utils import ModelException
+
+
+MAGIC = 'TMF'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<3sB8sQQH')
+COLUMN_ENTRY = struct.Struct('<HcQQ')
+OFFSET = struct.Struct('<Q')
+
+# allowed_types that are stored as fixed-width columns, with their struct format
+COLUMN_FORMATS = (
+    (frozenset([int]), 'q'),
+    (frozenset([long]), 'q'),
+    (frozenset([int, long]), 'q'),
+    (frozenset([float]), 'd'),
+    (frozenset([bool]), 'b'),
+)
+INT64_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+
+def __column_format(field_def):
+    if field_def.relationship != 'attribute' or not all(isinstance(t, type) for t in field_def.allowed_types):
+        return None
+    allowed_types = frozenset(field_def.allowed_types)
+    return next((fmt for (types, fmt) in COLUMN_FORMATS if allowed_types == types), None)
+
+
+def __column_value(fmt, value):
+    """ Returns the value to store in a fixed-width column, or None when the value cannot be stored there. """
+    if fmt == 'q' and type(value) in (int, long) and INT64_RANGE[0] <= value <= INT64_RANGE[1]:
+        return value
+    elif fmt == 'd' and type(value) is float:
+        return value
+    elif fmt == 'b' and type(value) is bool:
+        return int(value)
+    return None
+
+
+def __align(fp):
+    padding = -fp.tell() % 8
+    if padding:
+        fp.write('\0' * padding)
+
+
+def write_model_file(path, cls, models):
+    """
+    Writes models to a file that can be memory-mapped with ModelFile.
+
+    Layout: a fixed header (magic, version, schema fingerprint, record count, index offset, column count),
+    a column directory, the records encoded with tinymodel.internals.binary_object, an index of record offsets,
+    and one fixed-width array (plus a presence array) for every int, long, float or bool attribute field.
+
+    :param str path: The file to write
+    :param tinymodel.TinyModel cls: The class of the models
+    :param iterable(TinyModel) models: The models to write. They are consumed one at a time.
+
+    :rtype int: The number of records written
+
+    """
+    plan = get_plan(cls)
+    columns = [(f.title, fmt) for (f, fmt) in ((f, __column_format(f)) for f in plan.field_defs) if fmt]
+    packers = dict((title, struct.Struct('<' + fmt)) for (title, fmt) in columns)
+    values = dict((title, bytearray()) for (title, fmt) in columns)
+    presence = dict((title, bytearray()) for (title, fmt) in columns)
+    offsets = []
+
+    with open(path, 'wb') as fp:
+        fp.write('\0' * (HEADER.size + COLUMN_ENTRY.size * len(columns) + sum(len(title) for (title, fmt) in columns)))
+        for tinymodel in models:
+            offsets.append(fp.tell())
+            fp.write(encode_record(tinymodel))
+            field_values = dict((f.field_def.title, f.value) for f in tinymodel.FIELDS)
+            for (title, fmt) in columns:
+                value = __column_value(fmt, field_values.get(title))
+                presence[title].append(value is not None)
+                values[title].extend(packers[title].pack(value if value is not None else 0))
+        offsets.append(fp.tell())
+
+        __align(fp)
+        index_offset = fp.tell()
+        for offset in offsets:
+            fp.write(OFFSET.pack(offset))
+
+        directory = []
+        for (title, fmt) in columns:
+            presence_offset = fp.tell()
+            fp.write(str(presence[title]))
+            __align(fp)
+            data_offset = fp.tell()
+            fp.write(str(values[title]))
+            directory.append(COLUMN_ENTRY.pack(len(title), fmt, data_offset, presence_offset) + title)
+
+        fp.seek(0)
+        fp.write(HEADER.pack(MAGIC, FORMAT_VERSION, plan.fingerprint, len(offsets) - 1, index_offset, len(columns)))
+        fp.write(''.join(directory))
+    return len(offsets) - 1
+
+
+class Column(object):
+
+    """
+    A read-only view of a fixed-width column in a ModelFile.
+    Values are unpacked straight from the memory map; nothing is copied or decoded up front.
+
+    """
+
+    def __init__(self, mapping, title, fmt, count, data_offset, presence_offset):
+        self.title = title
+        self.format = fmt
+        self.mapping = mapping
+        self.count = count
+        self.data_offset = data_offset
+        self.presence_offset = presence_offset
+        self.item = struct.Struct('<' + fmt)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('column index out of range')
+        if self.mapping[self.presence_offset + index] == '\0':
+            return None
+        value = self.item.unpack_from(self.mapping, self.data_offset + index * self.item.size)[0]
+        return bool(value) if self.format == 'b' else value
+
+    def __iter__(self):
+        for index in xrange(self.count):
+            yield self[index]
+
+    def buffer(self):
+        """
+        Returns a zero-copy buffer over the raw little-endian values of this column,
+        e.g. for numpy.frombuffer. Slots of missing values hold 0; see presence().
+
+        """
+        return buffer(self.mapping, self.data_offset, self.count * self.item.size)
+
+    def presence(self):
+        """ Returns a zero-copy buffer holding one byte per record: 1 if the value is present, 0 otherwise. """
+        return buffer(self.mapping, self.presence_offset, self.count)
+
+
+class ModelFile(object):
+
+    """
+    Read-only, memory-mapped access to a file written by write_model_file.
+
+    Records are decoded lazily, one at a time, when they are indexed or iterated.
+    Since the file is mapped read-only, every process that opens it (or inherits it across a fork)
+    shares the same pages of the OS page cache.
+
+    """
+
+    def __init__(self, path, cls):
+        """
+        Opens and maps a model file.
+
+        :param str path: The file to read
+        :param tinymodel.TinyModel cls: The class the records are decoded to. Its schema must match the one the file was written with.
+
+        """
+        self.path = path
+        self.cls = cls
+        with open(path, 'rb') as fp:
+            # an empty file cannot be mapped
+            if not os.fstat(fp.fileno()).st_size:
+                raise ModelException(path + " is not a tinymodel file")
+            self.mapping = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.__read_header()
+        except BaseException:
+            self.mapping.close()
+            raise
+
+    def __read_header(self):
+        """ Validates the header of the file, and reads its column table. """
+        if self.mapping.size() < HEADER.size:
+            raise ModelException(self.path + " is not a tinymodel file")
+        magic, version, fingerprint, self.count, self.index_offset, column_count = HEADER.unpack_from(self.mapping, 0)
+        if magic != MAGIC:
+            raise ModelException(self.path + " is not a tinymodel file")
+        if version != FORMAT_VERSION:
+            raise ModelException(self.path + " has unsupported format version " + str(version))
+        if fingerprint != get_plan(self.cls).fingerprint:
+            raise ModelException(self.path + " was written with a schema (" + fingerprint.encode('hex') + ") that does not match " + str(self.cls))
+
+        self.columns = {}
+        position = HEADER.size
+        for x in xrange(column_count):
+            try:
+                title_size, fmt, data_offset, presence_offset = COLUMN_ENTRY.unpack_from(self.mapping, position)
+            except struct.error:
+                raise ModelException(self.path + " is truncated")
+            position += COLUMN_ENTRY.size
+            title = self.mapping[position:position + title_size]
+            position += title_size
+            self.columns[title] = Column(self.mapping, title, fmt, self.count, data_offset, presence_offset)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('record index out of range')
+        start, end = struct.unpack_from('<QQ', self.mapping, self.index_offset + index * OFFSET.size)
+        return decode_record(self.cls, buffer(self.mapping, start, end - start))
+
+    def __iter__(self):
+        for index in xrange(self.count):
+            yield self[index]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def column(self, title):
+        """
+        Returns the fixed-width Column for an int, long, float or bool field.
+
+        :param str title: The title of the field
+
+        """
+        if title not in self.columns:
+            raise KeyError(str(title) + " is not stored as a fixed-width column in " + self.path)
+        return self.columns[title]
+
+    def close(self):
+        self.mapping.close()
@@ -0,0 +1,286 @@
+"""
+Bulk JSON exports and imports that use every core.
+
+    with open('posts.ndjson', 'w') as fp:
+        dump_many(posts, fp, workers=4)
+    with open('posts.ndjson') as fp:
+        posts = load_many(fp, Post, workers=4)
+
+Models are split into chunks that are serialized or deserialized by a pool of worker processes, with a bounded number
+of chunks in flight, and the chunks are written or returned in order. Models cross process boundaries as PackedModels,
+i.e. their class and field values, instead of pickled instances with their Field wrappers and caches.
+
+"""
+import collections
+import multiprocessing
+import re
+import sys
+
+from tinymodel.internals.schema import compile_schema
+from tinymodel.utils import LazyModule, ModelException
+
+j = LazyModule('json')
+
+NDJSON = 'ndjson'
+JSON_ARRAY = 'array'
+FORMATS = (NDJSON, JSON_ARRAY)
+# the number of bytes read at a time from a JSON array
+READ_SIZE = 1 << 16
+WHITESPACE = re.compile(r'\s*')
+
+
+class PackedModel(object):
+
+    """
+    The class and field values of a model, with its untranslated lazy fields and the titles of its validated fields.
+    Nested models are packed as well.
+    """
+
+    __slots__ = ('cls', 'values', 'lazy_fields', 'validated')
+
+    def __init__(self, cls, values, lazy_fields=None, validated=None):
+        self.cls = cls
+        self.values = values
+        self.lazy_fields = lazy_fields
+        self.validated = validated
+
+    def __reduce__(self):
+        return (PackedModel, (self.cls, self.values, self.lazy_fields, self.validated))
+
+
+def __pack_value(value):
+    from tinymodel import TinyModel
+    if isinstance(value, TinyModel):
+        return pack(value)
+    if isinstance(value, list):
+        return [__pack_value(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(__pack_value(v) for v in value)
+    if isinstance(value, set):
+        return set(__pack_value(v) for v in value)
+    if isinstance(value, dict):
+        return dict((__pack_value(k), __pack_value(v)) for (k, v) in value.items())
+    return value
+
+
+def __unpack_value(value):
+    if isinstance(value, PackedModel):
+        return unpack(value)
+    if isinstance(value, list):
+        return [__unpack_value(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(__unpack_value(v) for v in value)
+    if isinstance(value, set):
+        return set(__unpack_value(v) for v in value)
+    if isinstance(value, dict):
+        return dict((__unpack_value(k), __unpack_value(v)) for (k, v) in value.items())
+    return value
+
+
+def pack(tinymodel):
+    """
+    :rtype PackedModel: The class and field values of a model
+    """
+    values = dict((field.field_def.title, __pack_value(field.value)) for field in tinymodel.FIELDS)
+    validated = [field.field_def.title for field in tinymodel.FIELDS if field.is_valid()]
+    return PackedModel(type(tinymodel), values, dict(tinymodel.LAZY_FIELDS) or None, validated or None)
+
+
+def unpack(packed):
+    """
+    :rtype TinyModel: The model a PackedModel was packed from. Its fields are set directly, since their values were
+                      translated when the model was built: default values are not set again, strs are not parsed as dates,
+                      and the validated fields stay validated.
+    """
+    from tinymodel import Field
+    tinymodel = packed.cls(set_defaults=False)
+    validated = packed.validated or ()
+    for field_def in compile_schema(packed.cls).field_defs:
+        if field_def.title in packed.values:
+            field = Field(field_def=field_def, value=__unpack_value(packed.values[field_def.title]))
+            if field_def.title in validated:
+                field.was_validated = True
+                field.last_validated_value = field.value
+            tinymodel.FIELDS.append(field)
+    if packed.lazy_fields:
+        tinymodel.LAZY_FIELDS.update(packed.lazy_fields)
+    return tinymodel
+
+
+def __dump_chunk(args):
+    (models, naive_datetimes) = args
+    return [(unpack(tinymodel) if isinstance(tinymodel, PackedModel) else tinymodel).to_json(naive_datetimes=naive_datetimes)
+            for tinymodel in models]
+
+
+def __load_chunk(args):
+    (cls, records, packed) = args
+    if records and isinstance(records[0], basestring):
+        records = [j.loads(record) for record in records]
+    models = [cls(from_json=record, preprocessed=True) for record in records]
+    return [pack(tinymodel) for tinymodel in models] if packed else models
+
+
+def __chunks(items, chunk_size):
+    chunk = []
+    try:
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    except Exception:
+        # the items read before the failure are yielded first, e.g. the records before the end of a truncated file
+        exc_info = sys.exc_info()
+        if chunk:
+            yield chunk
+        raise exc_info[0], exc_info[1], exc_info[2]
+    if chunk:
+        yield chunk
+
+
+def ordered_map(function, tasks, workers):
+    """
+    Yields the results of function for every task, in order. With several workers, the tasks run in a process pool,
+    with at most two tasks per worker in flight, so that the tasks are not all held in memory at once.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield function(task)
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.apply_async(function, (task,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def __default_workers(workers):
+    return multiprocessing.cpu_count() if workers is None else workers
+
+
+def dump_many(models, fp, workers=None, chunk_size=1000, format=NDJSON, naive_datetimes=False):
+    """
+    Writes the JSON representations of models to a file, in order.
+
+    :param iterable(TinyModel) models: The models to write
+    :param file fp: The file to write to
+    :param int workers: The number of worker processes. Defaults to the number of cores. 1 serializes in this process.
+    :param int chunk_size: The number of models serialized per task
+    :param str format: NDJSON for one JSON object per line, or JSON_ARRAY for a JSON array
+
+    :rtype int: The number of models written
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown format %r. Supported formats are: %s' % (format, FORMATS))
+    workers = __default_workers(workers)
+    count = 0
+    # models are only packed to be sent to other processes
+    tasks = (([pack(tinymodel) for tinymodel in chunk] if workers > 1 else chunk, naive_datetimes)
+             for chunk in __chunks(models, chunk_size))
+    if format == JSON_ARRAY:
+        fp.write('[')
+    for serialized in ordered_map(__dump_chunk, tasks, workers):
+        if format == NDJSON:
+            fp.write('\n'.join(serialized) + '\n')
+        else:
+            fp.write((',\n' if count else '\n') + ',\n'.join(serialized))
+        count += len(serialized)
+    if format == JSON_ARRAY:
+        fp.write('\n]\n')
+    return count
+
+
+def __is_json_array(fp):
+    """ Checks whether a file holds a JSON array, by its first non-blank character, and moves back to that character. """
+    while True:
+        position = fp.tell()
+        char = fp.read(1)
+        if not char:
+            return False
+        if not char.isspace():
+            fp.seek(position)
+            return char == '['
+
+
+def __iter_json_array(fp):
+    """
+    Yields the elements of the JSON array a file holds, from its opening bracket on. Elements are parsed as the file
+    is read, READ_SIZE bytes at a time or more for large elements, so that the array is never held in memory at once.
+
+    :raises ModelException: if the file does not hold a valid JSON array
+    """
+    decoder = j.JSONDecoder()
+    buffer = fp.read(READ_SIZE)
+    # after the opening bracket, and then after every element
+    (position, after_element, eof) = (1, False, False)
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        if position < len(buffer):
+            char = buffer[position]
+            if char == ']':
+                return
+            if after_element:
+                if char != ',':
+                    raise ModelException('Expected "," or "]" at %r in the JSON array' % buffer[position:position + 20])
+                (position, after_element) = (position + 1, False)
+                continue
+            try:
+                (record, end) = decoder.raw_decode(buffer, position)
+            except ValueError as e:
+                if eof:
+                    raise ModelException('Invalid JSON array: ' + str(e))
+            else:
+                # an element that ends the buffer may go on, e.g. a number
+                if end < len(buffer) or eof:
+                    yield record
+                    (position, after_element) = (end, True)
+                    continue
+        elif eof:
+            raise ModelException('Unterminated JSON array')
+        data = fp.read(max(READ_SIZE, len(buffer) - position))
+        (buffer, position, eof) = (buffer[position:] + data, 0, not data)
+
+
+def iter_records(fp, chunk_size=1000):
+    """
+    Reads the records of a file holding NDJSON or a JSON array, in chunks.
+    NDJSON lines are yielded unparsed, so that they are parsed by the workers. The elements of a JSON array are parsed
+    as the file is read, and every chunk is yielded as soon as it is complete.
+
+    :rtype generator(list(str | dict)): Chunks of records
+    """
+    if __is_json_array(fp):
+        for chunk in __chunks(__iter_json_array(fp), chunk_size):
+            yield chunk
+    else:
+        for chunk in __chunks((line for line in fp if line.strip()), chunk_size):
+            yield chunk
+
+
+def load_many(fp, cls, workers=None, chunk_size=1000):
+    """
+    Reads models from a file holding NDJSON or a JSON array of their JSON representations, in order.
+
+    :param file fp: The file to read from
+    :param class cls: The TinyModel class of the records
+    :param int workers: The number of worker processes. Defaults to the number of cores. 1 deserializes in this process.
+    :param int chunk_size: The number of records deserialized per task
+
+    :rtype list(TinyModel): The models
+    """
+    # compiled before the workers are forked, so that they inherit the compiled schema
+    compile_schema(cls)
+    models = []
+    workers = __default_workers(workers)
+    tasks = ((cls, records, workers > 1) for records in iter_records(fp, chunk_size))
+    for chunk in ordered_map(__load_chunk, tasks, workers):
+        models.extend(unpack(tinymodel) if workers > 1 else tinymodel for tinymodel in chunk)
+    return models
@@ -0,0 +1,131 @@
+import contextlib
+import random
+import threading
+import time
+
+from tinymodel.internals.responses import field_value, response_items
+from tinymodel.service import Service
+from tinymodel.utils import ValidationError
+
+
+READ_METHODS = ('find', 'sum', 'count', 'exists', 'aggregate')
+WRITE_METHODS = ('create', 'create_many', 'update', 'delete', 'get_or_create', 'upsert', 'upsert_many')
+
+
+class ReplicatedService(Service):
+
+    """
+    A Service that sends reads (find, sum, count, exists, aggregate) to a pool of replicas and writes
+    (create, create_many, update, delete, get_or_create, upsert, upsert_many) to a primary.
+
+    The methods of the primary are exposed, so that the api layer uses the same optional methods (e.g. count or upsert)
+    as on the primary itself. A read goes to the replica with the fewest calls in flight, among the replicas that have
+    the method, or to the primary if none has it.
+
+    To read your own writes despite replication lag, a read is sent to the primary instead when the session wrote
+    the same record (by id), or when it reads a query on an endpoint it wrote, in the last pin_seconds.
+    By default, each thread is a session; session() opens a new one.
+
+    """
+
+    def __init__(self, primary, replicas, return_type=None, pin_seconds=5.0, middlewares=None, hedging_policy=None):
+        """
+        :param Service primary: The service that receives the writes
+        :param list(Service) replicas: The services that receive the reads
+        :param str return_type: The return_type of the services. Defaults to the return_type of the primary.
+        :param float pin_seconds: How long reads of a written record are sent to the primary
+
+        """
+        if not replicas:
+            raise ValidationError("ReplicatedService needs at least one replica")
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.pin_seconds = pin_seconds
+        self.outstanding = [0] * len(self.replicas)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        methods = {}
+        for method_name in READ_METHODS:
+            if hasattr(primary, method_name):
+                replica_indexes = [index for (index, replica) in enumerate(self.replicas) if hasattr(replica, method_name)]
+                methods[method_name] = self.__read_method(method_name, replica_indexes)
+        for method_name in WRITE_METHODS:
+            if hasattr(primary, method_name):
+                methods[method_name] = self.__write_method(method_name)
+        supports_projection = all(getattr(service, 'supports_projection', False) for service in [primary] + self.replicas)
+        super(ReplicatedService, self).__init__(return_type=return_type or primary.return_type, middlewares=middlewares,
+                                                hedging_policy=hedging_policy, supports_projection=supports_projection,
+                                                **methods)
+
+    @contextlib.contextmanager
+    def session(self):
+        """
+        Opens a new session on the current thread: writes made before it do not pin its reads to the primary,
+        and its writes do not pin the reads made after it.
+
+        """
+        previous_writes = getattr(self.local, 'writes', None)
+        self.local.writes = {}
+        try:
+            yield self
+        finally:
+            self.local.writes = previous_writes
+
+    def __writes(self):
+        writes = getattr(self.local, 'writes', None)
+        if writes is None:
+            writes = self.local.writes = {}
+        return writes
+
+    def __record_write(self, method_name, endpoint_name, kwargs, response):
+        expires_at = time.time() + self.pin_seconds
+        writes = self.__writes()
+        writes[(endpoint_name, None)] = expires_at
+        if method_name == 'upsert':
+            items = [response[0]]
+        elif method_name == 'upsert_many':
+            items = [item for (item, created) in response]
+        else:
+            items = response_items(response)
+        ids = [field_value(item, 'id') for item in items]
+        ids.extend(record.get('id') for record in [kwargs] + list(kwargs.get('records') or []))
+        for id in ids:
+            if id is not None:
+                writes[(endpoint_name, str(id))] = expires_at
+
+    def __is_pinned(self, endpoint_name, kwargs):
+        writes = self.__writes()
+        now = time.time()
+        for key in [key for (key, expires_at) in writes.items() if expires_at <= now]:
+            del writes[key]
+        id = kwargs.get('id')
+        if id is not None and not isinstance(id, (list, tuple, set, dict)):
+            return (endpoint_name, str(id)) in writes
+        return (endpoint_name, None) in writes
+
+    def __least_outstanding_replica(self, replica_indexes):
+        with self.lock:
+            fewest = min(self.outstanding[i] for i in replica_indexes)
+            index = random.choice([i for i in replica_indexes if self.outstanding[i] == fewest])
+            self.outstanding[index] += 1
+        return index
+
+    def __read_method(self, method_name, replica_indexes):
+        def read(**kwargs):
+            if not replica_indexes or self.__is_pinned(kwargs.get('endpoint_name'), kwargs):
+                return getattr(self.primary, method_name)(**kwargs)
+            index = self.__least_outstanding_replica(replica_indexes)
+            try:
+                return getattr(self.replicas[index], method_name)(**kwargs)
+            finally:
+                with self.lock:
+                    self.outstanding[index] -= 1
+        return read
+
+    def __write_method(self, method_name):
+        def write(**kwargs):
+            response = getattr(self.primary, method_name)(**kwargs)
+            self.__record_write(method_name, kwargs.get('endpoint_name'), kwargs, response)
+            return response
+        return write
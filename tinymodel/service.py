@@ -8,17 +8,45 @@ class Service(object):
     """
     ALLOWED_RETURN_TYPES = ['tinymodel', 'foreign_model', 'json']
 
-    def __init__(self, return_type='json', **kwargs):
+    def __init__(self, return_type='json', middlewares=None, hedging_policy=None, supports_projection=False, **kwargs):
         """
         Make use of specific services to query any data storage.
 
         :params str return_type: whether to return json, foreign_model or tinymodel
+        :params list(callable) middlewares: Optional. Wrap every method call, the first middleware being the outermost.
+                                            See tinymodel.middleware for the calling convention and built-in middlewares.
+        :params tinymodel.middleware.HedgingPolicy hedging_policy: Optional. Hedges slow find and sum calls made by the api layer.
+        :params bool supports_projection: Whether find and update accept only=[titles], the list of fields to fetch.
+                                          The api layer only sends it on its own (e.g. to fetch ids) to services that do.
         """
         if return_type not in self.ALLOWED_RETURN_TYPES:
             raise ValidationError('Service "%s" is not a valid return_type, valid options are: %s' % (str(return_type), str(self.ALLOWED_RETURN_TYPES)))
         self.return_type = return_type
+        self.middlewares = list(middlewares or [])
+        self.hedging_policy = hedging_policy
+        self.supports_projection = supports_projection
 
         for key, value in kwargs.items():
             if not hasattr(value, '__call__'):
                 raise ValidationError('"%s" param is not a callable' % str(key))
-            setattr(self, key, value)
+            setattr(self, key, self.wrap(key, value))
+
+    def wrap(self, method_name, method):
+        """
+        Wraps a service method in the middlewares of this service. Without middlewares, the method is returned as is.
+
+        :param str method_name: The name of the method, e.g. 'find'
+        :param callable method: The method
+
+        :rtype callable: The method, called through the middlewares
+        """
+        call = method
+        for middleware in reversed(self.middlewares):
+            call = self.__middleware_call(middleware, method_name, call)
+        return call
+
+    @staticmethod
+    def __middleware_call(middleware, method_name, call):
+        def middleware_call(*args, **kwargs):
+            return middleware(method_name, call, *args, **kwargs)
+        return middleware_call
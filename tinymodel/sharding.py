@@ -0,0 +1,219 @@
+import bisect
+import hashlib
+import heapq
+import json
+import threading
+
+from tinymodel.internals.concurrency import call_all
+from tinymodel.internals.responses import field_value, response_items
+from tinymodel.service import Service
+from tinymodel.utils import ValidationError
+
+
+class HashRing(object):
+
+    """
+    A consistent hash ring. Every node is placed on the ring at several points (replicas), and a key belongs to the node
+    at the first point after the hash of the key. Adding or removing a node only moves the keys between its points
+    and the points before them, i.e. about 1/N of the keys for N nodes.
+
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        """
+        :param list(str) nodes: The names of the nodes
+        :param int replicas: The number of points of every node on the ring. More points spread the keys more evenly.
+
+        """
+        self.replicas = replicas
+        self.points = []
+        self.nodes_by_point = {}
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def hash(key):
+        return long(hashlib.md5(str(key)).hexdigest()[:16], 16)
+
+    def add_node(self, node):
+        for replica in range(self.replicas):
+            point = self.hash('%s:%d' % (node, replica))
+            if point not in self.nodes_by_point:
+                bisect.insort(self.points, point)
+            self.nodes_by_point[point] = node
+
+    def remove_node(self, node):
+        for replica in range(self.replicas):
+            point = self.hash('%s:%d' % (node, replica))
+            if self.nodes_by_point.get(point) == node:
+                del self.nodes_by_point[point]
+                self.points.remove(point)
+
+    def get_node(self, key):
+        """ Returns the name of the node a key belongs to. """
+        if not self.points:
+            raise ValidationError("The hash ring has no nodes")
+        index = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.nodes_by_point[self.points[index]]
+
+
+class _Descending(object):
+
+    """ Inverts the ordering of a value, so that descending sort keys can be merged by heapq. """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return self.value != other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class ShardedService(Service):
+
+    """
+    A Service that partitions records across several child services.
+
+    Calls that name a single record by its shard key (by default the id) go to the shard that owns the key on a
+    consistent hash ring. Other find, sum, update and delete calls are sent to all of the shards in parallel:
+    find results are merged in order_by order with a k-way merge before offset and limit are applied,
+    sum aggregates are added up, and update and delete results are concatenated.
+
+    Creating a record requires its shard key, since it decides where the record is stored.
+
+    """
+
+    def __init__(self, shards, return_type=None, shard_key='id', replicas=100, middlewares=None, hedging_policy=None):
+        """
+        :param dict|list shards: The child services, by shard name. A list is named by position: 'shard-0', 'shard-1', ...
+                                 Shard names decide the placement of keys, so they must be stable.
+        :param str return_type: The return_type of the child services. Defaults to the return_type of the first shard.
+        :param str shard_key: The field records are partitioned by
+        :param int replicas: The number of points of every shard on the hash ring
+
+        """
+        if isinstance(shards, (list, tuple)):
+            shards = dict(('shard-%d' % index, shard) for (index, shard) in enumerate(shards))
+        if not shards:
+            raise ValidationError("ShardedService needs at least one shard")
+        self.shards = {}
+        self.shard_key = shard_key
+        self.ring = HashRing(replicas=replicas)
+        self.lock = threading.Lock()
+        for (name, shard) in sorted(shards.items()):
+            self.add_shard(name, shard)
+        if return_type is None:
+            return_type = self.shards[sorted(self.shards)[0]].return_type
+        supports_projection = all(getattr(shard, 'supports_projection', False) for shard in self.shards.values())
+        super(ShardedService, self).__init__(return_type=return_type, middlewares=middlewares, hedging_policy=hedging_policy,
+                                             supports_projection=supports_projection,
+                                             find=self.__find, create=self.__create, update=self.__update,
+                                             delete=self.__delete, sum=self.__sum)
+
+    def add_shard(self, name, service):
+        """
+        Adds a shard. Only the keys that now belong to it move, about 1/N of them for N shards.
+        Moving the existing records is up to the caller.
+
+        """
+        with self.lock:
+            self.shards[name] = service
+            self.ring.add_node(name)
+            if not getattr(service, 'supports_projection', False):
+                self.supports_projection = False
+
+    def remove_shard(self, name):
+        with self.lock:
+            self.ring.remove_node(name)
+            del self.shards[name]
+
+    def get_shard(self, key):
+        """ Returns the child service that owns a shard key. """
+        return self.shards[self.ring.get_node(key)]
+
+    def __routed_shard(self, kwargs):
+        key = kwargs.get(self.shard_key)
+        if key is None or isinstance(key, (list, tuple, set, dict)):
+            return None
+        return self.get_shard(key)
+
+    def __fan_out(self, method_name, **kwargs):
+        shards = [self.shards[name] for name in sorted(self.shards)]
+        return call_all([self.__shard_call(getattr(shard, method_name), kwargs) for shard in shards])
+
+    @staticmethod
+    def __shard_call(method, kwargs):
+        return lambda: method(**kwargs)
+
+    def __find(self, **kwargs):
+        shard = self.__routed_shard(kwargs)
+        if shard is not None:
+            return shard.find(**kwargs)
+
+        offset = kwargs.get('offset') or 0
+        limit = kwargs.get('limit')
+        order_by = kwargs.get('order_by') or {}
+        shard_kwargs = dict(kwargs)
+        shard_kwargs['offset'] = 0
+        shard_kwargs['limit'] = offset + limit if limit is not None else None
+        responses = [response_items(response) for response in self.__fan_out('find', **shard_kwargs)]
+
+        ordering = [(field_name, direction) for (field_name, direction) in order_by.items() if direction is not None]
+        if ordering:
+            def keyed(index, items):
+                for (position, item) in enumerate(items):
+                    key = tuple(field_value(item, field_name) if direction == 'ascending' else _Descending(field_value(item, field_name))
+                                for (field_name, direction) in ordering)
+                    yield (key, index, position, item)
+            merged = (entry[3] for entry in heapq.merge(*[keyed(index, items) for (index, items) in enumerate(responses)]))
+        else:
+            merged = (item for items in responses for item in items)
+
+        results = []
+        for (position, item) in enumerate(merged):
+            if limit is not None and position >= offset + limit:
+                break
+            if position >= offset:
+                results.append(item)
+        return results
+
+    def __create(self, **kwargs):
+        shard = self.__routed_shard(kwargs)
+        if shard is None:
+            raise ValidationError('ShardedService needs the "%s" of a record to create it' % self.shard_key)
+        return shard.create(**kwargs)
+
+    def __update(self, **kwargs):
+        shard = self.__routed_shard(kwargs)
+        if shard is not None:
+            return shard.update(**kwargs)
+        return [item for response in self.__fan_out('update', **kwargs) for item in response_items(response)]
+
+    def __delete(self, **kwargs):
+        shard = self.__routed_shard(kwargs)
+        if shard is not None:
+            return shard.delete(**kwargs)
+        return [item for response in self.__fan_out('delete', **kwargs) for item in response_items(response)]
+
+    def __sum(self, **kwargs):
+        shard = self.__routed_shard(kwargs)
+        if shard is not None:
+            return shard.sum(**kwargs)
+
+        responses = self.__fan_out('sum', **kwargs)
+        totals = {}
+        for response in responses:
+            aggregates = json.loads(response) if isinstance(response, basestring) else (response or {})
+            for (field_name, value) in aggregates.items():
+                if value is not None:
+                    totals[field_name] = totals.get(field_name, 0) + value
+                else:
+                    totals.setdefault(field_name, None)
+        return json.dumps(totals) if any(isinstance(r, basestring) for r in responses) else totals
@@ -0,0 +1,534 @@
+import contextlib
+import json
+import sqlite3
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+
+from tinymodel.internals.schema import compile_schema
+from tinymodel.service import Service
+from tinymodel.utils import LazyModule, ValidationError
+
+inflection = LazyModule('inflection')
+
+
+# params the api layer sends along with the field values of a find
+EXTRA_PARAMS = ('limit', 'offset', 'order_by', 'fuzzy', 'fuzzy_match_exclude', 'expand_related', 'only')
+AGGREGATE_FUNCTIONS = {'count': 'COUNT', 'sum': 'SUM', 'avg': 'AVG', 'min': 'MIN', 'max': 'MAX'}
+RANGE_OPERATORS = (('gt', '>'), ('gte', '>='), ('lt', '<'), ('lte', '<='))
+COLUMN_TYPES = {
+    'integer': 'INTEGER',
+    'real': 'REAL',
+    'text': 'TEXT',
+    'bool': 'INTEGER',
+    'datetime': 'TEXT',
+    # decimals are stored as exact text, compared and sorted numerically with the decimal collation
+    'decimal': 'TEXT COLLATE decimal',
+    'json': 'TEXT',
+    'value': '',
+}
+SCALAR_KINDS = (
+    (bool, 'bool'),
+    (int, 'integer'),
+    (long, 'integer'),
+    (float, 'real'),
+    (Decimal, 'decimal'),
+    (str, 'text'),
+    (unicode, 'text'),
+    (datetime, 'datetime'),
+    (date, 'datetime'),
+)
+
+
+def _column_kind(field_def):
+    """ Returns how the values of a field are stored: as one of the keys of COLUMN_TYPES. """
+    if field_def.relationship == 'has_many':
+        return 'json'
+    if field_def.relationship == 'has_one':
+        return 'value'
+    kinds = set()
+    for allowed_type in field_def.allowed_types:
+        if isinstance(allowed_type, (list, tuple, set, dict)) or allowed_type in (list, tuple, set, dict):
+            return 'json'
+        kinds.add(next((kind for (scalar_type, kind) in SCALAR_KINDS if allowed_type is scalar_type), 'value'))
+    if kinds == set(['integer', 'real']):
+        return 'real'
+    return kinds.pop() if len(kinds) == 1 else 'value'
+
+
+def _to_json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return unicode(value)
+
+
+def _encode(kind, value):
+    """ Returns the SQLite representation of a field value. """
+    if value is None:
+        return None
+    if kind == 'json':
+        return json.dumps(value, default=_to_json_default)
+    if kind == 'decimal' and isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return unicode(value)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, datetime):
+        # aware datetimes are stored in UTC, so that their ISO strings sort chronologically
+        if value.utcoffset() is not None:
+            return (value.replace(tzinfo=None) - value.utcoffset()).isoformat() + '+00:00'
+        return value.isoformat()
+    if isinstance(value, (date, Decimal)):
+        return unicode(value)
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    if isinstance(value, (int, long, float, unicode)):
+        return value
+    return unicode(value)
+
+
+def _compare_decimals(a, b):
+    """ The decimal collation: compares decimals stored as text by their values. """
+    return cmp(Decimal(a), Decimal(b))
+
+
+def _decode(kind, value):
+    """ Returns the JSON value of a column value. """
+    if value is None:
+        return None
+    if kind == 'json':
+        return json.loads(value)
+    if kind == 'bool':
+        return bool(value)
+    return value
+
+
+class _DecimalAggregate(object):
+
+    """ An SQLite aggregate function over decimals stored as text, computed exactly with Decimal. """
+
+    operation = None
+
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(Decimal(value))
+
+    def finalize(self):
+        if not self.values:
+            return None
+        if self.operation == 'sum':
+            return unicode(sum(self.values))
+        if self.operation == 'avg':
+            return unicode(sum(self.values) / len(self.values))
+        return unicode(min(self.values) if self.operation == 'min' else max(self.values))
+
+
+DECIMAL_AGGREGATES = dict((operation, type('_Decimal%sAggregate' % operation.capitalize(), (_DecimalAggregate,), {'operation': operation}))
+                          for operation in ('sum', 'avg', 'min', 'max'))
+
+
+class _Table(object):
+
+    """ The SQLite table of a TinyModel class, with a column for every field that is not calculated. """
+
+    def __init__(self, name, cls):
+        self.name = name
+        self.cls = cls
+        self.kinds = {}
+        self.columns = []
+        for field_def in compile_schema(cls).field_defs:
+            if not field_def.calculated:
+                self.columns.append(field_def.title)
+                self.kinds[field_def.title] = _column_kind(field_def)
+        if 'id' not in self.kinds:
+            self.columns.insert(0, 'id')
+            self.kinds['id'] = 'integer'
+        self.integer_ids = self.kinds['id'] == 'integer'
+
+    def create_statement(self):
+        definitions = []
+        for column in self.columns:
+            definition = ('"%s" %s' % (column, COLUMN_TYPES[self.kinds[column]])).strip()
+            if column == 'id':
+                definition += ' PRIMARY KEY'
+            definitions.append(definition)
+        return 'CREATE TABLE IF NOT EXISTS "%s" (%s)' % (self.name, ', '.join(definitions))
+
+    def column(self, name):
+        if name not in self.kinds:
+            raise ValidationError('Table "%s" has no column "%s"' % (self.name, name))
+        return name
+
+    def document(self, row):
+        """ Returns the JSON document of a row, given as a sequence of (column, value). NULL columns are left out. """
+        return json.dumps(dict((column, _decode(self.kinds[column], value)) for (column, value) in row if value is not None))
+
+
+class SqliteService(Service):
+
+    """
+    A Service that stores records in SQLite, in one table per TinyModel class, with a column for every field
+    that is not calculated. Lists, dicts and has_many ids are stored as JSON text,
+    and datetimes as ISO strings (in UTC when they have a timezone), so that they sort chronologically.
+
+    Queries are parameterized SQL: field values and lt/lte/gt/gte lookup dicts become WHERE clauses, order_by, limit
+    and offset are applied by SQLite, fuzzy fields match with LIKE (every word of the value, except the words in
+    fuzzy_match_exclude), and sum, aggregate, count and exists are computed in the database.
+    The SQL of every query shape (the fields, operators, ordering and paging of a query, without their values)
+    is built once and cached, so that SQLite reuses its prepared statement.
+
+    Decimals are stored as text, so that they are exact, with a collation that compares them as numbers in WHERE clauses,
+    ORDER BY and indexes, and aggregate functions that compute their sums and averages exactly.
+
+    Calls on a database file take a connection from a pool of at most max_connections, and give it back when they
+    return, so that short-lived threads do not leave connections (and their file descriptors) behind. When all of
+    the connections are busy, calls wait for one. An in-memory database (':memory:') only exists for one connection,
+    so its connection is shared, and calls are serialized. Writes run in transactions, and
+    create_many inserts all of its records with executemany in a single transaction. upsert_many looks up and writes
+    all of its records in a single transaction.
+
+    """
+
+    def __init__(self, path, models, indexes=None, middlewares=None, hedging_policy=None, max_connections=8):
+        """
+        :param str path: The path of the database file, or ':memory:'
+        :param list|dict models: The TinyModel classes to store, each in the table of its default endpoint name,
+                                 or a dict of classes by endpoint name.
+        :param dict indexes: Optional. The fields to index, by endpoint name, e.g. {'my_model': ['name', 'created_at']}
+        :param int max_connections: The maximum number of open connections to a database file
+        """
+        if isinstance(models, (list, tuple)):
+            models = dict((inflection.underscore(cls.__name__), cls) for cls in models)
+        self.path = path
+        self.tables = dict((name, _Table(name, cls)) for (name, cls) in models.items())
+        self.statements = {}
+        self.local = threading.local()
+        self.lock = threading.RLock()
+        self.released = threading.Condition(self.lock)
+        self.max_connections = max_connections
+        # every open connection, and the ones that are not in use
+        self.connections = []
+        self.idle_connections = []
+        self.shared_connection = None
+        if path == ':memory:':
+            self.shared_connection = self.__connect()
+
+        with self.__connection() as connection:
+            for table in self.tables.values():
+                connection.execute(table.create_statement())
+                for field_name in (indexes or {}).get(table.name, []):
+                    connection.execute('CREATE INDEX IF NOT EXISTS "%s_%s" ON "%s" ("%s")' %
+                                       (table.name, field_name, table.name, table.column(field_name)))
+
+        super(SqliteService, self).__init__(return_type='json', middlewares=middlewares, hedging_policy=hedging_policy,
+                                            supports_projection=True,
+                                            find=self.__find, create=self.__create, create_many=self.__create_many,
+                                            update=self.__update, delete=self.__delete,
+                                            get_or_create=self.__get_or_create, sum=self.__sum, aggregate=self.__aggregate,
+                                            count=self.__count, exists=self.__exists,
+                                            upsert=self.__upsert, upsert_many=self.__upsert_many)
+
+    def __connect(self):
+        # connections are only used by one thread at a time (or under the lock), but they move between threads
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                     cached_statements=256)
+        if self.path != ':memory:':
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+        connection.create_collation('decimal', _compare_decimals)
+        for (operation, aggregate) in DECIMAL_AGGREGATES.items():
+            connection.create_aggregate('decimal_' + operation, 1, aggregate)
+        with self.lock:
+            self.connections.append(connection)
+        return connection
+
+    @contextlib.contextmanager
+    def __connection(self):
+        """ Yields the connection of the current thread, or the shared connection of an in-memory database. """
+        if self.shared_connection is not None:
+            with self.lock:
+                yield self.shared_connection
+            return
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            # nested in a call of the same thread, e.g. in a transaction
+            yield connection
+            return
+        with self.lock:
+            while not self.idle_connections and len(self.connections) >= self.max_connections:
+                self.released.wait()
+            connection = self.idle_connections.pop() if self.idle_connections else self.__connect()
+        self.local.connection = connection
+        try:
+            yield connection
+        finally:
+            self.local.connection = None
+            with self.lock:
+                if connection in self.connections:
+                    self.idle_connections.append(connection)
+                    self.released.notify()
+                else:
+                    # the service was closed in the meantime
+                    connection.close()
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        with self.__connection() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def close(self):
+        """ Closes the idle connections, and the busy ones once they are given back. """
+        with self.lock:
+            for connection in self.idle_connections + ([self.shared_connection] if self.shared_connection is not None else []):
+                connection.close()
+            del self.connections[:]
+            del self.idle_connections[:]
+            self.shared_connection = None
+            self.released.notify_all()
+        self.local = threading.local()
+
+    def __table(self, endpoint_name):
+        table = self.tables.get(endpoint_name)
+        if table is None:
+            raise ValidationError('SqliteService has no table for endpoint "%s"' % endpoint_name)
+        return table
+
+    def __statement(self, shape, build):
+        """ Returns the SQL of a query shape, building it on first use. """
+        statement = self.statements.get(shape)
+        if statement is None:
+            statement = self.statements[shape] = build()
+        return statement
+
+    def __where(self, table, kwargs):
+        """
+        Returns the shape and the params of the WHERE clause of a query.
+        Every condition of the shape is a (column, operator) pair, where the operator is a SQL comparison, 'is null',
+        or the number of words of a fuzzy match.
+
+        """
+        fuzzy_fields = kwargs.get('fuzzy') or []
+        excluded_words = set(word.lower() for word in (kwargs.get('fuzzy_match_exclude') or []))
+        conditions = []
+        params = []
+        for (field_name, value) in sorted(kwargs.items()):
+            if field_name in EXTRA_PARAMS:
+                continue
+            column = table.column(field_name)
+            kind = table.kinds[column]
+            if field_name in fuzzy_fields and value is not None:
+                words = [word for word in unicode(value).lower().split() if word not in excluded_words]
+                conditions.append((column, len(words)))
+                params.extend('%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%' for word in words)
+            elif isinstance(value, dict) and value and set(value) <= set(lookup for (lookup, operator) in RANGE_OPERATORS):
+                for (lookup, operator) in RANGE_OPERATORS:
+                    if lookup in value:
+                        conditions.append((column, operator))
+                        params.append(_encode(kind, value[lookup]))
+            elif value is None:
+                conditions.append((column, 'is null'))
+            else:
+                conditions.append((column, '='))
+                params.append(_encode(kind, value))
+        return tuple(conditions), params
+
+    @staticmethod
+    def __where_sql(conditions):
+        clauses = []
+        for (column, operator) in conditions:
+            if operator == 'is null':
+                clauses.append('"%s" IS NULL' % column)
+            elif isinstance(operator, int):
+                clauses.extend(['"%s" LIKE ? ESCAPE \'\\\'' % column] * operator)
+            else:
+                clauses.append('"%s" %s ?' % (column, operator))
+        return ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+
+    def __select(self, connection, table, kwargs, columns=None):
+        """ Runs the SELECT of a find, and returns its rows as lists of (column, value). """
+        conditions, params = self.__where(table, kwargs)
+        columns = tuple(table.column(column) for column in (columns or table.columns))
+        ordering = tuple((table.column(field_name), direction) for (field_name, direction) in sorted((kwargs.get('order_by') or {}).items())
+                         if direction is not None)
+        limit, offset = kwargs.get('limit'), kwargs.get('offset')
+
+        def build():
+            statement = 'SELECT %s FROM "%s"' % (', '.join('"%s"' % column for column in columns), table.name)
+            statement += self.__where_sql(conditions)
+            if ordering:
+                statement += ' ORDER BY ' + ', '.join('"%s" %s' % (column, 'DESC' if direction == 'descending' else 'ASC')
+                                                      for (column, direction) in ordering)
+            if limit is not None or offset:
+                statement += ' LIMIT ? OFFSET ?'
+            return statement
+
+        statement = self.__statement(('select', table.name, columns, conditions, ordering, limit is not None or bool(offset)), build)
+        if limit is not None or offset:
+            params = params + [limit if limit is not None else -1, offset or 0]
+        return [zip(columns, row) for row in connection.execute(statement, params)]
+
+    def __find(self, endpoint_name, **kwargs):
+        table = self.__table(endpoint_name)
+        with self.__connection() as connection:
+            return [table.document(row) for row in self.__select(connection, table, kwargs, kwargs.get('only'))]
+
+    def __insert(self, connection, table, records):
+        """ Inserts records with executemany, one statement per set of columns, and returns their documents. """
+        if table.integer_ids and any(record.get('id') is None for record in records):
+            next_id = (connection.execute('SELECT MAX("id") FROM "%s"' % table.name).fetchone()[0] or 0) + 1
+        rows = []
+        for record in records:
+            row = dict((table.column(column), value) for (column, value) in record.items() if column not in EXTRA_PARAMS)
+            if row.get('id') is None and table.integer_ids:
+                row['id'] = next_id
+                next_id += 1
+            rows.append(row)
+
+        batches = {}
+        for row in rows:
+            batches.setdefault(tuple(sorted(row)), []).append(row)
+        for (columns, batch) in batches.items():
+            statement = self.__statement(('insert', table.name, columns), lambda: 'INSERT INTO "%s" (%s) VALUES (%s)' % (
+                table.name, ', '.join('"%s"' % column for column in columns), ', '.join('?' * len(columns))))
+            try:
+                connection.executemany(statement, [[_encode(table.kinds[column], row[column]) for column in columns] for row in batch])
+            except sqlite3.IntegrityError as e:
+                raise ValidationError('Could not create records on endpoint "%s": %s' % (table.name, e))
+        return [table.document((column, _encode(table.kinds[column], row.get(column))) for column in table.columns) for row in rows]
+
+    def __create(self, endpoint_name, **kwargs):
+        return self.__create_many(endpoint_name, [kwargs])[0]
+
+    def __create_many(self, endpoint_name, records):
+        table = self.__table(endpoint_name)
+        with self.__transaction() as connection:
+            return self.__insert(connection, table, records)
+
+    def __update(self, endpoint_name, **kwargs):
+        table = self.__table(endpoint_name)
+        if kwargs.get('id') is None:
+            raise ValidationError('SqliteService needs the id of the record to update on endpoint "%s"' % endpoint_name)
+        with self.__transaction() as connection:
+            self.__update_row(connection, table, _encode(table.kinds['id'], kwargs['id']), kwargs)
+            return [table.document(row) for row in self.__select(connection, table, {'id': kwargs['id']})]
+
+    def __update_row(self, connection, table, id, values):
+        """ Sets the given values, except the id, on the row with the given (encoded) id. """
+        columns = tuple(sorted(table.column(column) for column in values if column not in EXTRA_PARAMS and column != 'id'))
+        if columns:
+            statement = self.__statement(('update', table.name, columns), lambda: 'UPDATE "%s" SET %s WHERE "id" = ?' % (
+                table.name, ', '.join('"%s" = ?' % column for column in columns)))
+            connection.execute(statement, [_encode(table.kinds[column], values[column]) for column in columns] + [id])
+
+    def __delete(self, endpoint_name, **kwargs):
+        table = self.__table(endpoint_name)
+        conditions, params = self.__where(table, kwargs)
+        with self.__transaction() as connection:
+            deleted = [table.document(row) for row in self.__select(connection, table, kwargs)]
+            statement = self.__statement(('delete', table.name, conditions),
+                                         lambda: 'DELETE FROM "%s"' % table.name + self.__where_sql(conditions))
+            connection.execute(statement, params)
+            return deleted
+
+    def __get_or_create(self, endpoint_name, **kwargs):
+        """ Returns the (document, created) pair for the first record matching kwargs, creating it if there is none. """
+        table = self.__table(endpoint_name)
+        with self.__transaction() as connection:
+            found = self.__select(connection, table, dict(kwargs, limit=1))
+            if found:
+                return table.document(found[0]), False
+            return self.__insert(connection, table, [kwargs])[0], True
+
+    def __upsert_in_transaction(self, connection, table, by, update, kwargs):
+        values = dict((key, value) for (key, value) in kwargs.items() if key not in EXTRA_PARAMS)
+        found = self.__select(connection, table, dict([(key, value) for (key, value) in values.items() if key in by], limit=1),
+                              columns=['id'])
+        if not found:
+            return self.__insert(connection, table, [values])[0], True
+        id = found[0][0][1]
+        if update:
+            self.__update_row(connection, table, id, values)
+        return table.document(self.__select(connection, table, {'id': id})[0]), False
+
+    def __upsert(self, endpoint_name, by, update=True, **kwargs):
+        """ Returns the (document, created) pair of the record matching the by fields, updated, or created if there is none. """
+        table = self.__table(endpoint_name)
+        with self.__transaction() as connection:
+            return self.__upsert_in_transaction(connection, table, by, update, kwargs)
+
+    def __upsert_many(self, endpoint_name, by, records):
+        table = self.__table(endpoint_name)
+        with self.__transaction() as connection:
+            return [self.__upsert_in_transaction(connection, table, by, True, record) for record in records]
+
+    def __sum(self, endpoint_name, return_fields, **kwargs):
+        table = self.__table(endpoint_name)
+        conditions, params = self.__where(table, kwargs)
+        columns = tuple(table.column(field_name) for field_name in return_fields)
+        # decimals are summed exactly, and returned as text like their values
+        statement = self.__statement(('sum', table.name, columns, conditions), lambda: 'SELECT %s FROM "%s"' % (', '.join(
+            ("COALESCE(decimal_sum(\"%s\"), '0')" if table.kinds[column] == 'decimal' else 'COALESCE(SUM("%s"), 0)') % column
+            for column in columns), table.name) + self.__where_sql(conditions))
+        with self.__connection() as connection:
+            totals = connection.execute(statement, params).fetchone()
+        return json.dumps(dict(zip(return_fields, totals)))
+
+    def __count(self, endpoint_name, **kwargs):
+        table = self.__table(endpoint_name)
+        conditions, params = self.__where(table, kwargs)
+        statement = self.__statement(('count', table.name, conditions),
+                                     lambda: 'SELECT COUNT(*) FROM "%s"' % table.name + self.__where_sql(conditions))
+        with self.__connection() as connection:
+            return connection.execute(statement, params).fetchone()[0]
+
+    def __exists(self, endpoint_name, **kwargs):
+        table = self.__table(endpoint_name)
+        conditions, params = self.__where(table, kwargs)
+        statement = self.__statement(('exists', table.name, conditions),
+                                     lambda: 'SELECT 1 FROM "%s"' % table.name + self.__where_sql(conditions) + ' LIMIT 1')
+        with self.__connection() as connection:
+            return connection.execute(statement, params).fetchone() is not None
+
+    def __aggregate(self, endpoint_name, group_by, metrics, **kwargs):
+        """ Runs an aggregation with GROUP BY, and returns its rows as dicts. """
+        table = self.__table(endpoint_name)
+        conditions, params = self.__where(table, kwargs)
+        group_by = tuple(table.column(field_name) for field_name in group_by)
+        metrics = tuple(sorted((table.column(field_name), operation) for (field_name, operation) in metrics.items()))
+
+        def build():
+            expressions = ['"%s"' % column for column in group_by]
+            for (column, operation) in metrics:
+                # decimals are stored as text, which the built-in functions would sum as floats
+                if table.kinds[column] == 'decimal' and operation != 'count':
+                    expressions.append('decimal_%s("%s")' % (operation, column))
+                else:
+                    expressions.append('%s("%s")' % (AGGREGATE_FUNCTIONS[operation], column))
+            statement = 'SELECT %s FROM "%s"' % (', '.join(expressions), table.name) + self.__where_sql(conditions)
+            if group_by:
+                columns = ', '.join('"%s"' % column for column in group_by)
+                statement += ' GROUP BY %s ORDER BY %s' % (columns, columns)
+            return statement
+
+        statement = self.__statement(('aggregate', table.name, group_by, metrics, conditions), build)
+        with self.__connection() as connection:
+            rows = connection.execute(statement, params).fetchall()
+        results = []
+        for row in rows:
+            result = dict((column, _decode(table.kinds[column], value)) for (column, value) in zip(group_by, row))
+            for ((column, operation), value) in zip(metrics, row[len(group_by):]):
+                if table.kinds[column] == 'decimal' and operation != 'count' and value is not None:
+                    value = Decimal(value)
+                elif table.kinds[column] == 'bool' and operation in ('min', 'max') and value is not None:
+                    value = bool(value)
+                result[column] = value
+            results.append(result)
+        return results
@@ -1,6 +1,45 @@
+from importlib import import_module
+
+
 class ModelException(Exception):
     pass
 
 
 class ValidationError(Exception):
     pass
+
+
+class UnloadedFieldError(ModelException, AttributeError):
+    pass
+
+
+class ServiceTimeoutError(ModelException):
+    pass
+
+
+class BufferFullError(ModelException):
+    pass
+
+
+class LazyModule(object):
+
+    """
+    Stands in for a module that is only imported when one of its attributes is first accessed.
+    Once imported, the attributes of the module are copied onto the proxy, so later lookups cost the same as on the module itself.
+
+    """
+
+    def __init__(self, module_name):
+        """
+        :param str module_name: The absolute name of the module, e.g. 'dateutil.parser'
+
+        """
+        self.__dict__['_LazyModule__module_name'] = module_name
+
+    def __getattr__(self, name):
+        module = import_module(self.__module_name)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+    def __repr__(self):
+        return "<tinymodel.utils.LazyModule '%s'>" % self.__module_name
@@ -0,0 +1,243 @@
+import json
+import sys
+import threading
+import time
+
+from tinymodel.internals.api import normalize_params
+from tinymodel.internals.concurrency import Call
+from tinymodel.utils import BufferFullError, LazyModule
+
+inflection = LazyModule('inflection')
+
+
+class BufferedWriter(object):
+
+    """
+    Buffers create and update calls, and writes them to a service in batches.
+
+    Every call is validated when it is buffered, with the same normalization as the api methods, so invalid
+    records are rejected at the call site. A background thread flushes the buffer when it holds max_count records,
+    or max_bytes of (JSON-encoded) params, or when its oldest record has waited max_delay seconds.
+    Creates are sent with the <create_many(endpoint_name, records)> method of the service if it has one,
+    and as concurrent create calls otherwise. Updates are sent as concurrent update calls.
+    The calls on a record are written in the order they were buffered: consecutive updates of the same id are merged
+    into one update (later values win), and a call that depends on an earlier call of the batch (e.g. an update
+    of a record created in the same batch, or an update without an id) waits until that call is written.
+
+    When the buffer holds max_buffered records, create and update block until a flush makes room
+    (or raise BufferFullError after block_timeout). Call flush() or close(), or use the writer as a context manager,
+    to write out the buffered records before shutting down. Without on_error, they also raise the first failure
+    of the background flushes since the last call, so that failed writes are never silently lost.
+
+        with BufferedWriter(MyModel, service) as writer:
+            for event in events:
+                writer.create(**event)
+
+    """
+
+    def __init__(self, cls, service, endpoint_name=None, max_count=100, max_bytes=1024 * 1024, max_delay=1.0,
+                 max_buffered=10000, concurrency=8, block_timeout=None, on_error=None):
+        """
+        :param tinymodel.TinyModel cls: The class of the records
+        :param tinymodel.service.Service service: The service to write to
+        :param str endpoint_name: The name of the endpoint. Defaults to the one the api methods use.
+        :param int max_count: The number of buffered records that triggers a flush, and the maximum size of a batch
+        :param int max_bytes: The size of the buffered params (JSON-encoded) that triggers a flush
+        :param float max_delay: The maximum time a record waits in the buffer, in seconds
+        :param int max_buffered: The maximum number of buffered records
+        :param int concurrency: The maximum number of concurrent calls when the service has no bulk method
+        :param float block_timeout: How long create and update wait for room in a full buffer. None waits forever.
+        :param callable on_error: Optional. Called with the exception and the (method_name, params) calls that were
+                                  not written when a flush fails. The calls of a batch are written in waves, and
+                                  the waves written before the failure are left out, so that the calls can be retried.
+                                  Failures are also kept in errors.
+
+        """
+        self.cls = cls
+        self.service = service
+        self.endpoint_name = endpoint_name or inflection.underscore(cls.__name__)
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.max_buffered = max_buffered
+        self.concurrency = concurrency
+        self.block_timeout = block_timeout
+        self.on_error = on_error
+        self.errors = []
+        # the failures of background flushes that flush() or close() has not raised yet
+        self.unreported_errors = []
+
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.oldest_at = None
+        self.in_flight = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def create(self, **kwargs):
+        """ Validates and buffers a create. """
+        self.__put('create', normalize_params(self.cls, True, **kwargs))
+
+    def update(self, **kwargs):
+        """ Validates and buffers an update. """
+        self.__put('update', normalize_params(self.cls, False, **kwargs))
+
+    def __put(self, method_name, params):
+        size = len(json.dumps(params, default=unicode))
+        with self.condition:
+            if self.closed:
+                raise BufferFullError("BufferedWriter for " + self.endpoint_name + " is closed")
+            deadline = time.time() + self.block_timeout if self.block_timeout is not None else None
+            while len(self.buffer) + self.in_flight >= self.max_buffered:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise BufferFullError("BufferedWriter for " + self.endpoint_name + " is full (" + str(self.max_buffered) + " records)")
+                self.condition.notify_all()
+                self.condition.wait(remaining)
+            if not self.buffer:
+                self.oldest_at = time.time()
+            self.buffer.append((method_name, params, size))
+            self.buffered_bytes += size
+            if len(self.buffer) >= self.max_count or self.buffered_bytes >= self.max_bytes:
+                self.condition.notify_all()
+
+    def __take_batch(self):
+        """ Takes the next batch out of the buffer. Must be called with the condition held. """
+        batch = self.buffer[:self.max_count]
+        del self.buffer[:self.max_count]
+        self.in_flight += len(batch)
+        self.buffered_bytes -= sum(size for (method_name, params, size) in batch)
+        self.oldest_at = time.time() if self.buffer else None
+        return [(method_name, params) for (method_name, params, size) in batch]
+
+    def __is_due(self):
+        return self.buffer and (len(self.buffer) >= min(self.max_count, self.max_buffered) or self.buffered_bytes >= self.max_bytes or
+                                time.time() - self.oldest_at >= self.max_delay)
+
+    def __run(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self.__is_due():
+                    timeout = self.max_delay - (time.time() - self.oldest_at) if self.buffer else self.max_delay
+                    self.condition.wait(max(timeout, 0.001))
+                if self.closed:
+                    return
+            try:
+                self.__flush_batches(force=False)
+            except Exception as e:
+                # already recorded in errors, and passed to on_error if there is one
+                if self.on_error is None:
+                    with self.condition:
+                        self.unreported_errors.append(e)
+
+    @staticmethod
+    def __waves(batch):
+        """
+        Splits a batch into waves of creates and updates that can be written concurrently, in order.
+        An update is merged into the update of the same id in the current wave. Any other call on an id of the current
+        wave starts a new wave, and updates without an id, which can match any record, are written in a wave of their own.
+
+        :rtype list(tuple): The params of the creates and of the updates of every wave
+        """
+        waves = []
+        ids = None
+        for (method_name, params) in batch:
+            id = params.get('id')
+            if method_name == 'update' and id is None:
+                waves.append(([], [params]))
+                ids = None
+                continue
+            if ids is not None and id is not None and id in ids:
+                (previous_method_name, previous_params) = ids[id]
+                if method_name == 'update' and previous_method_name == 'update':
+                    previous_params.update(params)
+                    continue
+                ids = None
+            if ids is None:
+                waves.append(([], []))
+                ids = {}
+            params = dict(params)
+            waves[-1][0 if method_name == 'create' else 1].append(params)
+            if id is not None:
+                ids[id] = (method_name, params)
+        return waves
+
+    def __write_batch(self, batch):
+        """
+        Writes a batch, wave by wave. The calls of a wave are all attempted, and a failed wave stops the batch.
+
+        :rtype tuple: The exc_info of the first failure and the (method_name, params) calls that were not written,
+                      or (None, []) if the whole batch was written
+        """
+        waves = self.__waves(batch)
+        for (index, (creates, updates)) in enumerate(waves):
+            (exc_info, failed) = (None, [])
+            calls = [('update', params) for params in updates]
+            if creates and hasattr(self.service, 'create_many'):
+                try:
+                    self.service.create_many(endpoint_name=self.endpoint_name, records=creates)
+                except Exception:
+                    (exc_info, failed) = (sys.exc_info(), [('create', params) for params in creates])
+            else:
+                calls = [('create', params) for params in creates] + calls
+            for start in range(0, len(calls), self.concurrency):
+                running = [(call, Call(getattr(self.service, call[0]), kwargs=dict(call[1], endpoint_name=self.endpoint_name)))
+                           for call in calls[start:start + self.concurrency]]
+                for (call, running_call) in running:
+                    running_call.wait()
+                    if running_call.exc_info is not None:
+                        exc_info = exc_info or running_call.exc_info
+                        failed.append(call)
+            if exc_info is not None:
+                for (creates, updates) in waves[index + 1:]:
+                    failed.extend([('create', params) for params in creates] + [('update', params) for params in updates])
+                return exc_info, failed
+        return None, []
+
+    def __flush_batches(self, force):
+        with self.flush_lock:
+            while True:
+                with self.condition:
+                    if not self.buffer or not (force or self.__is_due()):
+                        return
+                    batch = self.__take_batch()
+                try:
+                    (exc_info, failed) = self.__write_batch(batch)
+                finally:
+                    with self.condition:
+                        self.in_flight -= len(batch)
+                        self.condition.notify_all()
+                if exc_info is not None:
+                    self.errors.append((exc_info[1], failed))
+                    if self.on_error is not None:
+                        self.on_error(exc_info[1], failed)
+                    raise exc_info[0], exc_info[1], exc_info[2]
+
+    def flush(self):
+        """
+        Writes out every buffered record, in the calling thread. Exceptions of the writes are raised, and so is
+        the first failure of the background flushes that was not raised yet, if there is no on_error.
+        """
+        self.__flush_batches(force=True)
+        with self.condition:
+            (unreported_errors, self.unreported_errors) = (self.unreported_errors, [])
+        if unreported_errors:
+            raise unreported_errors[0]
+
+    def close(self):
+        """ Stops the background thread and writes out the buffered records. Raises like flush(). """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.flush()